@@ -1,13 +1,16 @@
 import json
+import sys
 from pathlib import Path
-from openai import OpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "search-engine"))
+from rag.llm import chat_completion, make_client
 
 # ==============================
 # CẤU HÌNH
 # ==============================
 
 MODEL_NAME = "gpt-4.1-mini"
-client = OpenAI(api_key="...")
+client = make_client(api_key="...")
 
 JSON_PATH = Path("sections_nam_benh_vn.json")
 OUT_CSV_PATH = Path("sections_nam_benh_vn_chunks.csv")
@@ -68,7 +71,9 @@ Hãy sinh dữ liệu CSV đúng yêu cầu.
 """
 
 def call_model_for_text(raw: str) -> str:
-    resp = client.chat.completions.create(
+    resp = chat_completion(
+        client,
+        site="enrich_csv",
         model=MODEL_NAME,
         messages=[
             {"role": "system", "content": system_prompt},
@@ -1,5 +1,8 @@
+import sys
 from pathlib import Path
-from openai import OpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "search-engine"))
+from rag.llm import chat_completion, make_client
 
 # ==============================
 # CẤU HÌNH
@@ -9,7 +12,7 @@ MODEL_NAME = "gpt-4.1-mini"  # hoặc model bạn đang dùng
 
 # Khuyến nghị set OPENAI_API_KEY trong biến môi trường:
 # export OPENAI_API_KEY="sk-xxxx"
-client = OpenAI(api_key="...")
+client = make_client(api_key="...")
 
 # ==============================
 # ĐOẠN SOP THÔ – BẠN THAY BẰNG TEXT CỦA BẠN
@@ -69,7 +72,9 @@ Hãy sinh dữ liệu CSV đúng yêu cầu.
 def call_model(raw: str) -> str:
     prompt = build_prompt(raw)
 
-    response = client.chat.completions.create(
+    response = chat_completion(
+        client,
+        site="enrich_text",
         model=MODEL_NAME,
         messages=[
             {"role": "system", "content": system_prompt},
@@ -19,8 +19,8 @@ try:
 except Exception:
     tqdm = None
 
-import urllib.request
-import urllib.error
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "search-engine"))
+from rag.llm import make_client, responses_create  # noqa: E402
 
 
 # ======================
@@ -248,19 +248,16 @@ def enforce_entity_rules(tags: List[str], entity_type: str) -> List[str]:
 
 
 # ======================
-# OpenAI call (via HTTPS)
+# OpenAI call (qua gateway rag/llm.py: pool kết nối, rate limit, retry + backoff, timeout)
 # ======================
 
 @dataclass
 class OpenAIConfig:
     api_key: str
     model: str = "gpt-4.1-mini"
-    timeout_sec: int = 60
-    max_retries: int = 3
-    base_url: str = "https://api.openai.com/v1/responses"
 
 
-def call_openai_tags(cfg: OpenAIConfig, content: str, max_tags: int, entity_type: str = "") -> List[str]:
+def call_openai_tags(client, cfg: OpenAIConfig, content: str, max_tags: int, entity_type: str = "") -> List[str]:
     system = (
         "You are a strict tagging engine for a RAG system. "
         "Generate compact, canonical tags used for metadata filtering and reranking. "
@@ -294,52 +291,17 @@ Content:
 {content}
 """.strip()
 
-    payload = {
-        "model": cfg.model,
-        "input": [
+    resp = responses_create(
+        client,
+        site="auto_tag",
+        model=cfg.model,
+        input=[
             {"role": "system", "content": [{"type": "input_text", "text": system}]},
             {"role": "user",   "content": [{"type": "input_text", "text": user}]},
         ],
-        "temperature": 0,
-    }
-
-    data = json.dumps(payload).encode("utf-8")
-    headers = {
-        "Authorization": f"Bearer {cfg.api_key}",
-        "Content-Type": "application/json",
-    }
-
-    last_err = None
-    for attempt in range(cfg.max_retries):
-        try:
-            req = urllib.request.Request(cfg.base_url, data=data, headers=headers, method="POST")
-            with urllib.request.urlopen(req, timeout=cfg.timeout_sec) as resp:
-                raw = resp.read().decode("utf-8")
-
-            obj = json.loads(raw)
-
-            texts = []
-            for item in obj.get("output", []):
-                for c in item.get("content", []):
-                    if c.get("type") == "output_text" and "text" in c:
-                        texts.append(c["text"])
-            out_text = "\n".join(texts).strip()
-
-            return ensure_json_array(out_text)
-
-        except urllib.error.HTTPError as e:
-            try:
-                err_body = e.read().decode("utf-8", errors="ignore")
-            except Exception:
-                err_body = ""
-            last_err = f"{e} | body={err_body}"
-            time.sleep(1.5 * (attempt + 1))
-
-        except Exception as e:
-            last_err = str(e)
-            time.sleep(1.5 * (attempt + 1))
-
-    raise RuntimeError(f"OpenAI call failed after retries: {last_err}")
+        temperature=0,
+    )
+    return ensure_json_array((resp.output_text or "").strip())
 
 
 # ======================
@@ -462,6 +424,7 @@ def main():
 
     cache = load_cache(cache_path)
     cfg = OpenAIConfig(api_key=api_key, model=args.model)
+    client = make_client(api_key=cfg.api_key)
 
     indices = list(range(start, end + 1))
     iterator = tqdm(indices, desc="Auto-tagging", unit="row") if (tqdm is not None) else indices
@@ -502,7 +465,7 @@ def main():
         if h in cache:
             raw_tags = cache[h]
         else:
-            raw_tags = call_openai_tags(cfg, content=content, max_tags=args.raw_max_tags, entity_type=str(et_value))
+            raw_tags = call_openai_tags(client, cfg, content=content, max_tags=args.raw_max_tags, entity_type=str(et_value))
             cache[h] = raw_tags
             if args.sleep > 0:
                 time.sleep(args.sleep)
@@ -3,12 +3,18 @@
 # =========================================================
 
 import re
+import sys
 import json
 import unicodedata
+from pathlib import Path
 from typing import List
 from collections import defaultdict
+
 from openai import OpenAI
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "search-engine"))
+from rag.llm import make_client, responses_create
+
 # ================== CONFIG ==================
 
 MODEL = "gpt-4.1-mini"
@@ -71,7 +77,9 @@ def call_gpt_batch(client: OpenAI, tags: List[str]):
         }
     }
 
-    resp = client.responses.create(
+    resp = responses_create(
+        client,
+        site="generate_aliases",
         model=MODEL,
         temperature=TEMPERATURE,
         input=[
@@ -95,7 +103,7 @@ def main():
 
     print(f"▶ Loaded {total} tags")
 
-    client = OpenAI(api_key="...")
+    client = make_client(api_key="...")
     grouped = defaultdict(lambda: defaultdict(list))
 
     batch_no = 0
@@ -1,8 +1,8 @@
 import pandas as pd
 import numpy as np
-from openai import OpenAI
 from pathlib import Path
 import re
+import sys
 import json
 
 # ==============================
@@ -10,10 +10,13 @@ import json
 # ==============================
 
 ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "search-engine"))
+from rag.llm import embedding_create, make_client  # noqa: E402
+
 DATA = ROOT / "data/kb-audit/check-backbone/data-kd-1-4-tags-v2-chuan.csv"
 OUT_FILE = "01012026-data-kd-1-4-chuan-fix-brand.npz"
 
-client = OpenAI(api_key="...")
+client = make_client(api_key="...")
 
 # ==============================
 #        LOAD CSV
@@ -115,7 +118,9 @@ for start in range(0, len(inputs), BATCH_SIZE):
 
     print(f"➡ Embedding batch {start} → {end - 1} (số lượng: {len(batch)})")
 
-    resp = client.embeddings.create(
+    resp = embedding_create(
+        client,
+        site="build_vectors_kd",
         model="text-embedding-3-small",
         input=batch,
     )
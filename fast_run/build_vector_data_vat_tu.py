@@ -1,18 +1,21 @@
 import pandas as pd
 import numpy as np
-from openai import OpenAI
 from pathlib import Path
 import re
+import sys
 
 # ==============================
 #        CONFIG
 # ==============================
 
 ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "search-engine"))
+from rag.llm import embedding_create, make_client  # noqa: E402
+
 DATA = ROOT / "data/data-kinh-doanh/data-kinh-doanh_Muc-2-3.csv"  # đổi đúng tên file mới của bạn
 OUT_FILE = "data-kinh-doanh_Muc-2-3.npz"
 
-client = OpenAI(api_key="...")
+client = make_client(api_key="...")
 
 # ==============================
 #        LOAD CSV
@@ -87,7 +90,9 @@ for _, row in df.iterrows():
 #       EMBEDDING
 # ==============================
 
-resp = client.embeddings.create(
+resp = embedding_create(
+    client,
+    site="build_vectors_vt",
     model="text-embedding-3-small",
     input=inputs,
 )
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# ======================
+# FINAL-ANSWER CACHE (2 tầng)
+#   1) Exact   : (normalized query, mode, context doc ids theo thứ tự, KB version)
+#   2) Semantic: cùng mode + KB version + cùng primary_doc, cosine(query) >= threshold
+#      ("thuốc trị rầy nâu" ~ "thuốc nào trị rầy nâu")
+#   - LRU eviction, lưu/đọc từ đĩa (json + npz), đếm hit/miss
+# ======================
+
+_space_re = re.compile(r"\s+")
+
+
+def normalize_cache_query(q: str) -> str:
+    q = (q or "").strip().lower()
+    q = _space_re.sub(" ", q)
+    return q.rstrip(" ?.!")
+
+
+def exact_key(norm_query: str, mode: str, doc_ids: Sequence[str] = (), kb_version: str = "") -> str:
+    raw = "\x1f".join([normalize_cache_query(norm_query), mode, "|".join(map(str, doc_ids)), kb_version])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 2000, semantic_threshold: float = 0.95, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self.path = path
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._vecs: Dict[str, np.ndarray] = {}
+        # (primary_doc, mode, kb_version) -> [key...] : tầng semantic chỉ so trong nhóm này
+        self._by_primary: Dict[tuple, List[str]] = {}
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    # ---------- lookup ----------
+
+    def get(
+        self,
+        key: str,
+        *,
+        query_vec: Optional[np.ndarray] = None,
+        primary_doc: Optional[str] = None,
+        mode: str = "",
+        kb_version: str = "",
+    ):
+        """
+        Return (text, tier) với tier = "exact" | "semantic"; (None, "miss") nếu không có.
+        """
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return e["text"], "exact"
+
+            if query_vec is not None and primary_doc:
+                best_key, best_sim = None, self.semantic_threshold
+                for k in self._by_primary.get((primary_doc, mode, kb_version), []):
+                    sim = float(self._vecs[k] @ query_vec)
+                    if sim >= best_sim:
+                        best_key, best_sim = k, sim
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key]["text"], "semantic"
+
+            self.misses += 1
+            return None, "miss"
+
+    # ---------- insert / evict ----------
+
+    def put(
+        self,
+        key: str,
+        text: str,
+        *,
+        query_vec: Optional[np.ndarray] = None,
+        primary_doc: Optional[str] = None,
+        mode: str = "",
+        kb_version: str = "",
+    ) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {"text": text, "primary_doc": primary_doc or "", "mode": mode, "kb_version": kb_version}
+            if query_vec is not None and primary_doc:
+                self._vecs[key] = np.asarray(query_vec, dtype=np.float32)
+                self._by_primary.setdefault((primary_doc, mode, kb_version), []).append(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        e = self._entries.pop(key)
+        if self._vecs.pop(key, None) is not None:
+            group = (e["primary_doc"], e["mode"], e["kb_version"])
+            keys = self._by_primary.get(group, [])
+            if key in keys:
+                keys.remove(key)
+            if not keys:
+                self._by_primary.pop(group, None)
+
+    # ---------- metrics ----------
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / total if total else 0.0,
+        }
+
+    # ---------- persistence ----------
+
+    def save(self, path: Optional[str] = None) -> None:
+        base = Path(path or self.path)
+        with self._lock:
+            entries = [{"key": k, **e} for k, e in self._entries.items()]
+            vec_keys = [k for k in self._entries if k in self._vecs]
+            vecs = np.stack([self._vecs[k] for k in vec_keys]) if vec_keys else np.zeros((0, 0), dtype=np.float32)
+
+        base.parent.mkdir(parents=True, exist_ok=True)
+        base.with_suffix(".json").write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+        np.savez(base.with_suffix(".npz"), keys=np.array(vec_keys, dtype=str), vecs=vecs)
+
+    def load(self, path: Optional[str] = None) -> "AnswerCache":
+        base = Path(path or self.path)
+        jpath, vpath = base.with_suffix(".json"), base.with_suffix(".npz")
+        if not jpath.exists():
+            return self
+
+        vec_by_key = {}
+        if vpath.exists():
+            data = np.load(vpath, allow_pickle=False)
+            vec_by_key = dict(zip(data["keys"].tolist(), data["vecs"]))
+
+        # giữ thứ tự LRU như lúc lưu (cũ -> mới)
+        for e in json.loads(jpath.read_text(encoding="utf-8")):
+            self.put(
+                e["key"],
+                e["text"],
+                query_vec=vec_by_key.get(e["key"]),
+                primary_doc=e.get("primary_doc") or None,
+                mode=e.get("mode", ""),
+                kb_version=e.get("kb_version", ""),
+            )
+        return self
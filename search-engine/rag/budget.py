@@ -0,0 +1,78 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from rag.debug_log import debug_log
+
+# ======================
+# LATENCY BUDGET (1 request)
+#   - Tạo ở đầu answer_with_suggestions, truyền xuống các stage (keyword budget=...)
+#   - Mỗi stage hỏi remaining_ms() trước khi làm việc tốn thời gian; thiếu thời gian -> degrade:
+#     bỏ LLM router / normalize, giảm top_k, bỏ LLM rerank, chọn DIRECT_DOC,
+#     model nhỏ / không escalate (GLOBAL), giới hạn max tokens
+#   - Các degradation đã dùng ghi vào res["budget"]; câu trả lời đã degrade không ghi answer cache
+# ======================
+
+
+@dataclass
+class LatencyBudget:
+    total_ms: float
+    started: float = field(default_factory=time.perf_counter)
+    degradations: List[str] = field(default_factory=list)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000.0
+
+    def remaining_ms(self) -> float:
+        return self.total_ms - self.elapsed_ms()
+
+    def short_of(self, needed_ms: float) -> bool:
+        """
+        True nếu thời gian còn lại < needed_ms (stage tiếp theo không nên chạy đầy đủ).
+        """
+        return self.remaining_ms() < needed_ms
+
+    def degrade(self, name: str, detail: str = "") -> None:
+        if name not in self.degradations:
+            self.degradations.append(name)
+        debug_log(
+            "=== BUDGET DEGRADE ===",
+            f"{name} {detail}".strip(),
+            f"elapsed_ms={self.elapsed_ms():.0f} remaining_ms={self.remaining_ms():.0f}",
+        )
+
+    def cap_tokens(self, max_tokens: int, tokens_per_s: float, min_tokens: int = 256) -> int:
+        """
+        Trần max_completion_tokens để sinh xong trong thời gian còn lại (ước lượng theo tốc độ sinh).
+        """
+        affordable = int(max(self.remaining_ms(), 0.0) / 1000.0 * tokens_per_s)
+        capped = max(min_tokens, min(max_tokens, affordable))
+        if capped < max_tokens:
+            self.degrade("cap_max_tokens", f"{max_tokens}->{capped}")
+        return capped
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "total_ms": self.total_ms,
+            "elapsed_ms": round(self.elapsed_ms(), 1),
+            "degradations": list(self.degradations),
+        }
+
+
+def make_budget(cfg, budget_ms: Optional[float] = None) -> Optional[LatencyBudget]:
+    """
+    budget_ms > 0 (hoặc cfg.latency_budget_ms > 0) -> LatencyBudget; 0 -> không giới hạn (None).
+    """
+    total = cfg.latency_budget_ms if budget_ms is None else budget_ms
+    return LatencyBudget(total_ms=float(total)) if total and total > 0 else None
+
+
+def short_of(budget: Optional[LatencyBudget], needed_ms: float) -> bool:
+    return budget is not None and budget.short_of(needed_ms)
+
+
+def degraded(budget: Optional[LatencyBudget]) -> bool:
+    """
+    True nếu request này đã dùng ít nhất 1 degradation (câu trả lời không phải bản đầy đủ).
+    """
+    return budget is not None and bool(budget.degradations)
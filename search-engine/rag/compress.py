@@ -0,0 +1,127 @@
+import math
+import re
+from typing import Dict, Iterable, List, Set
+
+from rag.answer_modes import DOSAGE_RE
+from rag.debug_log import debug_log
+from rag.tag_filter import ALIASES_BY_GROUP, GROUP_TAG_PREFIX, _norm
+
+# ======================
+# EXTRACTIVE CONTEXT COMPRESSION (local, không gọi LLM)
+#   - Tách NỘI DUNG mỗi doc thành dòng / câu
+#   - Chấm điểm theo từ khoá của query + alias của các tag đã suy ra (rầy nâu, abamectin...)
+#   - Giữ top dòng (theo tỉ lệ) + MỌI dòng có số liệu liều lượng / thời gian cách ly
+#   - Giữ nguyên thứ tự gốc, chỗ bị lược ghi "…"
+# ======================
+
+PHI_RE = re.compile(r"(cách ly|cach ly|tgcl|\bphi\b)", re.IGNORECASE)
+_sentence_split_re = re.compile(r"(?<=[.!?;])\s+(?=[A-ZÀ-Ỹ0-9(\-•])")
+_word_re = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "la", "gi", "cua", "cho", "va", "co", "khong", "nao", "the", "thi", "sao", "nhu", "duoc",
+    "bao", "nhieu", "voi", "mot", "cac", "nhung", "trong", "tren", "de", "ve", "hay", "hoac",
+    "nen", "dung", "can", "khi", "tu", "den", "o", "a", "oi", "nhe",
+}
+
+# prefix tag -> bảng alias (ngược của GROUP_TAG_PREFIX)
+_ALIASES_BY_PREFIX = {prefix: ALIASES_BY_GROUP[group] for group, prefix in GROUP_TAG_PREFIX.items()}
+
+
+def _terms(text: str) -> Set[str]:
+    return {w for w in _word_re.findall(_norm(text)) if len(w) >= 2 and w not in STOPWORDS}
+
+
+def tag_phrases(tags: Iterable[str]) -> List[str]:
+    """
+    "pest:ray-nau" -> ["ray nau", <các alias đã normalize của ray-nau>]
+    """
+    out = []
+    for t in tags or []:
+        prefix, _, canonical = str(t).partition(":")
+        if not canonical:
+            continue
+        out.append(_norm(canonical.replace("-", " ")))
+        out.extend(_norm(a) for a in _ALIASES_BY_PREFIX.get(prefix, {}).get(canonical, []))
+    return sorted({p for p in out if len(p) >= 3}, key=len, reverse=True)
+
+
+def split_units(text: str) -> List[str]:
+    """
+    Dòng (bullet / mục) -> nếu dòng quá dài thì tách tiếp theo câu.
+    """
+    units = []
+    for line in str(text or "").splitlines():
+        line = line.rstrip()
+        if not line.strip():
+            continue
+        if len(line) > 300:
+            units.extend(s for s in _sentence_split_re.split(line) if s.strip())
+        else:
+            units.append(line)
+    return units
+
+
+def is_quantitative(unit: str) -> bool:
+    return bool(DOSAGE_RE.search(unit) or PHI_RE.search(unit))
+
+
+def compress_text(text: str, q_terms: Set[str], phrases: List[str], keep_ratio: float = 0.4, min_units: int = 4) -> str:
+    units = split_units(text)
+    if len(units) <= min_units:
+        return str(text)
+
+    scores = []
+    for u in units:
+        un = _norm(u)
+        overlap = len(q_terms & set(_word_re.findall(un)))
+        phrase_hits = sum(1 for p in phrases if p in un)
+        scores.append((overlap + 2.0 * phrase_hits) / math.sqrt(1 + len(un) / 80))
+
+    n_keep = max(min_units, int(math.ceil(len(units) * keep_ratio)))
+    ranked = sorted(range(len(units)), key=lambda i: scores[i], reverse=True)
+    keep = {i for i in ranked[:n_keep] if scores[i] > 0}
+    keep.add(0)  # dòng đầu thường là tiêu đề / tên sản phẩm
+    keep.update(i for i, u in enumerate(units) if is_quantitative(u))
+
+    out = []
+    last = -1
+    for i in sorted(keep):
+        if i != last + 1:
+            out.append("…")
+        out.append(units[i])
+        last = i
+    if last != len(units) - 1:
+        out.append("…")
+    return "\n".join(out)
+
+
+def compress_hits(
+    hits_for_ctx: List[Dict],
+    query: str,
+    tags: Iterable[str] = (),
+    keep_ratio: float = 0.4,
+    min_chars: int = 600,
+) -> List[Dict]:
+    """
+    Return list hit mới (copy) với "answer" đã rút gọn; doc ngắn (< min_chars) giữ nguyên.
+    """
+    q_terms = _terms(query)
+    phrases = tag_phrases(tags)
+
+    out = []
+    before = after = 0
+    for h in hits_for_ctx:
+        answer = str(h.get("answer", ""))
+        before += len(answer)
+        if len(answer) >= min_chars:
+            h = dict(h)
+            h["answer"] = compress_text(answer, q_terms, phrases, keep_ratio=keep_ratio)
+        after += len(str(h.get("answer", "")))
+        out.append(h)
+
+    debug_log(
+        "=== CONTEXT COMPRESS ===",
+        f"chars: {after}/{before} (saved {before - after})",
+    )
+    return out
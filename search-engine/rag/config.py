@@ -204,4 +204,402 @@ class RAGConfig:
     Tránh bịa thông tin
 
     👉 Đây là best practice trong RAG cho dữ liệu kỹ thuật.
-    """
\ No newline at end of file
+    """
+    use_entity_partitions: bool = True
+    entity_partition_min_score: int = 2
+
+    """
+    1️⃣2️⃣ use_entity_partitions: bool = True
+    1️⃣2️⃣ entity_partition_min_score: int = 2
+    📌 Ý nghĩa
+
+    Index được chia theo entity_type (product/disease/procedure/registry...).
+
+    Nếu infer_entity_type của query đủ chắc (score >= entity_partition_min_score):
+    → chỉ quét các partition liên quan
+    → dữ liệu danh mục TBVTV (registry) không còn "pha loãng" câu hỏi sản phẩm
+
+    Không chắc (general / score thấp) → quét toàn bộ index như cũ.
+    """
+
+    use_listing_engine: bool = True
+    listing_page_size: int = 50
+    listing_use_llm: bool = False
+
+    """
+    1️⃣3️⃣ use_listing_engine / listing_page_size / listing_use_llm
+    📌 Ý nghĩa
+
+    Câu hỏi "liệt kê / danh sách" (answer_modes.detect_listing) có must/any tags:
+    → liệt kê TOÀN BỘ doc khớp tag qua tag index (không quét embedding, không cắt theo max_ctx)
+    → phân trang listing_page_size mục / trang, trả cursor để xem tiếp
+
+    listing_use_llm:
+    False → in danh sách trực tiếp (formatter, vài ms)
+    True  → LLM tóm tắt từng lô (mỗi lô <= max_source_chars_per_call)
+    """
+
+    use_session_cache: bool = True
+    session_max_pool: int = 400
+    session_incremental_top_k: int = 40
+
+    """
+    1️⃣4️⃣ use_session_cache / session_max_pool / session_incremental_top_k
+    📌 Ý nghĩa
+
+    Câu hỏi nối tiếp trong cùng hội thoại ("còn liều dùng thì sao?", "loại nào rẻ hơn?"):
+    → re-score trong candidate pool của câu trước (tối đa session_max_pool doc)
+    → nếu câu mới có tag mới: search nhỏ session_incremental_top_k doc rồi merge
+    → bỏ qua route + normalize + quét toàn bộ KB
+
+    Chỉ có tác dụng khi pipeline được gọi với session=...
+    """
+
+    use_answer_cache: bool = True
+    answer_cache_max_entries: int = 2000
+    answer_cache_semantic_threshold: float = 0.95
+    answer_cache_path: str = "answer_cache"
+
+    """
+    1️⃣5️⃣ use_answer_cache / answer_cache_max_entries / answer_cache_semantic_threshold / answer_cache_path
+    📌 Ý nghĩa
+
+    Cache câu trả lời cuối (trước call_finetune_with_context + nhánh GLOBAL):
+    → Exact   : cùng normalized query + mode + danh sách doc ngữ cảnh + KB version
+    → Semantic: cosine(query embedding) >= answer_cache_semantic_threshold
+                VÀ retrieval chọn cùng primary_doc ("thuốc trị rầy nâu" ~ "thuốc nào trị rầy nâu")
+
+    LRU tối đa answer_cache_max_entries câu; lưu ra answer_cache_path(.json/.npz) khi thoát.
+    KB đổi (kb_version khác) → cache cũ tự không khớp.
+    """
+
+    use_retrieval_cache: bool = True
+    retrieval_cache_max_entries: int = 4096
+    query_vec_cache_max_entries: int = 8192
+
+    """
+    1️⃣6️⃣ use_retrieval_cache / retrieval_cache_max_entries / query_vec_cache_max_entries
+    📌 Ý nghĩa
+
+    Câu hỏi lặp lại → retrieval giống hệt dù câu trả lời cuối có thể khác (mode, prompt...):
+    → cache kết quả retriever.search theo (query/embedding, must, any, top_k, partitions, KB version)
+    → lưu mảng gọn (idx, sim, stage, match_count), LRU retrieval_cache_max_entries
+    → embedding của query cũng cache theo text (query_vec_cache_max_entries)
+
+    Cache là biến module (rag.retrieval_cache) → dùng chung mọi thread trong 1 process server.
+    """
+
+    context_token_budget: int = 4000
+    context_min_tail_tokens: int = 150
+
+    """
+    1️⃣7️⃣ context_token_budget / context_min_tail_tokens
+    📌 Ý nghĩa
+
+    Ngân sách token cho NGỮ CẢNH gửi call_finetune_with_context (ước lượng theo ký tự,
+    ~3 ký tự / token → 4000 token ≈ max_source_chars_per_call 12k chars):
+    → nạp doc theo thứ tự ưu tiên (primary_doc, rồi theo score) đến khi hết budget
+    → doc cuối không vừa: cắt theo dòng nếu còn >= context_min_tail_tokens, còn lại bỏ
+    → dòng "HỎI KHÁC" rỗng / "nan" không đưa vào prompt
+
+    max_ctx_strict / max_ctx_soft vẫn là trần số doc; budget là trần kích thước.
+    0 → tắt (ghép toàn bộ doc như cũ).
+    """
+
+    use_mmr: bool = True
+    mmr_lambda: float = 0.7
+    mmr_dup_threshold: float = 0.95
+
+    """
+    1️⃣8️⃣ use_mmr / mmr_lambda / mmr_dup_threshold
+    📌 Ý nghĩa
+
+    Chọn doc đưa vào NGỮ CẢNH bằng MMR thay vì lấy thẳng top max_ctx:
+    → điểm = mmr_lambda·fused_score − (1−mmr_lambda)·cosine lớn nhất tới doc đã chọn
+    → chunk overlap gần trùng (cosine >= mmr_dup_threshold) bị bỏ hẳn
+
+    mmr_lambda = 1.0 → chỉ theo relevance (như cũ, trừ lọc trùng)
+    mmr_lambda nhỏ  → ưu tiên đa dạng bằng chứng
+    """
+
+    use_chunk_merge: bool = True
+
+    """
+    1️⃣9️⃣ use_chunk_merge
+    📌 Ý nghĩa
+
+    Các chunk liền nhau của cùng 1 tài liệu (<parent>_chunk_<NN>) cùng nằm trong NGỮ CẢNH:
+    → gộp thành 1 [DOC] liền mạch theo thứ tự chunk, bỏ phần text overlap ở ranh giới
+    → ít token hơn, SOP/quy trình không bị cắt rời thành nhiều DOC
+    """
+
+    use_context_compression: bool = True
+    compress_keep_ratio: float = 0.4
+    compress_min_chars: int = 600
+
+    """
+    2️⃣0️⃣ use_context_compression / compress_keep_ratio / compress_min_chars
+    📌 Ý nghĩa
+
+    Rút gọn NỘI DUNG từng doc trước khi gửi LLM (extractive, chạy local):
+    → tách dòng/câu, chấm điểm theo từ khoá query + alias của tag đã suy ra
+    → giữ compress_keep_ratio số dòng điểm cao + MỌI dòng có liều lượng / thời gian cách ly
+    → doc ngắn hơn compress_min_chars giữ nguyên
+
+    Không áp dụng cho mode procedure (giữ đủ các bước) và listing.
+    """
+
+    use_product_facts: bool = True
+
+    """
+    2️⃣1️⃣ use_product_facts
+    📌 Ý nghĩa
+
+    Câu hỏi dữ kiện sản phẩm ("liều dùng X", "thời gian cách ly của Y", "X chứa hoạt chất gì"):
+    → tra product fact store (build sẵn bằng run/build_indexes.py → <kb>.facts.json)
+    → trả lời bằng template trong vài ms: không route, không normalize, không retrieval, không LLM
+
+    Thiếu dữ kiện cho bất kỳ sản phẩm / ý hỏi nào → đi đường RAG + LLM như cũ.
+    Hỏi liều / TGCL kèm cây trồng / sâu bệnh / cỏ ("liều X trên lúa") → đi RAG (fact store
+    chỉ có 1 liều / TGCL cho mỗi sản phẩm, không theo cây).
+    """
+
+    use_registry_index: bool = True
+
+    """
+    2️⃣2️⃣ use_registry_index
+    📌 Ý nghĩa
+
+    Câu hỏi tra cứu danh mục thuốc BVTV (infer_entity_type → registry):
+    → tra registry index (tên thương phẩm / hoạt chất / đơn vị đăng ký / đối tượng / cây trồng,
+      build sẵn bằng run/build_indexes.py → <kb>.registry.json)
+    → trả đủ toàn bộ dòng khớp, phân trang listing_page_size, không embedding, không LLM
+
+    Không khớp được key nào → đi đường RAG như cũ.
+    """
+
+    use_local_rerank: bool = True
+    local_rerank_weights_path: str = "local_rerank_weights.json"
+
+    """
+    2️⃣3️⃣ use_local_rerank / local_rerank_weights_path
+    📌 Ý nghĩa
+
+    Rerank candidate pool bằng model nhỏ chạy local (thay LLM rerank):
+    → feature: dense sim, match_count, stage, BM25, mã sản phẩm, tag, entity_type
+    → rerank_score = sigmoid(w·x + b), tính vector hoá cho cả pool (< 1 ms)
+    → fused_score dùng rerank_score như LLM rerank cũ
+
+    Trọng số fit offline từ query đã log + gán nhãn (run/fit_reranker.py → local_rerank_weights.json).
+    Chưa có file trọng số → không rerank (giữ thứ tự embedding).
+    """
+
+    rerank_batch_size: int = 8
+    rerank_max_workers: int = 4
+    rerank_deadline_ms: int = 1500
+    rerank_cache_max_entries: int = 20000
+
+    """
+    2️⃣4️⃣ rerank_batch_size / rerank_max_workers / rerank_deadline_ms / rerank_cache_max_entries
+    📌 Ý nghĩa
+
+    Khi bật use_llm_rerank:
+    → top_k_rerank candidate chia batch rerank_batch_size doc, chấm điểm song song (rerank_max_workers luồng)
+    → batch lỗi JSON chỉ mất điểm của batch đó, không mất toàn bộ
+    → quá rerank_deadline_ms: dùng điểm đã có, doc còn lại giữ điểm local rerank / embedding
+    → điểm cache theo (query, doc id, KB version), tối đa rerank_cache_max_entries cặp
+
+    📌 Không có tác dụng nếu use_llm_rerank = False
+    """
+
+    use_hedging: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+    hedge_min_delay_ms: float = 300.0
+    hedge_max_extra_ratio: float = 0.10
+    hedge_max_workers: int = 32
+
+    """
+    2️⃣5️⃣ use_hedging / hedge_quantile / hedge_min_samples / hedge_min_delay_ms / hedge_max_extra_ratio / hedge_max_workers
+    📌 Ý nghĩa
+
+    Hedged request cho các call LLM (route, normalize, generate, GLOBAL, rerank) qua rag/llm.py:
+    → request chưa trả về sau latency p{hedge_quantile} của chính call site đó (tối thiểu hedge_min_delay_ms)
+      → bắn thêm 1 bản sao, lấy bản xong trước (stream thua bị đóng)
+    → chỉ hedge khi site đã có ≥ hedge_min_samples mẫu latency
+    → số bản sao ≤ hedge_max_extra_ratio × số call của site (trần chi phí phát sinh)
+
+    Mục tiêu: cắt đuôi p99 mà chi phí trung bình chỉ tăng vài %.
+    Thống kê theo site: rag.llm.llm_stats().
+    """
+
+    llm_timeout_s: float = 60.0
+    llm_max_retries: int = 3
+    llm_backoff_base_s: float = 0.5
+    llm_backoff_max_s: float = 8.0
+    llm_rpm_limit: int = 500
+    llm_tpm_limit: int = 200000
+    llm_max_connections: int = 32
+
+    """
+    2️⃣6️⃣ llm_timeout_s / llm_max_retries / llm_backoff_base_s / llm_backoff_max_s / llm_rpm_limit / llm_tpm_limit / llm_max_connections
+    📌 Ý nghĩa
+
+    Gateway LLM dùng chung (rag/llm.py) cho pipeline và script offline:
+    → client tạo bằng make_client: pool keep-alive tối đa llm_max_connections kết nối
+    → mỗi call timeout llm_timeout_s giây
+    → lỗi tạm thời (429 / 5xx / timeout / mất kết nối) retry tối đa llm_max_retries lần,
+      chờ ngẫu nhiên trong [0, min(llm_backoff_max_s, llm_backoff_base_s × 2^lần)] (hoặc theo Retry-After)
+    → token bucket: ≤ llm_rpm_limit request/phút và ≤ llm_tpm_limit token/phút (cả process, 0 = không giới hạn)
+
+    Thống kê latency / retry / token theo call site: rag.llm.llm_stats().
+    """
+
+    latency_budget_ms: int = 0
+    budget_llm_router_ms: int = 15000
+    budget_normalize_ms: int = 12000
+    budget_full_top_k_ms: int = 8000
+    budget_min_top_k: int = 60
+    budget_llm_rerank_ms: int = 8000
+    budget_generate_ms: int = 3000
+    budget_global_full_model_ms: int = 12000
+    budget_tokens_per_s: float = 60.0
+
+    """
+    2️⃣7️⃣ latency_budget_ms / budget_*
+    📌 Ý nghĩa
+
+    Latency budget cho mỗi request (0 = không giới hạn, gợi ý 20000), có thể đặt riêng từng request
+    qua answer_with_suggestions(budget_ms=...). Các ngưỡng dưới đây tính theo budget 20000 ms.
+    Mỗi stage chỉ chạy đầy đủ khi thời gian còn lại ≥ ngưỡng của nó, ngược lại degrade:
+    → budget_llm_router_ms        : không gọi LLM router (heuristic, mặc định RAG)
+    → budget_normalize_ms         : bỏ normalize, dùng nguyên câu hỏi
+    → budget_full_top_k_ms        : giảm top_k xuống budget_min_top_k
+    → budget_llm_rerank_ms        : bỏ LLM rerank (giữ local rerank)
+    → budget_generate_ms          : RAG_STRICT/SOFT → DIRECT_DOC (không gọi LLM sinh câu trả lời)
+    → budget_global_full_model_ms : GLOBAL dùng gpt-4.1-mini thay gpt-4.1, không escalate
+    → max_completion_tokens giới hạn theo thời gian còn lại × budget_tokens_per_s
+
+    Degradation đã dùng: res["budget"]["degradations"].
+    """
+
+    # ======================
+    # GLOBAL ESCALATION (gpt-4.1-mini -> gpt-4.1)
+    # ======================
+    use_global_escalation: bool = True
+    global_escalation_probe_chars: int = 1200
+    global_min_chars: int = 0
+
+    """
+    2️⃣8️⃣ use_global_escalation / global_escalation_probe_chars / global_min_chars
+    📌 Ý nghĩa
+
+    Câu GLOBAL không thuộc nhóm khó (_is_hard_global) trả lời bằng gpt-4.1-mini, luôn stream để kiểm tra dần:
+    → đủ global_escalation_probe_chars ký tự (~vài trăm token) mà chưa có mục "Định nghĩa"/"Khái niệm"/"Phân loại"
+      (không phân biệt hoa thường / dấu) → đóng stream ngay, escalate gpt-4.1 (không đợi mini trả lời hết)
+    → mini trả lời xong trước probe_chars (câu định nghĩa đơn giản) → dùng luôn, không gọi thêm model
+    → global_min_chars > 0: câu trả lời xong nhưng ngắn hơn → escalate (mặc định 0 = tắt,
+      câu hỏi đơn giản trả lời ngắn là bình thường)
+    Lý do escalate ghi vào res["escalated"] ("structure" / "short") để thống kê câu hỏi cần model lớn.
+    """
+
+    # ======================
+    # TRACING
+    # ======================
+    use_tracing: bool = True
+
+    """
+    2️⃣9️⃣ use_tracing
+    📌 Ý nghĩa
+
+    Mỗi lần answer_with_suggestions = 1 trace (1 trace_id cho mọi log của request đó).
+    Thời gian từng stage (route, normalize, tag_inference, embed, retrieve/scan/filter,
+    rerank, context, generate) → cây span in ra log + res["timings"]:
+    → {"trace_id", "total_ms", "stages": {"retrieve/scan": ms, ...}, "spans": [cây span]}
+    """
+
+    # ======================
+    # METRICS
+    # ======================
+    use_metrics: bool = True
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    metrics_snapshot_path: str = "rag_metrics.jsonl"
+    metrics_snapshot_interval_s: float = 60.0
+
+    """
+    3️⃣0️⃣ use_metrics / metrics_*
+    📌 Ý nghĩa
+
+    Metrics registry trong process (rag.metrics), mỗi request cộng 1 lần:
+    → histogram latency request + từng stage (p50/p95/p99), số request theo route/strategy,
+      answer cache tier, token LLM, degradation, escalation; lúc scrape đọc thêm llm_stats()
+      và hit/miss retrieval / query_vec / llm_rerank cache
+    → metrics_port > 0: Prometheus scrape http://metrics_host:metrics_port/metrics (0 = tắt)
+    → metrics_snapshot_interval_s > 0: append snapshot JSON vào metrics_snapshot_path định kỳ
+    """
+
+    # ======================
+    # DEBUG LOG (debug_flow.log)
+    # ======================
+    debug_log_enabled: bool = True
+    debug_log_level: str = "INFO"
+    debug_log_max_bytes: int = 50 * 1024 * 1024
+    debug_log_backups: int = 3
+
+    """
+    3️⃣1️⃣ debug_log_enabled / debug_log_level / debug_log_max_bytes / debug_log_backups
+    📌 Ý nghĩa
+
+    debug_log() chỉ đưa record vào queue; 1 thread nền gom batch và ghi file (caller không chờ disk).
+    → debug_log_enabled=False: tắt hẳn (không format, không queue)
+    → debug_log_level: "DEBUG" (thêm dump từng candidate của retriever) / "INFO" / "WARNING"
+    → file > debug_log_max_bytes → xoay vòng debug_flow.log.1 … .{debug_log_backups} (0 = không giới hạn)
+    Giá trị lớp RAGConfig áp dụng lúc import; cfg riêng → configure_debug_log(cfg).
+    """
+
+    # ======================
+    # QUERY LOG (JSONL, thay rag_logs.csv)
+    # ======================
+    use_query_log: bool = True
+    query_log_dir: str = "query_logs"
+    query_log_segment_max_bytes: int = 64 * 1024 * 1024
+    query_log_compress: bool = True
+    query_log_answer_chars: int = 300
+    query_log_top_hits: int = 10
+
+    """
+    3️⃣2️⃣ use_query_log / query_log_*
+    📌 Ý nghĩa
+
+    Mỗi query = 1 dòng JSON trong query_log_dir/queries-YYYYMMDD-HHMMSS-NNN.jsonl (ghi nền, theo batch):
+    route, strategy, profile, query_log_top_hits hit đầu (id, fused/raw/rerank score),
+    thời gian từng stage, latency, token usage, cache, degradation, escalation.
+    → câu trả lời: chỉ giữ query_log_answer_chars ký tự đầu + sha1 (không phình như CSV cũ)
+    → segment > query_log_segment_max_bytes hoặc sang ngày mới → đóng, gzip (query_log_compress)
+    → phân tích: rag.query_log.load_query_log(dir, "YYYY-MM-DD") → DataFrame
+    """
+
+    # ======================
+    # HTTP SERVER (run/server.py)
+    # ======================
+    server_host: str = "127.0.0.1"
+    server_port: int = 8080
+    server_max_concurrency: int = 16
+    server_max_queue: int = 64
+    server_request_timeout_s: float = 120.0
+    server_shutdown_grace_s: float = 30.0
+    server_max_body_bytes: int = 64 * 1024
+
+    """
+    3️⃣3️⃣ server_*
+    📌 Ý nghĩa
+
+    python -m run.server: load KB 1 lần, phục vụ nhiều câu hỏi đồng thời.
+    → server_max_concurrency: số request chạy pipeline cùng lúc (= số worker thread; LLM dùng chung
+      httpx pool llm_max_connections → nên ≤ llm_max_connections)
+    → server_max_queue: số request chờ tối đa, vượt → 503 + Retry-After
+    → server_request_timeout_s: quá hạn → 504 (thread pipeline vẫn chạy nốt, kết quả bỏ;
+      slot worker chỉ trả lại khi thread xong)
+    → server_shutdown_grace_s: SIGTERM → readyz 503, chờ request đang chạy tối đa ngần này giây
+    """
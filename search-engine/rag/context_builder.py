@@ -1,14 +1,151 @@
-def build_context_from_hits(hits_for_ctx: list) -> str:
+import re
+
+from rag.debug_log import debug_log
+
+# Ước lượng token theo ký tự (tiếng Việt có dấu ~3 ký tự / token với tokenizer OpenAI)
+CHARS_PER_TOKEN = 3.0
+DOC_SEPARATOR = "\n\n--------------------\n\n"
+TRUNCATED_MARK = "…(đã rút gọn)"
+# <parent>_chunk_<NN>, NN bắt đầu từ 00
+CHUNK_ID_RE = re.compile(r"^(.*?)_chunk_(\d+)$")
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text or "") / CHARS_PER_TOKEN) + 1
+
+
+def _has_text(x) -> bool:
+    s = str(x or "").strip()
+    return bool(s) and s.lower() not in {"nan", "none", "null"}
+
+
+def _format_block(i: int, h: dict, answer=None) -> str:
+    question = h.get("question", "")
+    alt = h.get("alt_question", "")
+    lines = [f"[DOC {i}]", f"CÂU HỎI: {question}"]
+    # HỎI KHÁC rỗng / "nan" / trùng câu hỏi -> bỏ, không tốn token
+    if _has_text(alt) and str(alt).strip() != str(question).strip():
+        lines.append(f"HỎI KHÁC: {alt}")
+    lines.append(f"NỘI DUNG:\n{h.get('answer', '') if answer is None else answer}")
+    return "\n".join(lines)
+
+
+def _truncate_lines(text: str, max_chars: int) -> str:
+    """
+    Cắt theo ranh giới dòng (không cắt giữa câu/bullet); dòng đầu quá dài thì cắt cứng.
+    """
+    out, used = [], 0
+    for line in text.splitlines():
+        if used + len(line) + 1 > max_chars:
+            break
+        out.append(line)
+        used += len(line) + 1
+    if not out:
+        return text[:max_chars].rstrip()
+    return "\n".join(out).rstrip()
+
+
+def _join_with_overlap(prev: str, nxt: str, min_overlap: int = 20) -> str:
+    """
+    Chunk overlap: đầu `nxt` lặp lại đuôi `prev` -> nối liền, bỏ phần lặp (overlap dài nhất).
+    Không thấy overlap -> nối bằng xuống dòng.
+    """
+    probe = nxt[:min_overlap]
+    if len(probe) >= min_overlap:
+        pos = prev.find(probe)
+        while pos != -1:
+            tail = prev[pos:]
+            if nxt.startswith(tail):
+                return prev + nxt[len(tail):]
+            pos = prev.find(probe, pos + 1)
+    return prev.rstrip() + "\n" + nxt
+
+
+def merge_adjacent_chunks(hits_for_ctx: list, min_overlap: int = 20) -> list:
+    """
+    Gộp các chunk liên tiếp cùng parent (<parent>_chunk_<NN>) thành 1 đoạn liền mạch:
+    - nhóm theo parent, sắp theo chunk index, chunk NN và NN+1 -> 1 passage (bỏ phần overlap)
+    - passage đứng ở vị trí chunk ưu tiên cao nhất của nhóm; doc không phải chunk giữ nguyên
+    Passage = bản copy hit đầu tiên (theo chunk index), thêm "merged_ids".
+    """
+    groups = {}
+    order = []
+    for h in hits_for_ctx:
+        m = CHUNK_ID_RE.match(str(h.get("id", "")))
+        # chunk (kể cả _chunk_00) -> nhóm theo parent; doc không phải chunk đứng riêng
+        key, cidx = (m.group(1), int(m.group(2))) if m else (("__single__", id(h)), 0)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append((cidx, h))
+
+    out = []
+    for key in order:
+        chunks = sorted(groups[key], key=lambda x: x[0])
+        run = None
+        for cidx, h in chunks:
+            if run is not None and cidx == run["_last"] + 1:
+                run["answer"] = _join_with_overlap(run["answer"], str(h.get("answer", "")).strip(), min_overlap)
+                run["merged_ids"].append(h.get("id", ""))
+                run["_last"] = cidx
+                continue
+            if run is not None:
+                out.append(run)
+            run = dict(h)
+            run["answer"] = str(h.get("answer", ""))
+            run["merged_ids"] = [h.get("id", "")]
+            run["_last"] = cidx
+        out.append(run)
+
+    for p in out:
+        p.pop("_last", None)
+        if len(p["merged_ids"]) == 1:
+            p.pop("merged_ids")
+    return out
+
+
+def build_context_from_hits(hits_for_ctx: list, token_budget: int = None, min_tail_tokens: int = 150) -> str:
+    """
+    hits_for_ctx: đã theo thứ tự ưu tiên (primary_doc trước, còn lại theo score).
+    token_budget: None/0 -> ghép toàn bộ như cũ.
+                  Có budget -> nạp lần lượt đến khi hết budget; doc cuối không vừa
+                  thì cắt theo dòng (nếu còn >= min_tail_tokens), các doc sau bỏ.
+    """
+    full_blocks = [_format_block(i, h) for i, h in enumerate(hits_for_ctx, 1)]
+    if not token_budget:
+        return DOC_SEPARATOR.join(full_blocks)
+
+    sep_tokens = estimate_tokens(DOC_SEPARATOR)
     blocks = []
-    for i, h in enumerate(hits_for_ctx, 1):
-        block = (
-            f"[DOC {i}]\n"
-            f"CÂU HỎI: {h.get('question','')}\n"
-            f"HỎI KHÁC: {h.get('alt_question','')}\n"
-            f"NỘI DUNG:\n{h.get('answer','')}"
-        )
-        blocks.append(block)
-    return "\n\n--------------------\n\n".join(blocks)
+    used = 0
+    truncated = 0
+    for i, (h, block) in enumerate(zip(hits_for_ctx, full_blocks), 1):
+        cost = estimate_tokens(block) + (sep_tokens if blocks else 0)
+        if used + cost <= token_budget:
+            blocks.append(block)
+            used += cost
+            continue
+
+        remaining = token_budget - used - (sep_tokens if blocks else 0)
+        header_tokens = estimate_tokens(_format_block(i, h, answer=""))
+        if remaining - header_tokens >= min_tail_tokens or not blocks:
+            max_chars = int(max(remaining - header_tokens, 0) * CHARS_PER_TOKEN)
+            answer = _truncate_lines(str(h.get("answer", "")), max_chars)
+            blocks.append(_format_block(i, h, answer=answer + "\n" + TRUNCATED_MARK))
+            truncated = 1
+        break
+
+    context = DOC_SEPARATOR.join(blocks)
+
+    full_tokens = estimate_tokens(DOC_SEPARATOR.join(full_blocks))
+    packed_tokens = estimate_tokens(context)
+    debug_log(
+        "=== CONTEXT PACK ===",
+        f"docs       : {len(blocks)}/{len(hits_for_ctx)} (truncated tail: {truncated})",
+        f"est tokens : {packed_tokens}/{full_tokens} (budget {token_budget}, saved {full_tokens - packed_tokens})",
+    )
+    return context
+
 
 def choose_adaptive_max_ctx(hits_reranked, is_listing: bool = False):
     # dùng fused_score (ổn định cả khi rerank bật/tắt)
@@ -22,4 +159,4 @@ def choose_adaptive_max_ctx(hits_reranked, is_listing: bool = False):
         return 25
     if s1 >= 0.80 and s2 >= 0.65:
         return 20
-    return 15
\ No newline at end of file
+    return 15
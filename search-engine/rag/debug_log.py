@@ -1,12 +1,162 @@
-from datetime import datetime
+import atexit
+import logging
+import os
+import queue
+import threading
+
+from rag.config import RAGConfig
+
+# ======================
+# DEBUG LOG (buffer + thread ghi nền)
+#   - debug_log(...) chỉ format + đưa vào queue, không mở/ghi file ở thread gọi
+#   - 1 thread nền gom nhiều record / lần ghi, giữ file mở, xoay vòng theo kích thước
+#   - queue đầy -> bỏ record (đếm dropped), caller không bao giờ chờ disk
+#   - level: DEBUG (dump từng candidate) / INFO (mặc định) / WARNING; debug_log_enabled=False -> tắt hẳn
+# ======================
 
 DEBUG_LOG_FILE = "debug_flow.log"
 
-def debug_log(*args):
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+
+_settings = {
+    "enabled": RAGConfig.debug_log_enabled,
+    "level": logging.getLevelName(RAGConfig.debug_log_level),
+    "max_bytes": RAGConfig.debug_log_max_bytes,
+    "backups": RAGConfig.debug_log_backups,
+}
+
+_QUEUE_MAX = 100_000
+_BATCH_MAX = 1000
+_STOP = object()
+
+_queue: "queue.Queue" = queue.Queue(maxsize=_QUEUE_MAX)
+_writer = None
+_writer_lock = threading.Lock()
+_dropped = 0
+
+
+def configure_debug_log(cfg=RAGConfig, path=None) -> None:
+    """
+    Áp dụng cfg.debug_log_* (mặc định lấy từ RAGConfig lúc import). path: đổi file log.
+    """
+    global DEBUG_LOG_FILE
+    _settings["enabled"] = cfg.debug_log_enabled
+    _settings["level"] = logging.getLevelName(cfg.debug_log_level)
+    _settings["max_bytes"] = cfg.debug_log_max_bytes
+    _settings["backups"] = cfg.debug_log_backups
+    if path is not None:
+        DEBUG_LOG_FILE = path
+
+
+def debug_enabled(level: int = INFO) -> bool:
+    """
+    Caller dùng để bỏ qua việc dựng log tốn kém (vd. dump từng candidate) khi level bị tắt.
+    """
+    return _settings["enabled"] and level >= _settings["level"]
+
+
+def debug_log(*args, level: int = INFO):
     """
-    Ghi log giống print(), nhưng ghi vào file (append)
+    Ghi log giống print(), nhưng ghi vào file (append) — qua queue, thread nền ghi.
     """
-    with open(DEBUG_LOG_FILE, "a", encoding="utf-8") as f:
-        for arg in args:
-            f.write(str(arg) + "\n")
-        f.write("\n")  # cách dòng cho dễ đọc
+    global _dropped
+    if not debug_enabled(level):
+        return
+    record = "".join(str(arg) + "\n" for arg in args) + "\n"  # cách dòng cho dễ đọc
+    _ensure_writer()
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        _dropped += 1
+
+
+def _ensure_writer() -> None:
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            t = threading.Thread(target=_write_loop, name="rag-debug-log", daemon=True)
+            t.start()
+            _writer = t
+
+
+def _rotate(path: str, backups: int) -> None:
+    if backups <= 0:
+        os.remove(path)
+        return
+    for i in range(backups - 1, 0, -1):
+        src = f"{path}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _write_loop() -> None:
+    global _dropped
+    f = None
+    f_path = None
+    while True:
+        item = _queue.get()
+        batch = [item]
+        while len(batch) < _BATCH_MAX:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        stop = any(x is _STOP for x in batch)
+        records = [x for x in batch if x is not _STOP and not isinstance(x, threading.Event)]
+        try:
+            if records:
+                if f is None or f_path != DEBUG_LOG_FILE:
+                    if f is not None:
+                        f.close()
+                    f_path = DEBUG_LOG_FILE
+                    f = open(f_path, "a", encoding="utf-8")
+                f.write("".join(records))
+                f.flush()
+                if _settings["max_bytes"] and f.tell() >= _settings["max_bytes"]:
+                    f.close()
+                    f = None
+                    _rotate(f_path, _settings["backups"])
+        except OSError:
+            _dropped += len(records)
+        finally:
+            for x in batch:
+                if isinstance(x, threading.Event):
+                    x.set()  # flush_debug_log() đang chờ
+        if stop:
+            if f is not None:
+                f.close()
+            return
+
+
+def flush_debug_log(timeout: float = 5.0) -> bool:
+    """
+    Chờ thread nền ghi hết các record đã vào queue (trước khi thoát / trong script kiểm tra).
+    """
+    if _writer is None:
+        return True
+    done = threading.Event()
+    try:
+        _queue.put(done, timeout=timeout)
+    except queue.Full:
+        return False
+    return done.wait(timeout)
+
+
+def debug_log_stats() -> dict:
+    return {"queued": _queue.qsize(), "dropped": _dropped}
+
+
+@atexit.register
+def _shutdown() -> None:
+    if _writer is not None:
+        try:
+            _queue.put(_STOP, timeout=1.0)
+        except queue.Full:
+            return
+        _writer.join(timeout=5.0)
@@ -15,4 +15,98 @@ def format_direct_doc_answer(user_query: str, primary_doc: dict) -> str:
         out.append("")
         out.append(a)
 
-    return "\n".join(out).strip()
\ No newline at end of file
+    return "\n".join(out).strip()
+
+def format_listing_answer(user_query: str, page) -> str:
+    """
+    Trả lời dạng liệt kê trực tiếp từ ListingPage (không qua LLM), nhóm theo facet tag.
+    """
+    if not page.items:
+        return "Không tìm thấy mục nào phù hợp."
+
+    start = int(page.cursor) + 1
+    end = int(page.cursor) + len(page.items)
+
+    out = []
+    out.append(f"Danh sách phù hợp ({start}–{end} / {page.total} mục):")
+
+    no = start
+    for facet, items in page.groups.items():
+        out.append("")
+        out.append(f"▸ {facet}")
+        for it in items:
+            q = (it.get("question", "") or "").strip() or it.get("parent", "")
+            out.append(f"  {no}. {q}")
+            no += 1
+
+    if page.next_cursor is not None:
+        out.append("")
+        out.append(f"Còn {page.total - end} mục. Xem tiếp với cursor: {page.next_cursor}")
+
+    return "\n".join(out).strip()
+
+def format_product_fact_answer(user_query: str, facts: dict) -> str:
+    """
+    Trả lời câu hỏi dữ kiện sản phẩm (liều dùng / TGCL / hoạt chất) từ product fact store.
+    facts: output của product_facts.lookup_product_facts
+    """
+    intents = facts["intents"]
+    out = []
+    for tag, rec in facts["products"]:
+        name = tag.split(":", 1)[-1].replace("-", " ").upper()
+        lines = [f"{name}{' (' + rec['formulation'] + ')' if rec.get('formulation') and not name.endswith(rec['formulation']) else ''}:"]
+        sources = []
+
+        if "active" in intents:
+            lines.append(f"- Hoạt chất: {rec['active']}")
+            sources.append(rec["sources"].get("active"))
+        if "dosage" in intents:
+            if rec.get("per_tank_ml_range"):
+                lo, hi = rec["per_tank_ml_range"]
+                lines.append(f"- Liều pha: {lo}–{hi} ml cho bình {rec.get('tank_l', '')} lít")
+                sources.append(rec["sources"].get("per_tank_ml_range"))
+            if rec.get("per_ha_l"):
+                lines.append(f"- Liều dùng: {rec['per_ha_l']} lít/ha")
+                sources.append(rec["sources"].get("per_ha_l"))
+        if "phi" in intents:
+            lines.append(f"- Thời gian cách ly: {rec['phi_days']} ngày")
+            sources.append(rec["sources"].get("phi_days"))
+
+        srcs = ", ".join(dict.fromkeys(s for s in sources if s))
+        if srcs:
+            lines.append(f"(Nguồn: {srcs})")
+        out.append("\n".join(lines))
+
+    out.append("Lưu ý: đọc kỹ nhãn thuốc trước khi sử dụng; liều có thể thay đổi theo cây trồng và đối tượng.")
+    return "\n\n".join(out).strip()
+
+def format_registry_answer(user_query: str, page) -> str:
+    """
+    Kết quả tra danh mục thuốc BVTV (registry_index.registry_page), nhóm theo hoạt chất.
+    """
+    if not page.items:
+        return "Không tìm thấy thuốc phù hợp trong danh mục thuốc BVTV."
+
+    start = int(page.cursor) + 1
+    end = int(page.cursor) + len(page.items)
+
+    out = []
+    out.append(f"Danh mục thuốc BVTV phù hợp ({start}–{end} / {page.total} thuốc):")
+
+    no = start
+    for active, items in page.groups.items():
+        out.append("")
+        out.append(f"▸ Hoạt chất: {active}")
+        for it in items:
+            out.append(f"  {no}. {it['trade_name']}")
+            if it.get("targets"):
+                out.append(f"     Đối tượng/cây trồng: {it['targets']}")
+            if it.get("registrant"):
+                out.append(f"     Đơn vị đăng ký: {it['registrant']}")
+            no += 1
+
+    if page.next_cursor is not None:
+        out.append("")
+        out.append(f"Còn {page.total - end} thuốc. Xem tiếp với cursor: {page.next_cursor}")
+
+    return "\n".join(out).strip()
@@ -1,7 +1,21 @@
-def call_finetune_with_context(client, user_query, context, answer_mode: str = "general", rag_mode: str = "STRICT"):
-    print('answer_mode:', answer_mode)
-    # Mode requirements (giữ nguyên tinh thần code v4 của anh)
-    BASE_REASONING_PROMPT = """
+from functools import lru_cache
+
+from rag.llm import add_usage, chat_completion
+
+FINETUNE_MODEL = "gpt-4.1-mini"
+FINETUNE_MAX_TOKENS = 3500
+
+
+# ======================
+# PROMPT LAYOUT (thân thiện prefix cache của provider)
+#   - system = phần TĨNH theo (answer_mode, rag_mode): nguyên tắc chung + chỉ thị chung + chỉ thị riêng mode
+#     -> giống hệt từng byte giữa các query cùng mode -> provider cache được prefix dài
+#   - user   = phần ĐỘNG: NGỮ CẢNH + CÂU HỎI (đặt cuối)
+#   - cached_tokens lấy từ usage (rag/llm.py), ghi vào res["usage"] + log
+# ======================
+
+# Mode requirements (giữ nguyên tinh thần code v4 của anh)
+BASE_REASONING_PROMPT = """
     Bạn là Trợ lý Kỹ thuật Nông nghiệp & Sản phẩm của BMCVN.
     NGUYÊN TẮC BẮT BUỘC:
     1) Ưu tiên NGỮ CẢNH. Chỉ dùng thông tin có trong NGỮ CẢNH cho các dữ liệu định lượng/chỉ định chi tiết như:
@@ -18,8 +32,8 @@ def call_finetune_with_context(client, user_query, context, answer_mode: str = "
     - Không giữ số gốc (ví dụ không dùng (5) nếu (2)(3)(4) không tồn tại).
     """.strip()
 
-    if answer_mode == "disease":
-        mode_requirements = """
+MODE_REQUIREMENTS = {
+    "disease": """
     - Cấu trúc ưu tiên:
     (1) Tổng quan
     (2) Nguyên nhân/điều kiện phát sinh (chỉ khi có trong NGỮ CẢNH; SOFT có thể bổ sung kiến thức chung)
@@ -30,67 +44,125 @@ def call_finetune_with_context(client, user_query, context, answer_mode: str = "
     - Không bịa thuốc/liều/TGCL.
     - Nếu chỉ có một số mục được tạo, hãy ĐÁNH SỐ LẠI LIÊN TỤC (1,2,3...) theo thứ tự xuất hiện.
     - Không giữ số gốc (ví dụ không dùng (5) nếu (2)(3)(4) không tồn tại).
-    """.strip()
-    elif answer_mode == "product":
-        mode_requirements = """
+    """.strip(),
+    "product": """
     - Trình bày chi tiết, không trả lời quá ngắn gọn.
     - Cố gắn trình bày đầy đủ thông tin sản phẩm, lưu ý, công thức từ các DOC được đề xuất. 
     - Chỉ đề xuất các sản phẩm liên quan, không đề xuất các sản phẩm không có tác dụng đối với nhu cầu trừ cỏ, sâu, bệnh mà người dùng đang quan tâm.
     - Làm rõ đặc tính sản phẩm, cơ chế (nếu NGỮ CẢNH có), phạm vi tác động.
     - CHỈ sử dụng dữ liệu trong NGỮ CẢNH, không được tự bịa thêm liều lượng, cách pha, thời gian cách ly.
-    """.strip()
-    elif answer_mode == "procedure":
-        mode_requirements = """
+    """.strip(),
+    "procedure": """
     - Trình bày theo checklist từng bước.
     - Mỗi bước: (Việc cần làm) + (Mục đích) nếu NGỮ CẢNH có.
     - Không tự phát minh quy trình mới ngoài NGỮ CẢNH (STRICT).
     - Nếu thiếu bước quan trọng, chỉ được bổ sung dưới dạng "Kiến thức chung" (SOFT) và không kèm số liệu định lượng.
-    """.strip()
-    elif answer_mode == "listing":
-        mode_requirements = """
+    """.strip(),
+    "listing": """
     - Mục tiêu: tổng hợp đầy đủ các mục xuất hiện trong NGỮ CẢNH, không bỏ sót.
     - Trình bày theo nhóm nếu có thể (theo chủ đề/tags/đối tượng).
     - Không bịa thêm ngoài NGỮ CẢNH.
-    """.strip()
-    else:
-        mode_requirements = """
+    """.strip(),
+    "general": """
     - Trình bày có cấu trúc theo ý chính.
     - Ưu tiên tổng hợp từ nhiều đoạn NGỮ CẢNH.
     - Không bịa số liệu/liều lượng nếu NGỮ CẢNH không có.
     - Nếu câu hỏi liên quan thủy sinh (cá/tôm/vật nuôi...), mà NGỮ CẢNH không đề cập: phải nhấn mạnh "Tài liệu không đề cập".
+    """.strip(),
+}
+
+RAG_MODE_RULES = {
+    "SOFT": "SOFT MODE: được phép bổ sung 'kiến thức chung' để giải thích mạch lạc, nhưng không đưa số liệu/liều/TGCL nếu NGỮ CẢNH không có.",
+    "STRICT": "STRICT MODE: chỉ dùng NGỮ CẢNH. Không thêm kiến thức ngoài, trừ diễn giải lại cho dễ hiểu.",
+}
+
+GENERAL_RULES = """
+    CHỈ THỊ CHUNG (bắt buộc):
+    - Không bịa số liệu/liều lượng/cách pha/TGCL nếu NGỮ CẢNH không nêu.
+    - Nếu có thể, ưu tiên tổng hợp từ nhiều đoạn NGỮ CẢNH (không chỉ 1–2 đoạn).
+    - Khi liệt kê sản phẩm/tên thuốc: tên đó phải xuất hiện trong NGỮ CẢNH.
     """.strip()
 
-    # RAG STRICT vs SOFT
-    if rag_mode == "SOFT":
-        system_prompt = ( BASE_REASONING_PROMPT + "\nSOFT MODE: được phép bổ sung 'kiến thức chung' để giải thích mạch lạc, nhưng không đưa số liệu/liều/TGCL nếu NGỮ CẢNH không có.")
-    else:
-        system_prompt = (BASE_REASONING_PROMPT + "\nSTRICT MODE: chỉ dùng NGỮ CẢNH. Không thêm kiến thức ngoài, trừ diễn giải lại cho dễ hiểu.")
 
+@lru_cache(maxsize=None)
+def finetune_system_prompt(answer_mode: str = "general", rag_mode: str = "STRICT") -> str:
+    """
+    Prefix tĩnh (không chứa gì của query) cho 1 cặp (answer_mode, rag_mode).
+    """
+    mode_requirements = MODE_REQUIREMENTS.get(answer_mode, MODE_REQUIREMENTS["general"])
+    rag_rule = RAG_MODE_RULES["SOFT"] if rag_mode == "SOFT" else RAG_MODE_RULES["STRICT"]
+    return (
+        BASE_REASONING_PROMPT + "\n" + rag_rule
+        + "\n\n" + GENERAL_RULES
+        + f"\n\n    CHỈ THỊ RIÊNG THEO MODE (MODE: {answer_mode}):\n    " + mode_requirements
+    )
+
+
+def build_finetune_messages(user_query, context, answer_mode: str = "general", rag_mode: str = "STRICT"):
     user_prompt = f"""
     NGỮ CẢNH (chỉ được dùng các dữ kiện định lượng từ đây):
     \"\"\"{context}\"\"\"
 
     CÂU HỎI:
     \"\"\"{user_query}\"\"\"
+    """.strip()
 
-    MODE: {answer_mode}
+    return [
+        {"role": "system", "content": finetune_system_prompt(answer_mode, rag_mode)},
+        {"role": "user", "content": user_prompt}
+    ]
 
-    CHỈ THỊ CHUNG (bắt buộc):
-    - Không bịa số liệu/liều lượng/cách pha/TGCL nếu NGỮ CẢNH không nêu.
-    - Nếu có thể, ưu tiên tổng hợp từ nhiều đoạn NGỮ CẢNH (không chỉ 1–2 đoạn).
-    - Khi liệt kê sản phẩm/tên thuốc: tên đó phải xuất hiện trong NGỮ CẢNH.
 
-    CHỈ THỊ RIÊNG THEO MODE:
-    {mode_requirements}
-    """.strip()
+def call_finetune_with_context(client, user_query, context, answer_mode: str = "general", rag_mode: str = "STRICT", usage_out=None, max_completion_tokens: int = FINETUNE_MAX_TOKENS):
+    """
+    usage_out (dict, tuỳ chọn): nhận prompt_tokens / cached_tokens / completion_tokens.
+    """
+    print('answer_mode:', answer_mode)
+    resp = chat_completion(
+        client,
+        site="generate",
+        model=FINETUNE_MODEL,
+        temperature=0.4,
+        max_completion_tokens=max_completion_tokens,
+        messages=build_finetune_messages(user_query, context, answer_mode, rag_mode),
+    )
+    if usage_out is not None:
+        add_usage(usage_out, getattr(resp, "usage", None))
+    return resp.choices[0].message.content.strip()
 
-    resp = client.chat.completions.create(
-        model="gpt-4.1-mini",
+
+def iter_stream_text(stream):
+    """
+    Lấy phần text (delta.content) từ stream chat.completions, bỏ chunk rỗng / chunk usage.
+    """
+    started = False
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if not started:
+            # giống .strip() của bản không stream: bỏ khoảng trắng đầu
+            delta = delta.lstrip()
+            started = bool(delta)
+        if delta:
+            yield delta
+
+
+def stream_finetune_with_context(client, user_query, context, answer_mode: str = "general", rag_mode: str = "STRICT", usage_out=None, max_completion_tokens: int = FINETUNE_MAX_TOKENS):
+    """
+    Như call_finetune_with_context nhưng yield từng đoạn text ngay khi model sinh ra.
+    usage_out được điền sau khi stream kết thúc (chunk usage cuối).
+    """
+    print('answer_mode:', answer_mode)
+    stream = chat_completion(
+        client,
+        site="generate_stream",  # latency = tới chunk đầu, tách khỏi "generate"
+        model=FINETUNE_MODEL,
         temperature=0.4,
-        max_completion_tokens=3500,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        max_completion_tokens=max_completion_tokens,
+        messages=build_finetune_messages(user_query, context, answer_mode, rag_mode),
+        stream=True,
     )
-    return resp.choices[0].message.content.strip()
\ No newline at end of file
+    yield from iter_stream_text(stream)
+    if usage_out is not None:
+        add_usage(usage_out, getattr(stream, "usage", None))
@@ -0,0 +1,85 @@
+import hashlib
+import threading
+
+import numpy as np
+
+# ======================
+# KB-derived indexes (build 1 lần / KB, dùng lại cho mọi query)
+# ======================
+
+# _lock chỉ giữ lúc đọc/ghi dict (không giữ khi build); mỗi (KB, name) có lock build riêng
+# -> build kNN graph lần đầu không chặn thread đang dùng index khác
+_lock = threading.Lock()
+_INDEXES = {}  # id(EMBS) -> (EMBS, {name: index})
+_BUILD_LOCKS = {}  # (id(EMBS), name) -> RLock, chỉ tồn tại trong lúc build
+
+
+def unpack_kb(kb):
+    """
+    Trả về đủ 9 phần tử theo thứ tự load_npz:
+    (EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE)
+    KB cũ (7 phần tử) -> TAGS_V2/ENTITY_TYPE = None (backward compatible).
+    """
+    if len(kb) >= 9:
+        return tuple(kb[:9])
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS = kb
+    return EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, None, None
+
+
+def _slot(kb):
+    embs = kb[0]
+    key = id(embs)
+    entry = _INDEXES.get(key)
+    # id() có thể bị tái sử dụng sau khi KB cũ bị giải phóng -> kiểm tra identity
+    if entry is None or entry[0] is not embs:
+        entry = (embs, {})
+        _INDEXES[key] = entry
+    return entry[1]
+
+
+def get_kb_index(kb, name: str, builder):
+    """
+    Lấy index `name` của KB; nếu chưa có thì gọi builder() đúng 1 lần (thread-safe).
+    Thread khác cần cùng index thì chờ; cần index khác thì không bị chặn.
+    """
+    key = (id(kb[0]), name)
+    with _lock:
+        slot = _slot(kb)
+        if name in slot:
+            return slot[name]
+        build_lock = _BUILD_LOCKS.setdefault(key, threading.RLock())  # RLock: builder có thể gọi lồng
+
+    with build_lock:
+        with _lock:
+            slot = _slot(kb)
+            if name in slot:
+                return slot[name]
+        value = builder()
+        with _lock:
+            value = _slot(kb).setdefault(name, value)
+            if _BUILD_LOCKS.get(key) is build_lock:
+                del _BUILD_LOCKS[key]
+        return value
+
+
+def set_kb_index(kb, name: str, value) -> None:
+    """
+    Gắn sẵn index đã build/load từ trước (vd: sidecar file) cho KB.
+    """
+    with _lock:
+        _slot(kb)[name] = value
+
+
+def kb_version(kb) -> str:
+    """
+    Fingerprint ngắn của KB (ids + embeddings). Dùng làm khoá cache / kiểm tra sidecar.
+    """
+    def build():
+        EMBS = kb[0]
+        IDS = unpack_kb(kb)[6]
+        h = hashlib.sha1()
+        h.update("\x1f".join(str(x) for x in IDS).encode("utf-8"))
+        h.update(np.ascontiguousarray(EMBS, dtype=np.float32).tobytes())
+        return h.hexdigest()[:16]
+
+    return get_kb_index(kb, "version", build)
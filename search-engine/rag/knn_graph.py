@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from rag.kb_index import get_kb_index, kb_version, set_kb_index, unpack_kb
+from rag.verbatim import parse_parent_and_index
+
+# ======================
+# kNN DOCUMENT GRAPH (build-time)
+#   - Mỗi doc lưu sẵn k láng giềng gần nhất theo cosine (EMBS đã normalize)
+#   - Tính theo từng block (block x N) để không cần ma trận N x N
+#   - Query time: gợi ý "Có thể bạn quan tâm" = tra bảng, không nhân ma trận
+# ======================
+
+KNN_SUFFIX = ".knn.npz"
+
+
+@dataclass(frozen=True)
+class KnnGraph:
+    """
+    idx    : [N, k] int32 — index láng giềng trong KB (giảm dần theo score)
+    score  : [N, k] float32 — cosine tương ứng
+    version: kb_version của KB đã dùng để build
+    """
+    idx: np.ndarray
+    score: np.ndarray
+    version: str = ""
+
+
+def build_knn_graph(EMBS, k: int = 16, block_size: int = 1024, version: str = "") -> KnnGraph:
+    embs = np.ascontiguousarray(EMBS, dtype=np.float32)
+    n = embs.shape[0]
+    k = max(1, min(k, n - 1))
+
+    out_idx = np.empty((n, k), dtype=np.int32)
+    out_score = np.empty((n, k), dtype=np.float32)
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        sims = embs[start:end] @ embs.T                      # [B, N]
+        rows = np.arange(end - start)
+        sims[rows, start + rows] = -np.inf                   # bỏ chính nó
+
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]  # top-k chưa sắp
+        part_scores = np.take_along_axis(sims, part, axis=1)
+        order = np.argsort(-part_scores, axis=1)
+
+        out_idx[start:end] = np.take_along_axis(part, order, axis=1)
+        out_score[start:end] = np.take_along_axis(part_scores, order, axis=1)
+
+    return KnnGraph(idx=out_idx, score=out_score, version=version)
+
+
+def save_knn_graph(path, graph: KnnGraph) -> None:
+    np.savez(path, idx=graph.idx, score=graph.score, version=np.array(graph.version))
+
+
+def load_knn_graph(path, expected_version: Optional[str] = None) -> Optional[KnnGraph]:
+    """
+    Return None nếu file không tồn tại hoặc đã cũ (KB đổi sau khi build).
+    """
+    p = Path(path)
+    if not p.exists():
+        return None
+    data = np.load(p, allow_pickle=False)
+    version = str(data["version"]) if "version" in data else ""
+    if expected_version and version != expected_version:
+        return None
+    return KnnGraph(idx=data["idx"], score=data["score"], version=version)
+
+
+def knn_sidecar_path(npz_path) -> Path:
+    p = Path(npz_path)
+    return p.with_name(p.stem + KNN_SUFFIX)
+
+
+def attach_knn_graph(kb, npz_path) -> Optional[KnnGraph]:
+    """
+    Load sidecar <kb>.knn.npz (nếu còn khớp KB) và gắn vào KB cho pipeline dùng.
+    """
+    graph = load_knn_graph(knn_sidecar_path(npz_path), expected_version=kb_version(kb))
+    if graph is not None:
+        set_kb_index(kb, "knn", graph)
+    return graph
+
+
+def get_knn_graph(kb) -> KnnGraph:
+    # Chưa có sidecar -> build 1 lần trong process
+    return get_kb_index(kb, "knn", lambda: build_knn_graph(kb[0], version=kb_version(kb)))
+
+
+def related_suggestions(
+    kb,
+    doc_idx: int,
+    *,
+    max_suggest: int,
+    min_score: float,
+    exclude_idx: Iterable[int] = (),
+) -> List[Dict[str, Any]]:
+    """
+    Láng giềng của doc_idx (đã build sẵn), bỏ:
+    - doc đã nằm trong ngữ cảnh (exclude_idx)
+    - chunk cùng parent với doc_idx
+    - câu hỏi trùng nhau
+    """
+    if max_suggest <= 0:
+        return []
+
+    QUESTIONS = unpack_kb(kb)[1]
+    IDS = unpack_kb(kb)[6]
+    graph = get_knn_graph(kb)
+
+    exclude = set(int(i) for i in exclude_idx)
+    exclude.add(int(doc_idx))
+    parent, _ = parse_parent_and_index(IDS[doc_idx])
+
+    out = []
+    seen_q = set()
+    for j, sc in zip(graph.idx[doc_idx].tolist(), graph.score[doc_idx].tolist()):
+        if sc < min_score:
+            break
+        if j in exclude or parse_parent_and_index(IDS[j])[0] == parent:
+            continue
+        q = str(QUESTIONS[j]) if QUESTIONS is not None else ""
+        key = q.strip().lower()
+        if not key or key in seen_q:
+            continue
+        seen_q.add(key)
+        out.append({"idx": j, "id": str(IDS[j]), "question": q, "score": float(sc)})
+        if len(out) >= max_suggest:
+            break
+    return out
@@ -0,0 +1,215 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from rag.config import RAGConfig
+from rag.generator import call_finetune_with_context
+from rag.kb_index import get_kb_index, unpack_kb
+from rag.partitions import get_partition_index, partition_spans
+from rag.retriever import _parse_tags_any_format
+from rag.verbatim import parse_parent_and_index
+
+# ======================
+# LISTING ENGINE ("liệt kê / danh sách")
+#   - Inverted index tag -> doc indices (build 1 lần / KB)
+#   - Liệt kê TOÀN BỘ doc khớp must/any theo thứ tự KB (ổn định) -> phân trang bằng cursor
+#   - Không cần embedding / similarity scan
+# ======================
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+@dataclass
+class ListingPage:
+    """
+    items      : doc (1 doc / parent) của trang hiện tại, theo thứ tự KB
+    groups     : facet tag -> items (giữ thứ tự)
+    total      : tổng số mục khớp (sau khi gộp chunk theo parent)
+    cursor     : cursor của trang hiện tại
+    next_cursor: None nếu đã hết
+    """
+    items: List[Dict[str, Any]]
+    groups: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    total: int = 0
+    cursor: str = "0"
+    next_cursor: Optional[str] = None
+
+
+def build_tag_index(TAGS_V2) -> Dict[str, np.ndarray]:
+    postings: Dict[str, List[int]] = {}
+    if TAGS_V2 is None:
+        return {}
+    for i, raw in enumerate(TAGS_V2):
+        for t in _parse_tags_any_format(raw):
+            postings.setdefault(t, []).append(i)
+    # index tăng dần (đã đúng thứ tự vì duyệt tuần tự)
+    return {t: np.asarray(ix, dtype=np.int64) for t, ix in postings.items()}
+
+
+def get_tag_index(kb) -> Dict[str, np.ndarray]:
+    TAGS_V2 = unpack_kb(kb)[7]
+    return get_kb_index(kb, "tag_index", lambda: build_tag_index(TAGS_V2))
+
+
+def _union(index: Dict[str, np.ndarray], tags: Sequence[str]) -> np.ndarray:
+    arrs = [index[t] for t in tags if t in index]
+    if not arrs:
+        return _EMPTY
+    return np.unique(np.concatenate(arrs))
+
+
+def _intersect(index: Dict[str, np.ndarray], tags: Sequence[str]) -> np.ndarray:
+    out = None
+    for t in tags:
+        arr = index.get(t, _EMPTY)
+        out = arr if out is None else np.intersect1d(out, arr, assume_unique=True)
+        if not len(out):
+            return _EMPTY
+    return _EMPTY if out is None else out
+
+
+def _partition_rows(kb, partitions: Optional[Sequence[str]]) -> Optional[np.ndarray]:
+    if not partitions:
+        return None
+    pindex = get_partition_index(kb)
+    spans = partition_spans(pindex, partitions)
+    if not spans:
+        return None
+    return np.sort(np.concatenate([pindex.order[s:e] for s, e in spans]))
+
+
+def enumerate_by_tags(kb, must_tags: Sequence[str], any_tags: Sequence[str], partitions=None) -> np.ndarray:
+    """
+    Doc indices khớp: (có đủ must_tags) AND (có ít nhất 1 any_tags), sắp theo thứ tự KB.
+    Giống retriever: không có doc khớp any -> bỏ any (chỉ giữ must).
+    """
+    index = get_tag_index(kb)
+    must_tags = list(must_tags or [])
+    any_tags = list(any_tags or [])
+    if not index or not (must_tags or any_tags):
+        return _EMPTY
+
+    docs = _EMPTY
+    if must_tags:
+        base = _intersect(index, must_tags)
+        if any_tags:
+            docs = np.intersect1d(base, _union(index, any_tags), assume_unique=True)
+        if not len(docs):
+            docs = base
+    else:
+        docs = _union(index, any_tags)
+
+    rows = _partition_rows(kb, partitions)
+    if rows is not None and len(docs):
+        docs = np.intersect1d(docs, rows, assume_unique=True)
+    return docs
+
+
+def _collapse_parents(kb, docs: np.ndarray) -> List[List[int]]:
+    """
+    Gộp chunk cùng parent (<parent>_chunk_<NN>) thành 1 mục, giữ thứ tự xuất hiện đầu tiên.
+    """
+    IDS = unpack_kb(kb)[6]
+    groups: Dict[str, List[int]] = {}
+    for i in docs.tolist():
+        parent, _ = parse_parent_and_index(IDS[i])
+        groups.setdefault(parent, []).append(i)
+    return list(groups.values())
+
+
+def _facet_of(tagset, must_tags: Sequence[str], any_tags: Sequence[str]) -> str:
+    for t in list(any_tags) + list(must_tags):
+        if t in tagset:
+            return t
+    return "khác"
+
+
+def _make_item(kb, members: List[int], must_tags, any_tags) -> Dict[str, Any]:
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = unpack_kb(kb)
+    i = members[0]
+    tagset = set()
+    for j in members:
+        tagset |= _parse_tags_any_format(TAGS_V2[j]) if TAGS_V2 is not None else set()
+    item = {
+        "idx": i,
+        "id": str(IDS[i]),
+        "parent": parse_parent_and_index(IDS[i])[0],
+        "question": str(QUESTIONS[i]) if QUESTIONS is not None else "",
+        "alt_question": str(ALT_QUESTIONS[i]) if ALT_QUESTIONS is not None else "",
+        "answer": str(ANSWERS[i]),
+        "n_chunks": len(members),
+        "facet": _facet_of(tagset, must_tags, any_tags),
+    }
+    if ENTITY_TYPE is not None:
+        item["entity_type"] = str(ENTITY_TYPE[i])
+    return item
+
+
+def _page_from(kb, entries: List[List[int]], offset: int, page_size: int, must_tags, any_tags) -> ListingPage:
+    chunk = entries[offset: offset + page_size]
+    items = [_make_item(kb, members, must_tags, any_tags) for members in chunk]
+
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for it in items:
+        groups.setdefault(it["facet"], []).append(it)
+
+    end = offset + len(chunk)
+    return ListingPage(
+        items=items,
+        groups=groups,
+        total=len(entries),
+        cursor=str(offset),
+        next_cursor=str(end) if end < len(entries) else None,
+    )
+
+
+def _parse_cursor(cursor: Optional[str]) -> int:
+    try:
+        return max(0, int(cursor or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def list_page(kb, must_tags, any_tags, *, partitions=None, cursor: Optional[str] = None, page_size: int = 50) -> ListingPage:
+    docs = enumerate_by_tags(kb, must_tags, any_tags, partitions=partitions)
+    entries = _collapse_parents(kb, docs)
+    return _page_from(kb, entries, _parse_cursor(cursor), page_size, must_tags, any_tags)
+
+
+def iter_listing_pages(kb, must_tags, any_tags, *, partitions=None, page_size: int = 50) -> Iterator[ListingPage]:
+    """
+    Stream lần lượt mọi trang (thứ tự ổn định), không build lại index giữa các trang.
+    """
+    docs = enumerate_by_tags(kb, must_tags, any_tags, partitions=partitions)
+    entries = _collapse_parents(kb, docs)
+    for offset in range(0, len(entries), page_size):
+        yield _page_from(kb, entries, offset, page_size, must_tags, any_tags)
+
+
+def summarize_listing_with_llm(client, user_query: str, page: ListingPage, max_chars: int = RAGConfig.max_source_chars_per_call) -> str:
+    """
+    Tóm tắt danh sách bằng LLM theo từng lô (mỗi lô <= max_chars ký tự ngữ cảnh).
+    """
+    batches, cur, cur_len = [], [], 0
+    for it in page.items:
+        block = f"[{it['facet']}] {it['question']}\n{it['answer']}"
+        if cur and cur_len + len(block) > max_chars:
+            batches.append(cur); cur = []; cur_len = 0
+        cur.append(block)
+        cur_len += len(block)
+    if cur:
+        batches.append(cur)
+
+    parts = []
+    for no, blocks in enumerate(batches, start=1):
+        context = "\n\n--------------------\n\n".join(blocks)
+        text = call_finetune_with_context(
+            client=client,
+            user_query=user_query,
+            context=context,
+            answer_mode="listing",
+            rag_mode="STRICT",
+        )
+        parts.append(text if len(batches) == 1 else f"=== PHẦN {no}/{len(batches)} ===\n{text}")
+    return "\n\n".join(parts)
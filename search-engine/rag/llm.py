@@ -0,0 +1,423 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from rag.config import RAGConfig
+
+# ======================
+# LLM GATEWAY (chat.completions / embeddings / responses) + HEDGING
+#   - Mọi call site gọi qua chat_completion / embedding_create / responses_create (site=...)
+#   - make_client: 1 HTTP client keep-alive dùng chung (pool kết nối), SDK không tự retry
+#   - Token bucket: giới hạn request/phút + token/phút (ước lượng trước khi gửi)
+#   - Retry lỗi tạm thời (429/5xx/timeout/mất kết nối), backoff có jitter, tôn trọng Retry-After
+#   - Timeout mỗi call; thống kê theo call site: latency p50/p90/p95/p99, retry, token usage
+#   - Hedging (opt-in, RAGConfig.use_hedging): request chưa xong sau p95 của site
+#     -> bắn thêm 1 bản sao, lấy bản nào xong trước
+#   - Giới hạn chi phí: số request hedge <= hedge_max_extra_ratio * số call của site
+# ======================
+
+LATENCY_WINDOW = 500
+CHARS_PER_TOKEN = 3.0  # như context_builder: ước lượng thô cho tiếng Việt
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError"}
+
+
+# ---------- client + rate limit ----------
+
+def make_client(api_key=None, cfg=RAGConfig):
+    """
+    OpenAI client với httpx pool keep-alive dùng chung; retry do gateway lo (max_retries=0).
+    """
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=cfg.llm_max_connections,
+            max_keepalive_connections=cfg.llm_max_connections,
+            keepalive_expiry=60.0,
+        ),
+        timeout=cfg.llm_timeout_s,
+    )
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=0, timeout=cfg.llm_timeout_s)
+
+
+class TokenBucket:
+    """
+    Bucket dung lượng per_minute, nạp đều theo thời gian. per_minute <= 0 -> không giới hạn.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        Chờ tới khi đủ amount (amount > capacity bị cắt về capacity). Return số giây đã chờ.
+        """
+        if self.capacity <= 0:
+            return 0.0
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                sleep_s = (amount - self.level) / self.rate
+            time.sleep(sleep_s)
+            waited += sleep_s
+
+
+class RateLimiter:
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, tokens: float) -> float:
+        return self.requests.acquire(1) + self.tokens.acquire(tokens)
+
+
+RATE_LIMITER = RateLimiter(RAGConfig.llm_rpm_limit, RAGConfig.llm_tpm_limit)
+
+
+def _text_chars(x) -> int:
+    if x is None:
+        return 0
+    if isinstance(x, str):
+        return len(x)
+    if isinstance(x, dict):
+        return sum(_text_chars(v) for k, v in x.items() if k in ("content", "text", "input"))
+    if isinstance(x, (list, tuple)):
+        return sum(_text_chars(v) for v in x)
+    return 0
+
+
+def estimate_request_tokens(kwargs) -> int:
+    """
+    Token prompt (ước lượng theo ký tự) + trần output, giống cách API tính TPM.
+    """
+    chars = _text_chars(kwargs.get("messages")) + _text_chars(kwargs.get("input"))
+    out = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens") or kwargs.get("max_output_tokens") or 0
+    return int(chars / CHARS_PER_TOKEN) + int(out)
+
+
+def is_retryable(e: Exception) -> bool:
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return type(e).__name__ in RETRYABLE_ERRORS or isinstance(e, (TimeoutError, ConnectionError))
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, cfg=RAGConfig, retry_after: Optional[float] = None) -> float:
+    """
+    Full jitter: uniform(0, min(max, base * 2^attempt)); server gửi Retry-After thì chờ ít nhất bằng đó.
+    """
+    delay = random.uniform(0.0, min(cfg.llm_backoff_max_s, cfg.llm_backoff_base_s * (2 ** attempt)))
+    return max(delay, retry_after or 0.0)
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    quantile: float = 0.95
+    min_samples: int = 20        # chưa đủ mẫu -> chưa hedge (p95 chưa tin được)
+    min_delay_ms: float = 300.0  # không hedge sớm hơn mức này
+    max_extra_ratio: float = 0.10
+
+    @classmethod
+    def from_config(cls, cfg=RAGConfig) -> Optional["HedgePolicy"]:
+        if not cfg.use_hedging:
+            return None
+        return cls(
+            quantile=cfg.hedge_quantile,
+            min_samples=cfg.hedge_min_samples,
+            min_delay_ms=cfg.hedge_min_delay_ms,
+            max_extra_ratio=cfg.hedge_max_extra_ratio,
+        )
+
+
+class SiteStats:
+    """
+    Thống kê 1 call site: latency (giây, chỉ request gốc thành công) + đếm call/hedge/lỗi.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.rate_limited_s = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self.latencies:
+                return None
+            return float(np.quantile(np.fromiter(self.latencies, dtype=np.float64), q))
+
+    def incr(self, field: str, amount=1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def record_usage(self, usage) -> None:
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            self.prompt_tokens += int(getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", 0) or 0)
+            self.completion_tokens += int(getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", 0) or 0)
+            self.cached_tokens += int(getattr(details, "cached_tokens", 0) or 0)
+
+    def try_reserve_hedge(self, max_extra_ratio: float) -> bool:
+        with self._lock:
+            if self.hedged + 1 > max_extra_ratio * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = np.fromiter(self.latencies, dtype=np.float64)
+            out = {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "rate_limited_s": round(self.rate_limited_s, 3),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+        if len(lat):
+            for name, q in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99)):
+                out[f"{name}_ms"] = round(float(np.quantile(lat, q)) * 1000, 1)
+        return out
+
+
+_SITES: Dict[str, SiteStats] = {}
+_sites_lock = threading.Lock()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def site_stats(site: str) -> SiteStats:
+    with _sites_lock:
+        stats = _SITES.get(site)
+        if stats is None:
+            stats = _SITES[site] = SiteStats()
+        return stats
+
+
+def llm_stats() -> Dict[str, Dict[str, Any]]:
+    with _sites_lock:
+        sites = dict(_SITES)
+    return {site: s.snapshot() for site, s in sorted(sites.items())}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=RAGConfig.hedge_max_workers, thread_name_prefix="llm-hedge")
+        return _executor
+
+
+class _UsageStream:
+    """
+    Bọc stream chat.completions: ghi usage ở chunk cuối (stream_options.include_usage), giữ close().
+    """
+
+    def __init__(self, stream, stats: SiteStats):
+        self._stream = stream
+        self._stats = stats
+        self.usage = None
+
+    def __iter__(self):
+        for chunk in self._stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                self.usage = usage
+                self._stats.record_usage(usage)
+            yield chunk
+
+    def close(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if callable(close):
+            close()
+
+
+def usage_dict(usage) -> Dict[str, int]:
+    """
+    usage của response (hoặc stream đã đọc hết) -> {prompt_tokens, cached_tokens, completion_tokens}.
+    """
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+        "cached_tokens": int(getattr(details, "cached_tokens", 0) or 0),
+        "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+    }
+
+
+def add_usage(total: Dict[str, int], usage) -> Dict[str, int]:
+    """
+    Cộng dồn usage_dict(usage) vào total (nhiều call LLM trong 1 câu trả lời).
+    """
+    for k, v in usage_dict(usage).items():
+        total[k] = total.get(k, 0) + v
+    return total
+
+
+def _call(create, stats: SiteStats, kwargs, record_latency: bool = True, cfg=RAGConfig):
+    """
+    1 call qua gateway: rate limit -> create(timeout=...) -> retry lỗi tạm thời (backoff + jitter).
+    """
+    kwargs = {"timeout": cfg.llm_timeout_s, **kwargs}
+    tokens = estimate_request_tokens(kwargs)
+    for attempt in range(cfg.llm_max_retries + 1):
+        stats.incr("rate_limited_s", RATE_LIMITER.acquire(tokens))
+        t0 = time.perf_counter()
+        try:
+            resp = create(**kwargs)
+        except Exception as e:
+            if attempt >= cfg.llm_max_retries or not is_retryable(e):
+                raise
+            stats.incr("retries")
+            time.sleep(backoff_delay(attempt, cfg, _retry_after(e)))
+            continue
+        if record_latency:
+            stats.record(time.perf_counter() - t0)
+        if kwargs.get("stream"):
+            return _UsageStream(resp, stats)
+        stats.record_usage(getattr(resp, "usage", None))
+        return resp
+
+
+def _timed_create(client, stats: SiteStats, kwargs, record_latency: bool = True):
+    return _call(client.chat.completions.create, stats, kwargs, record_latency)
+
+
+def _close_loser(fut) -> None:
+    # stream thua cuộc: đóng kết nối, không đọc tiếp
+    try:
+        resp = fut.result()
+    except Exception:
+        return
+    close = getattr(resp, "close", None)
+    if callable(close):
+        close()
+
+
+def chat_completion(client, *, site: str, hedge: Optional[HedgePolicy] = None, **kwargs):
+    """
+    client.chat.completions.create(**kwargs) có đo latency theo site.
+    hedge=None -> lấy theo RAGConfig (use_hedging=False thì gọi thẳng, không qua thread pool).
+    Với stream=True: hedge áp dụng cho thời gian tới khi nhận được response (header / chunk đầu)
+    -> caller dùng site riêng cho stream ("generate_stream", "global_stream"), không chung site
+    với call không stream (p95 cả câu trả lời).
+    """
+    stats = site_stats(site)
+    stats.incr("calls")
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    policy = hedge if hedge is not None else HedgePolicy.from_config()
+
+    delay = None
+    if policy is not None and len(stats.latencies) >= policy.min_samples:
+        delay = max(stats.quantile(policy.quantile), policy.min_delay_ms / 1000.0)
+
+    if delay is None:
+        try:
+            return _timed_create(client, stats, kwargs)
+        except Exception:
+            stats.incr("errors")
+            raise
+
+    executor = _get_executor()
+    primary = executor.submit(_timed_create, client, stats, kwargs)
+    done, _ = wait([primary], timeout=delay)
+    if done or not stats.try_reserve_hedge(policy.max_extra_ratio):
+        try:
+            return primary.result()
+        except Exception:
+            stats.incr("errors")
+            raise
+
+    # latency bản sao không ghi vào thống kê (chỉ đo phân phối của request gốc)
+    backup = executor.submit(_timed_create, client, stats, kwargs, False)
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        ok = [f for f in done if f.exception() is None]
+        if not ok:
+            error = next(iter(done)).exception()
+            continue
+        winner = primary if primary in ok else backup
+        for other in (pending | done) - {winner}:
+            other.add_done_callback(_close_loser)
+        if winner is backup:
+            stats.incr("hedge_wins")
+        return winner.result()
+
+    stats.incr("errors")
+    raise error
+
+
+def embedding_create(client, *, site: str = "embed", **kwargs):
+    """
+    client.embeddings.create qua gateway (rate limit, retry, timeout, thống kê); không hedge.
+    """
+    stats = site_stats(site)
+    stats.incr("calls")
+    try:
+        return _call(client.embeddings.create, stats, kwargs)
+    except Exception:
+        stats.incr("errors")
+        raise
+
+
+def responses_create(client, *, site: str, **kwargs):
+    """
+    client.responses.create qua gateway (dùng cho script offline); không hedge.
+    """
+    stats = site_stats(site)
+    stats.incr("calls")
+    try:
+        return _call(client.responses.create, stats, kwargs)
+    except Exception:
+        stats.incr("errors")
+        raise
@@ -0,0 +1,174 @@
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+from rag.answer_cache import normalize_cache_query
+from rag.config import RAGConfig
+from rag.debug_log import debug_log
+from rag.kb_index import kb_version
+from rag.llm import chat_completion
+from rag.retrieval_cache import LRUCache
+
+# ======================
+# LLM RERANK (song song + cache)
+#   - Chia candidate thành batch nhỏ, chấm điểm đồng thời (thread pool dùng chung)
+#   - Batch lỗi JSON / lỗi API chỉ mất điểm của batch đó
+#   - Cache điểm theo (query đã normalize, doc id, KB version); batch về trễ vẫn ghi cache
+#   - Điểm LLM ghi vào h["llm_rerank_score"] (thang 0–1, khác thang sigmoid của local rerank)
+#   - Hết deadline -> dùng điểm đã có; doc chưa có điểm giữ rerank_score cũ (local rerank)
+#     hoặc fallback embedding trong fused_score, và luôn xếp sau doc đã chấm (scoring.rank_key)
+# ======================
+
+RERANK_MODEL = "gpt-4o-mini"
+
+RERANK_SYSTEM_PROMPT = (
+    "Bạn là LLM dùng để RERANK tài liệu cho hệ thống vật tư BMCVN. "
+    "Bạn CHỈ được trả về JSON THUẦN, không có code block hay markdown."
+)
+
+RERANK_CACHE = LRUCache(RAGConfig.rerank_cache_max_entries)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_json_list_re = re.compile(r"\[.*\]", re.DOTALL)
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-rerank")
+        return _executor
+
+
+def rerank_key(norm_query: str, doc_id: str, kb_ver: str):
+    return (normalize_cache_query(norm_query), str(doc_id), kb_ver)
+
+
+def build_rerank_prompt(norm_query: str, batch: List[Dict], snippet_chars: int = 1200) -> str:
+    doc_texts = []
+    for i, h in enumerate(batch):
+        ans = str(h.get("answer", ""))
+        if len(ans) > snippet_chars:
+            ans = ans[:snippet_chars] + " ..."
+        doc_texts.append(
+            f"[DOC {i}]\nQUESTION: {h.get('question', '')}\nALT_QUESTION: {h.get('alt_question', '')}\nANSWER_SNIPPET:\n{ans}"
+        )
+    docs_block = "\n\n------------------------\n\n".join(doc_texts)
+
+    return f"""
+CÂU HỎI:
+\"\"\"{norm_query}\"\"\"
+
+CÁC TÀI LIỆU ỨNG VIÊN:
+{docs_block}
+
+YÊU CẦU:
+- Chấm điểm LIÊN QUAN từng DOC trong khoảng 0–1.
+- Trả về DUY NHẤT JSON, ví dụ:
+[
+  {{"doc_index": 0, "score": 0.92}},
+  {{"doc_index": 1, "score": 0.85}}
+]
+- KHÔNG dùng ```json hoặc bất kỳ code block nào.
+- KHÔNG giải thích thêm.
+- Nếu không thể trả JSON đúng, TRẢ JSON RỖNG: [].
+""".strip()
+
+
+def parse_rerank_scores(text: str, n: int) -> Dict[int, float]:
+    """
+    JSON list [{"doc_index", "score"}] -> {doc_index: score in [0, 1]}; item hỏng thì bỏ qua item đó.
+    Không có JSON list -> ValueError (batch tính là lỗi).
+    """
+    cleaned = (text or "").replace("```json", "").replace("```", "").strip()
+    m = _json_list_re.search(cleaned)
+    if not m:
+        raise ValueError(f"rerank: không có JSON list: {cleaned[:80]!r}")
+    ranking = json.loads(m.group(0))
+    out = {}
+    for item in ranking if isinstance(ranking, list) else []:
+        try:
+            di = int(item.get("doc_index", -1))
+            sc = float(item.get("score", 0))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if 0 <= di < n:
+            out[di] = min(max(sc, 0.0), 1.0)
+    return out
+
+
+def _score_batch(client, norm_query: str, batch: List[Dict], kb_ver: str, model: str, snippet_chars: int) -> Dict[str, float]:
+    resp = chat_completion(
+        client,
+        site="rerank",
+        model=model,
+        temperature=0.0,
+        messages=[
+            {"role": "system", "content": RERANK_SYSTEM_PROMPT},
+            {"role": "user", "content": build_rerank_prompt(norm_query, batch, snippet_chars)},
+        ],
+    )
+    scores = parse_rerank_scores(resp.choices[0].message.content, len(batch))
+    out = {}
+    for di, sc in scores.items():
+        doc_id = batch[di]["id"]
+        out[doc_id] = sc
+        RERANK_CACHE.put(rerank_key(norm_query, doc_id, kb_ver), sc)
+    return out
+
+
+def llm_rerank(client, kb, norm_query: str, hits: List[Dict], cfg=RAGConfig, model: str = RERANK_MODEL) -> Dict[str, int]:
+    """
+    Gán h["llm_rerank_score"] (in-place) cho top cfg.top_k_rerank hit.
+    Return thống kê: scored / cached / failed_batches / late_batches.
+    """
+    candidates = hits[: cfg.top_k_rerank]
+    stats = {"candidates": len(candidates), "scored": 0, "cached": 0, "failed_batches": 0, "late_batches": 0}
+    if len(candidates) <= 1:
+        return stats
+
+    kb_ver = kb_version(kb)
+    scores: Dict[str, float] = {}
+    missing = []
+    for h in candidates:
+        sc = RERANK_CACHE.get(rerank_key(norm_query, h["id"], kb_ver))
+        if sc is None:
+            missing.append(h)
+        else:
+            scores[h["id"]] = sc
+    stats["cached"] = len(scores)
+
+    if missing:
+        executor = _get_executor(cfg.rerank_max_workers)
+        futures = [
+            executor.submit(_score_batch, client, norm_query, missing[i: i + cfg.rerank_batch_size],
+                            kb_ver, model, cfg.rerank_snippet_chars)
+            for i in range(0, len(missing), cfg.rerank_batch_size)
+        ]
+        done, not_done = wait(futures, timeout=cfg.rerank_deadline_ms / 1000.0)
+        for fut in not_done:
+            fut.cancel()  # batch chưa chạy thì huỷ; batch đang chạy vẫn ghi cache khi xong
+        stats["late_batches"] = len(not_done)
+
+        for fut in done:
+            try:
+                scores.update(fut.result())
+            except Exception as e:
+                stats["failed_batches"] += 1
+                debug_log("=== LLM RERANK BATCH FAILED ===", repr(e))
+
+    for h in candidates:
+        if h["id"] in scores:
+            h["llm_rerank_score"] = scores[h["id"]]
+    stats["scored"] = sum(1 for h in candidates if h["id"] in scores)
+
+    if cfg.debug_rerank:
+        debug_log(
+            "=== LLM RERANK ===",
+            json.dumps(stats, ensure_ascii=False),
+            "\n".join(f"{scores.get(h['id'], '-')}\t{h['id']}" for h in candidates),
+        )
+    return stats
@@ -0,0 +1,215 @@
+import json
+import math
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from rag.kb_index import get_kb_index, unpack_kb
+from rag.listing import get_tag_index
+from rag.tag_filter import _norm
+from rag.text_utils import extract_codes_from_query
+
+# ======================
+# LOCAL RERANKER (thay LLM rerank)
+#   - Feature cho cả candidate pool, tính vector hoá (numpy), không gọi API:
+#     dense sim | match_count | stage STRICT | BM25 (text bỏ dấu) | code hit | tag hit | entity_type khớp
+#   - rerank_score = sigmoid(w·x + b) -> scoring.fused_score dùng như LLM rerank cũ
+#   - Trọng số fit offline (run/fit_reranker.py) -> JSON; chưa có file trọng số -> không rerank
+# ======================
+
+FEATURES = ("dense", "match_count", "stage_strict", "bm25", "code_hit", "tag_hit", "entity_match")
+WEIGHTS_PATH = "local_rerank_weights.json"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+_word_re = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _word_re.findall(_norm(text))
+
+
+# ---------- BM25 index (CSR: doc -> term ids + trọng số BM25 đã tính sẵn) ----------
+
+@dataclass(frozen=True)
+class Bm25Index:
+    vocab: Dict[str, int]
+    indptr: np.ndarray   # [N+1]
+    indices: np.ndarray  # term id
+    weights: np.ndarray  # idf * tf-saturation
+
+
+def build_bm25_index(kb) -> Bm25Index:
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = unpack_kb(kb)
+    n = len(ANSWERS)
+    vocab: Dict[str, int] = {}
+    rows_terms, rows_tfs, lengths = [], [], np.zeros(n, dtype=np.float32)
+
+    for i in range(n):
+        text = " ".join(str(x[i]) for x in (QUESTIONS, ALT_QUESTIONS, ANSWERS) if x is not None)
+        counts: Dict[int, int] = {}
+        toks = tokenize(text)
+        for t in toks:
+            tid = vocab.setdefault(t, len(vocab))
+            counts[tid] = counts.get(tid, 0) + 1
+        rows_terms.append(np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)))
+        rows_tfs.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        lengths[i] = len(toks)
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(r) for r in rows_terms])
+    indices = np.concatenate(rows_terms) if n else np.zeros(0, dtype=np.int32)
+    tfs = np.concatenate(rows_tfs) if n else np.zeros(0, dtype=np.float32)
+
+    df = np.bincount(indices, minlength=len(vocab)).astype(np.float32)
+    idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+    dl = np.repeat(lengths, np.diff(indptr))
+    avgdl = float(lengths.mean()) if n else 1.0
+    weights = idf[indices] * tfs * (BM25_K1 + 1) / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * dl / max(avgdl, 1.0)))
+
+    return Bm25Index(vocab=vocab, indptr=indptr, indices=indices, weights=weights.astype(np.float32))
+
+
+def get_bm25_index(kb) -> Bm25Index:
+    return get_kb_index(kb, "bm25", lambda: build_bm25_index(kb))
+
+
+def bm25_scores(index: Bm25Index, query: str, cand_idx: np.ndarray) -> np.ndarray:
+    """
+    BM25 của query với từng candidate: gom slice CSR của các candidate rồi bincount.
+    """
+    q_ids = np.array(sorted({index.vocab[t] for t in tokenize(query) if t in index.vocab}), dtype=np.int32)
+    n = len(cand_idx)
+    if n == 0 or len(q_ids) == 0:
+        return np.zeros(n, dtype=np.float32)
+
+    starts = index.indptr[cand_idx]
+    lens = index.indptr[cand_idx + 1] - starts
+    row = np.repeat(np.arange(n), lens)
+    pos = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens) + np.repeat(starts, lens)
+
+    hit = np.isin(index.indices[pos], q_ids, assume_unique=False)
+    return np.bincount(row[hit], weights=index.weights[pos][hit], minlength=n).astype(np.float32)
+
+
+# ---------- features ----------
+
+def rerank_features(kb, norm_query: str, hits: List[Dict], query_tags: Sequence[str] = (), entity_type=None) -> np.ndarray:
+    """
+    [n, len(FEATURES)] float32, mọi cột trong khoảng ~[0, 1].
+    """
+    ENTITY_TYPE = unpack_kb(kb)[8]
+    n = len(hits)
+    X = np.zeros((n, len(FEATURES)), dtype=np.float32)
+    if n == 0:
+        return X
+
+    cand_idx = np.array([h.get("idx", 0) for h in hits], dtype=np.int64)
+
+    X[:, 0] = [float(h.get("raw_sim", h.get("score", 0.0))) for h in hits]
+    X[:, 1] = np.minimum(np.array([h.get("match_count", 0) for h in hits], dtype=np.float32) / 4.0, 1.0)
+    X[:, 2] = [1.0 if h.get("stage", "STRICT") == "STRICT" else 0.0 for h in hits]
+
+    bm = bm25_scores(get_bm25_index(kb), norm_query, cand_idx)
+    X[:, 3] = bm / (bm.max() + 1e-6)
+
+    codes = [c.lower() for c in extract_codes_from_query(norm_query)]
+    if codes:
+        X[:, 4] = [
+            1.0 if any(c in (str(h.get("question", "")) + " " + str(h.get("answer", ""))).lower() for c in codes) else 0.0
+            for h in hits
+        ]
+
+    tags = [t for t in query_tags or [] if t]
+    if tags:
+        tag_index = get_tag_index(kb)
+        hit_count = np.zeros(n, dtype=np.float32)
+        for t in tags:
+            rows = tag_index.get(t)
+            if rows is not None:
+                hit_count += np.isin(cand_idx, rows)
+        X[:, 5] = hit_count / len(tags)
+
+    if ENTITY_TYPE is not None and entity_type and entity_type != "general":
+        wanted = set(entity_type) if isinstance(entity_type, tuple) else {entity_type}
+        X[:, 6] = np.isin(ENTITY_TYPE[cand_idx].astype(str), list(wanted))
+
+    return X
+
+
+# ---------- model ----------
+
+@dataclass(frozen=True)
+class RerankWeights:
+    w: np.ndarray
+    b: float
+
+    @classmethod
+    def load(cls, path=WEIGHTS_PATH) -> Optional["RerankWeights"]:
+        p = Path(path)
+        if not p.exists():
+            return None
+        data = json.loads(p.read_text(encoding="utf-8"))
+        w = np.array([float(data["weights"].get(f, 0.0)) for f in FEATURES], dtype=np.float32)
+        return cls(w=w, b=float(data.get("bias", 0.0)))
+
+    def save(self, path=WEIGHTS_PATH, **meta) -> None:
+        data = {"features": list(FEATURES), "weights": dict(zip(FEATURES, map(float, self.w))), "bias": float(self.b), **meta}
+        Path(path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def score(self, X: np.ndarray) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-(X @ self.w + self.b)))
+
+
+_WEIGHTS_CACHE: Dict[str, Optional[RerankWeights]] = {}
+
+
+def get_rerank_weights(path=WEIGHTS_PATH) -> Optional[RerankWeights]:
+    key = str(path)
+    if key not in _WEIGHTS_CACHE:
+        _WEIGHTS_CACHE[key] = RerankWeights.load(path)
+    return _WEIGHTS_CACHE[key]
+
+
+def local_rerank(kb, norm_query: str, hits: List[Dict], query_tags=(), entity_type=None, weights_path=WEIGHTS_PATH) -> List[Dict]:
+    """
+    Gán h["rerank_score"] cho TẤT CẢ hit (in-place). Không có trọng số -> giữ nguyên.
+    Chấm hết (vài trăm dòng features, rẻ): hit không có rerank_score sẽ xếp theo embedding
+    score (khác thang đo) và có thể vượt hit đã rerank.
+    """
+    weights = get_rerank_weights(weights_path)
+    if weights is None or not hits:
+        return hits
+    X = rerank_features(kb, norm_query, hits, query_tags, entity_type)
+    for h, s in zip(hits, weights.score(X).tolist()):
+        h["rerank_score"] = float(s)
+    return hits
+
+
+def fit_logistic(X: np.ndarray, y: np.ndarray, l2: float = 1e-3, lr: float = 0.5, epochs: int = 2000) -> RerankWeights:
+    """
+    Logistic regression (gradient descent, full batch) — đủ cho vài chục nghìn cặp (query, doc).
+    Cân bằng lớp bằng sample weight.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    pos = max(y.sum(), 1.0)
+    neg = max(len(y) - y.sum(), 1.0)
+    sw = np.where(y > 0, len(y) / (2 * pos), len(y) / (2 * neg))
+
+    w = np.zeros(X.shape[1])
+    b = 0.0
+    for _ in range(epochs):
+        p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+        g = (p - y) * sw
+        w -= lr * (X.T @ g / len(y) + l2 * w)
+        b -= lr * float(g.mean())
+    return RerankWeights(w=w.astype(np.float32), b=float(b))
+
+
+def log_loss(weights: RerankWeights, X: np.ndarray, y: np.ndarray) -> float:
+    p = np.clip(weights.score(np.asarray(X, dtype=np.float32)), 1e-6, 1 - 1e-6)
+    return float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))) if len(y) else math.nan
@@ -0,0 +1,364 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from rag.debug_log import debug_log
+
+# ======================
+# METRICS (in-process, dạng Prometheus)
+#   - Counter / Histogram (bucket cố định) theo label; hot path chỉ lock + cộng số
+#   - record_request(res, total_ms): pipeline gọi 1 lần / request
+#     (latency từng stage từ res["timings"], strategy, answer cache tier, tokens, degradation, escalation)
+#   - Collector đọc số liệu sẵn có lúc scrape: LLM call site (llm_stats), hit/miss các LRU cache
+#   - /metrics (text format Prometheus) trên cổng local + dump snapshot JSONL định kỳ
+# ======================
+
+# ms: từ stage vài ms (scan, filter) tới generate hàng chục giây
+LATENCY_BUCKETS_MS = (
+    1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 40000, 80000,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _fmt_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for lv, v in sorted(self.values().items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, lv)} {v:g}")
+        return lines
+
+    def snapshot(self) -> Dict[str, float]:
+        return {"|".join(lv) or "_": v for lv, v in sorted(self.values().items())}
+
+
+class _HistSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * (n_buckets + 1)  # bucket cuối = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """
+    Histogram bucket cố định (không giữ từng giá trị); p50/p95/p99 nội suy tuyến tính trong bucket.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS_MS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, _HistSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = _HistSeries(len(self.buckets))
+            s.counts[i] += 1
+            s.sum += value
+            s.count += 1
+
+    def _copy(self) -> Dict[LabelValues, Tuple[List[int], float, int]]:
+        with self._lock:
+            return {lv: (list(s.counts), s.sum, s.count) for lv, s in self._series.items()}
+
+    def quantile(self, counts: List[int], total: int, q: float) -> float:
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if c and seen + c >= rank:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * ((rank - seen) / c)
+            seen += c
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for lv, (counts, total_sum, count) in sorted(self._copy().items()):
+            cum = 0
+            for b, c in zip(self.buckets, counts):
+                cum += c
+                le = 'le="%g"' % b
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, le)} {cum}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, le)} {count}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, lv)} {total_sum:g}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, lv)} {count}")
+        return lines
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for lv, (counts, total_sum, count) in sorted(self._copy().items()):
+            if not count:
+                continue
+            out["|".join(lv) or "_"] = {
+                "count": count,
+                "mean": round(total_sum / count, 1),
+                "p50": round(self.quantile(counts, count, 0.50), 1),
+                "p95": round(self.quantile(counts, count, 0.95), 1),
+                "p99": round(self.quantile(counts, count, 0.99), 1),
+            }
+        return out
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name: str, factory):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = factory()
+            return m
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS_MS) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, help, labels, buckets))
+
+    def register_collector(self, fn: Callable[[], List[str]]) -> None:
+        """
+        fn() -> các dòng text Prometheus, gọi lúc scrape (số liệu module khác đã tự đếm).
+        """
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        for fn in collectors:
+            try:
+                lines.extend(fn())
+            except Exception as e:
+                debug_log("=== METRICS COLLECTOR FAILED ===", repr(e))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {"ts": time.time(), **{name: m.snapshot() for name, m in sorted(metrics.items())}}
+
+
+METRICS = MetricsRegistry()
+
+REQUESTS = METRICS.counter("rag_requests_total", "Số request theo route / strategy", ("route", "strategy"))
+ERRORS = METRICS.counter("rag_request_errors_total", "Số request lỗi (exception) theo loại lỗi", ("error",))
+REQUEST_MS = METRICS.histogram("rag_request_duration_ms", "Thời gian 1 request (ms)", ("route",))
+STAGE_MS = METRICS.histogram("rag_stage_duration_ms", "Thời gian từng stage (ms, theo trace span)", ("stage",))
+ANSWER_CACHE = METRICS.counter("rag_answer_cache_total", "Answer cache theo tier (exact/semantic/miss/off)", ("tier",))
+TOKENS = METRICS.counter("rag_llm_tokens_total", "Token LLM theo loại (prompt/cached/completion)", ("kind",))
+DEGRADATIONS = METRICS.counter("rag_budget_degradations_total", "Degradation do latency budget", ("name",))
+ESCALATIONS = METRICS.counter("rag_global_escalations_total", "GLOBAL escalate gpt-4.1-mini -> gpt-4.1", ("reason",))
+
+
+def strategy_label(strategy: str) -> str:
+    # "GLOBAL/gpt-4.1-mini->gpt-4.1" -> "GLOBAL": giữ số label nhỏ
+    return (strategy or "UNKNOWN").split("/", 1)[0]
+
+
+def record_request(res: Dict[str, Any], total_ms: float) -> None:
+    route = res.get("route", "RAG")
+    REQUESTS.inc(route, strategy_label(res.get("strategy", "")))
+    REQUEST_MS.observe(total_ms, route)
+
+    for stage, ms in ((res.get("timings") or {}).get("stages") or {}).items():
+        STAGE_MS.observe(ms, stage)
+    if "cache" in res:
+        ANSWER_CACHE.inc(str(res["cache"]))
+    for kind in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+        n = (res.get("usage") or {}).get(kind, 0)
+        if n:
+            TOKENS.inc(kind.replace("_tokens", ""), amount=n)
+    for name in (res.get("budget") or {}).get("degradations", []):
+        DEGRADATIONS.inc(name)
+    if res.get("escalated"):
+        ESCALATIONS.inc(res["escalated"])
+
+
+def record_error(exc: BaseException) -> None:
+    ERRORS.inc(type(exc).__name__)
+
+
+# ======================
+# COLLECTORS (số liệu module khác đã đếm sẵn)
+# ======================
+
+def _collect_llm_sites() -> List[str]:
+    from rag.llm import llm_stats
+
+    stats = llm_stats()
+    lines = []
+    counters = {
+        "calls": "rag_llm_calls_total",
+        "errors": "rag_llm_errors_total",
+        "retries": "rag_llm_retries_total",
+        "hedged": "rag_llm_hedged_total",
+        "prompt_tokens": "rag_llm_site_prompt_tokens_total",
+        "cached_tokens": "rag_llm_site_cached_tokens_total",
+        "completion_tokens": "rag_llm_site_completion_tokens_total",
+    }
+    for key, name in counters.items():
+        lines.append(f"# TYPE {name} counter")
+        for site, s in stats.items():
+            lines.append(f'{name}{{site="{_escape(site)}"}} {s.get(key, 0)}')
+    lines.append("# TYPE rag_llm_latency_ms gauge")
+    for site, s in stats.items():
+        for q in ("p50", "p95", "p99"):
+            if f"{q}_ms" in s:
+                lines.append(f'rag_llm_latency_ms{{site="{_escape(site)}",quantile="{q}"}} {s[f"{q}_ms"]}')
+    return lines
+
+
+def _collect_lru_caches() -> List[str]:
+    from rag.llm_rerank import RERANK_CACHE
+    from rag.retrieval_cache import QUERY_VEC_CACHE, RETRIEVAL_CACHE
+
+    caches = {"retrieval": RETRIEVAL_CACHE, "query_vec": QUERY_VEC_CACHE, "llm_rerank": RERANK_CACHE}
+    lines = ["# TYPE rag_cache_lookups_total counter"]
+    for name, cache in caches.items():
+        s = cache.stats()
+        lines.append(f'rag_cache_lookups_total{{cache="{name}",result="hit"}} {s["hits"]}')
+        lines.append(f'rag_cache_lookups_total{{cache="{name}",result="miss"}} {s["misses"]}')
+    lines.append("# TYPE rag_cache_entries gauge")
+    for name, cache in caches.items():
+        lines.append(f'rag_cache_entries{{cache="{name}"}} {len(cache)}')
+    return lines
+
+
+METRICS.register_collector(_collect_llm_sites)
+METRICS.register_collector(_collect_lru_caches)
+
+
+def full_snapshot() -> Dict[str, Any]:
+    """
+    Snapshot registry + LLM call site + cache hit rate (dạng dict, ghi JSONL).
+    """
+    from rag.llm import llm_stats
+    from rag.llm_rerank import RERANK_CACHE
+    from rag.retrieval_cache import QUERY_VEC_CACHE, RETRIEVAL_CACHE
+
+    snap = METRICS.snapshot()
+    snap["llm_sites"] = llm_stats()
+    snap["lru_caches"] = {
+        "retrieval": RETRIEVAL_CACHE.stats(),
+        "query_vec": QUERY_VEC_CACHE.stats(),
+        "llm_rerank": RERANK_CACHE.stats(),
+    }
+    return snap
+
+
+# ======================
+# EXPOSITION: /metrics + snapshot định kỳ
+# ======================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # không in mỗi lần scrape
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Prometheus scrape http://host:port/metrics (thread daemon).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="rag-metrics-http", daemon=True).start()
+    return server
+
+
+def start_snapshot_dumper(path: str, interval_s: float) -> Callable[[], None]:
+    """
+    Mỗi interval_s giây append 1 dòng JSON snapshot vào path. Return stop(): dừng + dump lần cuối.
+    """
+    stop = threading.Event()
+
+    def dump():
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(full_snapshot(), ensure_ascii=False) + "\n")
+
+    def loop():
+        while not stop.wait(interval_s):
+            try:
+                dump()
+            except Exception as e:
+                debug_log("=== METRICS SNAPSHOT FAILED ===", repr(e))
+        dump()
+
+    thread = threading.Thread(target=loop, name="rag-metrics-snapshot", daemon=True)
+    thread.start()
+
+    def stop_and_flush():
+        stop.set()
+        thread.join(timeout=5)
+
+    return stop_and_flush
+
+
+def start_metrics(cfg) -> Optional[Callable[[], None]]:
+    """
+    Bật exposition theo config (metrics_port > 0, metrics_snapshot_interval_s > 0).
+    Return stop() của snapshot dumper (None nếu không bật).
+    """
+    if not cfg.use_metrics:
+        return None
+    if cfg.metrics_port:
+        start_metrics_server(cfg.metrics_port, cfg.metrics_host)
+        print(f"Metrics: http://{cfg.metrics_host}:{cfg.metrics_port}/metrics")
+    if cfg.metrics_snapshot_interval_s and cfg.metrics_snapshot_path:
+        return start_snapshot_dumper(cfg.metrics_snapshot_path, cfg.metrics_snapshot_interval_s)
+    return None
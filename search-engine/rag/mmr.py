@@ -0,0 +1,62 @@
+from typing import Dict, List
+
+import numpy as np
+
+from rag.kb_index import unpack_kb
+from rag.scoring import rerank_tier
+
+# ======================
+# MMR (Maximal Marginal Relevance) cho context hits
+#   - Dữ liệu chunk overlap -> nhiều chunk gần như trùng nhau cùng vào NGỮ CẢNH
+#   - Chọn lần lượt doc có  λ·relevance − (1−λ)·max cosine(doc, các doc đã chọn)
+#   - Dùng sẵn EMBS của KB: 1 Gram matrix [m x m] cho m candidate, không gọi API
+#   - Gần trùng hẳn (cosine >= dup_threshold) -> bỏ luôn, không lấy thêm doc bù
+# ======================
+
+
+def mmr_select(
+    kb,
+    primary_doc: Dict,
+    candidates: List[Dict],
+    k: int,
+    lambda_mult: float = 0.7,
+    dup_threshold: float = 0.95,
+) -> List[Dict]:
+    """
+    Return tối đa k hit, primary_doc luôn đứng đầu.
+    relevance = fused_score (fallback score) của từng hit, cộng rerank_tier: hit đã rerank
+    luôn được chọn trước hit chưa chấm (trừ khi gần trùng doc đã chọn).
+    """
+    pool = [primary_doc] + [h for h in candidates if h is not primary_doc]
+    if k <= 1 or len(pool) == 1:
+        return pool[:max(k, 1)]
+
+    EMBS = unpack_kb(kb)[0]
+    has_vec = np.array(["idx" in h for h in pool])
+    idx = np.array([h.get("idx", 0) for h in pool], dtype=np.int64)
+
+    E = np.asarray(EMBS[idx], dtype=np.float32)
+    gram = E @ E.T                                   # [m, m]
+    gram[~has_vec, :] = 0.0                          # hit không có embedding -> không tính trùng
+    gram[:, ~has_vec] = 0.0
+
+    rel = np.array([rerank_tier(h) + float(h.get("fused_score", h.get("score", 0.0))) for h in pool], dtype=np.float32)
+
+    m = len(pool)
+    selected = [0]
+    available = np.ones(m, dtype=bool)
+    available[0] = False
+    max_sim = gram[0].copy()                         # max cosine tới tập đã chọn
+
+    while len(selected) < k:
+        available &= max_sim < dup_threshold
+        if not available.any():
+            break
+        mmr = lambda_mult * rel - (1.0 - lambda_mult) * max_sim
+        mmr[~available] = -np.inf
+        j = int(np.argmax(mmr))
+        selected.append(j)
+        available[j] = False
+        np.maximum(max_sim, gram[j], out=max_sim)
+
+    return [pool[j] for j in selected]
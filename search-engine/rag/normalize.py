@@ -1,5 +1,10 @@
+from rag.llm import chat_completion
+
+
 def normalize_query(client, q: str) -> str:
-    resp = client.chat.completions.create(
+    resp = chat_completion(
+        client,
+        site="normalize",
         model="gpt-4o-mini",
         temperature=0,
         messages=[
@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.kb_index import get_kb_index, unpack_kb
+
+# ======================
+# ENTITY-TYPE PARTITIONED INDEX
+#   - EMBS được sắp lại theo entity_type thành các khối liền nhau (contiguous)
+#   - Query có entity_type chắc chắn -> chỉ nhân ma trận trên các khối liên quan
+# ======================
+
+# entity_type của query (tag_filter.infer_entity_type) -> các partition của KB cần quét.
+# KB không có entity "pest": doc về sâu hại nằm trong disease/product.
+QUERY_ENTITY_PARTITIONS: Dict[str, Tuple[str, ...]] = {
+    "product": ("product",),
+    "disease": ("disease", "product"),
+    "pest": ("disease", "product"),
+    "weed": ("weed", "product"),
+    "procedure": ("procedure", "product"),
+    "registry": ("registry",),
+}
+
+# Các doc chưa phân loại luôn được quét kèm (ít, tránh mất recall)
+SHARED_PARTITIONS: Tuple[str, ...] = ("general", "")
+
+
+@dataclass(frozen=True)
+class PartitionIndex:
+    """
+    order: vị trí trong embs (đã sắp) -> index gốc trong KB
+    embs : EMBS sắp theo entity_type, float32 C-contiguous
+    spans: entity_type -> (start, end) trong embs
+    """
+    order: np.ndarray
+    embs: np.ndarray
+    spans: Dict[str, Tuple[int, int]]
+
+
+def _norm_entity(x) -> str:
+    s = str(x or "").strip().lower()
+    return "" if s in {"nan", "none"} else s
+
+
+def build_partition_index(EMBS, ENTITY_TYPE) -> PartitionIndex:
+    embs = np.asarray(EMBS, dtype=np.float32)
+    n = embs.shape[0]
+
+    if ENTITY_TYPE is None:
+        return PartitionIndex(
+            order=np.arange(n, dtype=np.int64),
+            embs=np.ascontiguousarray(embs),
+            spans={"": (0, n)},
+        )
+
+    labels = np.array([_norm_entity(x) for x in ENTITY_TYPE], dtype=object)
+    # stable sort: trong 1 partition giữ nguyên thứ tự KB
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+
+    spans: Dict[str, Tuple[int, int]] = {}
+    start = 0
+    for i in range(1, n + 1):
+        if i == n or sorted_labels[i] != sorted_labels[start]:
+            spans[str(sorted_labels[start])] = (start, i)
+            start = i
+
+    return PartitionIndex(
+        order=order.astype(np.int64),
+        embs=np.ascontiguousarray(embs[order]),
+        spans=spans,
+    )
+
+
+def get_partition_index(kb) -> PartitionIndex:
+    EMBS, *_rest, ENTITY_TYPE = unpack_kb(kb)
+    return get_kb_index(kb, "partitions", lambda: build_partition_index(EMBS, ENTITY_TYPE))
+
+
+def partitions_for_query(entity_type, entity_score: Dict[str, int], min_score: int = 2) -> Optional[Tuple[str, ...]]:
+    """
+    Input: output của tag_filter.infer_entity_type
+      - "general"          -> None (quét toàn bộ)
+      - "product"          -> chỉ tin khi score >= min_score
+      - ("disease","pest") -> top1/top2 sát nhau: quét hợp 2 nhóm
+    Return: tuple partition cần quét, hoặc None = full index.
+    """
+    if not entity_type or entity_type == "general":
+        return None
+
+    ets = entity_type if isinstance(entity_type, tuple) else (entity_type,)
+    top_score = max(int((entity_score or {}).get(et, 0)) for et in ets)
+    if top_score < min_score:
+        return None
+
+    parts = []
+    for et in ets:
+        mapped = QUERY_ENTITY_PARTITIONS.get(et)
+        if mapped is None:
+            return None
+        for p in mapped:
+            if p not in parts:
+                parts.append(p)
+    return tuple(parts)
+
+
+def partition_spans(index: PartitionIndex, partitions: Optional[Sequence[str]]) -> List[Tuple[int, int]]:
+    """
+    Các khối (start, end) cần quét, đã sắp tăng dần.
+    [] nghĩa là quét toàn bộ (partitions=None hoặc KB không có partition nào khớp).
+    """
+    if not partitions or not any(p in index.spans for p in partitions):
+        return []
+    wanted = list(partitions) + [p for p in SHARED_PARTITIONS if p not in partitions]
+    return sorted(index.spans[p] for p in wanted if p in index.spans)
+
+
+def scan_partitions(index: PartitionIndex, q: np.ndarray, partitions: Optional[Sequence[str]] = None):
+    """
+    Return (cand_idx, sims) — cand_idx là index gốc trong KB.
+    partitions=None hoặc KB không có partition nào khớp -> quét toàn bộ.
+    """
+    spans = partition_spans(index, partitions)
+    if not spans:
+        return index.order, index.embs @ q
+
+    cand_idx = np.concatenate([index.order[s:e] for s, e in spans])
+    sims = np.concatenate([index.embs[s:e] @ q for s, e in spans])
+    return cand_idx, sims
@@ -1,20 +1,41 @@
 from rag.config import RAGConfig
 from rag.router import route_query
 from rag.normalize import normalize_query
-from rag.retriever import search as retrieve_search
-from rag.scoring import fused_score, analyze_hits_fused
+from rag.retriever import search as retrieve_search, embed_query
+from rag.scoring import fused_score, analyze_hits_fused, rank_key
 from rag.strategy import decide_strategy
 from rag.text_utils import extract_codes_from_query
-from rag.context_builder import choose_adaptive_max_ctx, build_context_from_hits
-from rag.answer_modes import decide_answer_policy
-from rag.formatter import format_direct_doc_answer
-from rag.generator import call_finetune_with_context
+from rag.context_builder import choose_adaptive_max_ctx, build_context_from_hits, merge_adjacent_chunks
+from rag.answer_modes import decide_answer_policy, detect_listing
+from rag.formatter import format_direct_doc_answer, format_listing_answer, format_product_fact_answer, format_registry_answer
+from rag.llm import add_usage, chat_completion
+from rag.generator import FINETUNE_MAX_TOKENS, call_finetune_with_context, stream_finetune_with_context, iter_stream_text
 from rag.verbatim import verbatim_export
-from rag.tag_filter import infer_filters_from_query
+from rag.tag_filter import _norm, infer_filters_from_query, infer_entity_type
+from rag.partitions import partitions_for_query
+from rag.listing import list_page, summarize_listing_with_llm
+from rag.knn_graph import related_suggestions
+from rag.mmr import mmr_select
+from rag.local_rerank import local_rerank
+from rag.llm_rerank import llm_rerank
+from rag.budget import degraded, make_budget, short_of
+from rag.compress import compress_hits
+from rag.product_facts import lookup_product_facts
+from rag.registry_index import registry_page
+from rag.session import is_follow_up, rescore_in_session
+from rag.answer_cache import exact_key
+from rag.kb_index import kb_version
 from rag.logger import get_logger, new_trace_id
+from rag.tracing import span, start_trace
+from rag.metrics import record_error, record_request
+from rag.debug_log import debug_log
 from typing import List, Tuple
 from rag.multi_query import build_query_variants, retrieve_multi_query
+from contextlib import nullcontext
+import queue
 import re
+import threading
+import time
 
 
 logger = get_logger()
@@ -41,6 +62,111 @@ Quy tắc:
 - Ưu tiên trả lời đúng trọng tâm, không lan man sang công dụng phủ đất/chống xói mòn nếu không liên quan câu hỏi.
 """.strip()
 
+def _chat_text(client, *, site, on_delta=None, usage_out=None, **kwargs) -> str:
+    """
+    chat.completions -> text. Có on_delta: stream, gọi on_delta(đoạn text) ngay khi nhận được.
+    usage_out (dict): cộng dồn prompt_tokens / cached_tokens / completion_tokens.
+    """
+    if on_delta is None:
+        resp = chat_completion(client, site=site, **kwargs)
+        if usage_out is not None:
+            add_usage(usage_out, getattr(resp, "usage", None))
+        return resp.choices[0].message.content.strip()
+
+    parts = []
+    # site riêng cho stream: latency tới chunk đầu, không trộn với latency cả câu trả lời
+    stream = chat_completion(client, site=f"{site}_stream", stream=True, **kwargs)
+    for delta in iter_stream_text(stream):
+        parts.append(delta)
+        on_delta(delta)
+    if usage_out is not None:
+        add_usage(usage_out, getattr(stream, "usage", None))
+    return "".join(parts).strip()
+
+# mục bắt buộc theo _global_system_prompt; so trên text đã bỏ dấu + lowercase
+# ("ĐỊNH NGHĨA", "Định nghĩa", "1. Khái niệm" đều tính)
+GLOBAL_STRUCTURE_MARKERS = ("dinh nghia", "khai niem", "phan loai")
+
+def _has_global_structure(text: str) -> bool:
+    qn = _norm(text)
+    return any(m in qn for m in GLOBAL_STRUCTURE_MARKERS)
+
+def _stream_global_with_probe(client, *, on_delta=None, usage_out=None, probe_chars=1200, min_chars=0, **kwargs):
+    """
+    GLOBAL bằng model nhỏ: luôn stream (kể cả không có on_delta) để kiểm tra dần.
+    Đủ probe_chars ký tự mà chưa có mục Định nghĩa/Khái niệm/Phân loại -> đóng stream ngay,
+    không đợi hết câu trả lời. Câu trả lời xong trước probe_chars (câu hỏi đơn giản) -> giữ nguyên.
+    Return (text, lý do escalate | None): "structure" (phát hiện sớm), "short" (chỉ khi min_chars > 0).
+    """
+    parts = []
+    n_chars = 0
+    reason = None
+    probed = False
+    stream = chat_completion(client, site="global_stream", stream=True, **kwargs)
+    try:
+        for delta in iter_stream_text(stream):
+            parts.append(delta)
+            n_chars += len(delta)
+            if on_delta is not None:
+                on_delta(delta)
+            if not probed and n_chars >= probe_chars:
+                probed = True  # kiểm tra 1 lần tại điểm probe
+                if not _has_global_structure("".join(parts)):
+                    reason = "structure"
+                    break
+    finally:
+        if reason is not None and hasattr(stream, "close"):
+            stream.close()
+    if usage_out is not None:
+        add_usage(usage_out, getattr(stream, "usage", None))  # stream bị đóng sớm thường không có usage
+
+    text = "".join(parts).strip()
+    if reason is None and min_chars and len(text) < min_chars:
+        reason = "short"
+    return text, reason
+
+def _hit_summary(hits: list, n: int) -> list:
+    # top hit cho query log: id + điểm (fused / embedding / rerank)
+    return [
+        {
+            "id": str(h.get("id", "")),
+            "score": round(float(h.get("fused_score", h.get("score", 0.0))), 4),
+            "sim": round(float(h.get("raw_sim", h.get("score", 0.0))), 4),
+            "rerank": round(float(h.get("rerank_score", 0.0)), 4),
+            "llm_rerank": None if h.get("llm_rerank_score") is None else round(float(h["llm_rerank_score"]), 4),
+            "stage": h.get("stage", ""),
+        }
+        for h in hits[:n]
+    ]
+
+def _log_usage(strategy: str, usage: dict) -> None:
+    if not usage:
+        return
+    debug_log(
+        "=== LLM USAGE ===",
+        f"strategy={strategy} prompt_tokens={usage.get('prompt_tokens', 0)} "
+        f"cached_tokens={usage.get('cached_tokens', 0)} completion_tokens={usage.get('completion_tokens', 0)}",
+    )
+
+def attach_suggestions(res: dict, *, kb, primary_doc: dict, used_hits: list, retrieval_policy) -> dict:
+    """
+    "Có thể bạn quan tâm": láng giềng của primary_doc trong kNN graph (build sẵn),
+    lọc theo min_suggest_score, bỏ các doc đã dùng làm ngữ cảnh.
+    """
+    if "idx" not in primary_doc:
+        return res
+    suggestions = related_suggestions(
+        kb,
+        primary_doc["idx"],
+        max_suggest=int(getattr(retrieval_policy, "max_suggest", 0) or 0),
+        min_score=float(getattr(retrieval_policy, "min_suggest_score", 1.0)),
+        exclude_idx=[h["idx"] for h in used_hits if "idx" in h],
+    )
+    if suggestions:
+        res["suggestions"] = suggestions
+        res["text"] = res["text"] + "\n\nCó thể bạn quan tâm:\n" + "\n".join(f"- {s['question']}" for s in suggestions)
+    return res
+
 def choose_top_k(
     must_tags: List[str],
     any_tags: List[str],
@@ -64,6 +190,9 @@ def choose_top_k(
     # Heuristic theo intent ngôn ngữ
     ask_recommend = bool(re.search(r"\b(thuoc|phun|tri|phong|xu ly|dung gi|nen dung|loai nao)\b", norm_query.lower()))
 
+    # Mặc định (không có tag sản phẩm/sâu/bệnh/cây trồng)
+    top_k = 150
+
     # Tăng mạnh cho bài toán "tìm sản phẩm / tư vấn sâu bệnh"
     if has_product:
         top_k = 220
@@ -83,75 +212,395 @@ def choose_top_k(
 
     return top_k
 
-def answer_with_suggestions(*, user_query, kb, client, cfg, retrieval_policy):
-    # 0) Route GLOBAL / RAG
-    route = route_query(client, user_query)
+def answer_follow_up(*, user_query, kb, client, cfg, retrieval_policy, session, answer_cache=None, on_delta=None, budget=None):
+    """
+    Câu hỏi nối tiếp trong cùng session: re-score trong candidate pool của câu trước
+    (+ search nhỏ nếu câu mới có tag mới). Bỏ qua route/normalize/full scan.
+    Return None nếu không phải follow-up.
+    """
+    new_must, new_any = infer_filters_from_query(user_query)
+    if not is_follow_up(user_query, session, new_must, new_any):
+        return None
+
+    query_text = f"{session.norm_query} {user_query}".strip()
+    q_vec = embed_query(client, query_text, cfg)
+
+    extra_hits = []
+    fresh_must = [t for t in new_must if t not in session.must_tags]
+    fresh_any = [t for t in new_any if t not in session.any_tags]
+    if fresh_must or fresh_any:
+        extra_hits = retrieve_search(
+            client=client,
+            kb=kb,
+            norm_query=query_text,
+            top_k=cfg.session_incremental_top_k,
+            must_tags=fresh_must,
+            any_tags=fresh_any,
+            partitions=session.partitions,
+            query_vec=q_vec,
+            cfg=cfg,
+        )
+
+    hits = rescore_in_session(kb, session, q_vec, extra_hits=extra_hits)
+    session.follow_ups += 1
+    session.touch()
+    print("FOLLOW-UP  :", user_query, f"(pool={len(session.pool_idx)}, extra={len(extra_hits)})")
+
+    res = answer_from_hits(
+        # LLM cần ngữ cảnh câu hỏi gốc để hiểu "còn liều dùng thì sao?"
+        user_query=f"{session.last_query}\n{user_query}",
+        norm_query=query_text,
+        hits=hits,
+        kb=kb,
+        client=client,
+        cfg=cfg,
+        retrieval_policy=retrieval_policy,
+        query_vec=q_vec,
+        query_tags=session.must_tags + session.any_tags + fresh_must + fresh_any,
+        answer_cache=answer_cache,
+        on_delta=on_delta,
+        budget=budget,
+    )
+    res["follow_up"] = True
+    return res
+
+def answer_with_suggestions(
+    *,
+    user_query,
+    kb,
+    client,
+    cfg,
+    retrieval_policy,
+    listing_cursor=None,
+    session=None,
+    answer_cache=None,
+    on_delta=None,
+    budget_ms=None,
+):
+    """
+    on_delta: callback(text) nhận từng đoạn câu trả lời khi LLM đang sinh (stream);
+              on_delta(None) = bỏ phần đã stream (câu trả lời được sinh lại).
+              Câu trả lời không qua LLM (DIRECT_DOC, cache, listing...) chỉ có trong kết quả cuối.
+    budget_ms: latency budget của request (mặc định cfg.latency_budget_ms; 0 = không giới hạn).
+               Các degradation đã dùng ghi vào res["budget"].
+    cfg.use_tracing: thời gian từng stage (cây span) ghi log + res["timings"].
+    cfg.use_metrics: cộng vào metrics registry (rag.metrics).
+    """
+    t0 = time.perf_counter()
+    budget = make_budget(cfg, budget_ms)
+    with start_trace("answer") if cfg.use_tracing else nullcontext() as trace:
+        try:
+            res = _answer_with_suggestions(
+                user_query=user_query,
+                kb=kb,
+                client=client,
+                cfg=cfg,
+                retrieval_policy=retrieval_policy,
+                listing_cursor=listing_cursor,
+                session=session,
+                answer_cache=answer_cache,
+                on_delta=on_delta,
+                budget=budget,
+            )
+        except Exception as e:
+            if cfg.use_metrics:
+                record_error(e)
+            raise
+    if budget is not None:
+        res["budget"] = budget.report()
+    if trace is not None:
+        trace.root.set(strategy=res.get("strategy", ""))
+        res["timings"] = trace.timings()
+        logger.info(f"trace\n{trace.format()}", extra={"trace_id": trace.trace_id})
+    if cfg.use_metrics:
+        record_request(res, (time.perf_counter() - t0) * 1000.0)
+    return res
+
+def _answer_with_suggestions(
+    *,
+    user_query,
+    kb,
+    client,
+    cfg,
+    retrieval_policy,
+    listing_cursor,
+    session,
+    answer_cache,
+    on_delta,
+    budget,
+):
+    # 0) Follow-up trong cùng session -> re-rank trong pool cũ
+    if session is not None and cfg.use_session_cache and session.has_pool:
+        res = answer_follow_up(
+            user_query=user_query,
+            kb=kb,
+            client=client,
+            cfg=cfg,
+            retrieval_policy=retrieval_policy,
+            session=session,
+            answer_cache=answer_cache,
+            on_delta=on_delta,
+            budget=budget,
+        )
+        if res is not None:
+            return res
+
+    # Câu hỏi mới: bỏ pool cũ; chỉ nhánh RAG (sau retrieval) lưu lại pool mới,
+    # GLOBAL / listing / fact store / danh mục không để lại pool của chủ đề trước
+    if session is not None and cfg.use_session_cache:
+        session.reset()
+
+    # 0b) Dữ kiện sản phẩm (liều dùng / TGCL / hoạt chất) -> template từ fact store
+    if cfg.use_product_facts:
+        q_must, q_any = infer_filters_from_query(user_query)
+        facts = lookup_product_facts(kb, user_query, q_must + q_any)
+        if facts is not None:
+            return {
+                "text": format_product_fact_answer(user_query, facts),
+                "img_keys": [],
+                "route": "RAG",
+                "norm_query": "",
+                "strategy": "PRODUCT_FACT",
+                "profile": {"top1": 0, "top2": 0, "gap": 0, "mean5": 0, "n": len(facts["products"]), "conf": 0},
+            }
+
+    # 0c) Tra danh mục thuốc BVTV -> registry index (đủ + phân trang, không LLM)
+    if cfg.use_registry_index:
+        entity_type, _ = infer_entity_type(user_query)
+        if entity_type == "registry" or (isinstance(entity_type, tuple) and entity_type[0] == "registry"):
+            page = registry_page(kb, user_query, cursor=listing_cursor, page_size=cfg.listing_page_size)
+            if page.total:
+                return {
+                    "text": format_registry_answer(user_query, page),
+                    "img_keys": [],
+                    "route": "RAG",
+                    "norm_query": "",
+                    "strategy": "REGISTRY",
+                    "profile": {"top1": 0, "top2": 0, "gap": 0, "mean5": 0, "n": page.total, "conf": 0},
+                    "listing": {"total": page.total, "cursor": page.cursor, "next_cursor": page.next_cursor},
+                }
+
+    # 1) Route GLOBAL / RAG (thiếu thời gian -> chỉ heuristic, không gọi LLM router)
+    use_llm_router = not short_of(budget, cfg.budget_llm_router_ms)
+    if not use_llm_router:
+        budget.degrade("skip_llm_router")
+    with span("route", llm=use_llm_router) as sp:
+        route = route_query(client, user_query, use_llm=use_llm_router)
+        sp.set(route=route)
     if route == "GLOBAL":
         hard = _is_hard_global(user_query)
+        if hard and short_of(budget, cfg.budget_global_full_model_ms):
+            budget.degrade("smaller_model", "gpt-4.1 -> gpt-4.1-mini")
+            hard = False
         model = "gpt-4.1" if hard else "gpt-4.1-mini"
-
-        resp = client.chat.completions.create(
+        strategy = f"GLOBAL/{model}"
+
+        # GLOBAL không phụ thuộc KB -> chỉ dùng tầng exact
+        cache_key = exact_key(user_query, strategy) if answer_cache is not None else None
+        text, cache_tier = answer_cache.get(cache_key) if cache_key else (None, "off")
+        if text is not None:
+            return {
+                "text": text,
+                "img_keys": [],
+                "route": "GLOBAL",
+                "norm_query": "",
+                "strategy": strategy,
+                "profile": {"top1": 0, "top2": 0, "gap": 0, "mean5": 0, "n": 0, "conf": 0},
+                "cache": cache_tier,
+            }
+
+        # cache miss mới giới hạn max tokens theo thời gian còn lại
+        max_tokens = 3500 if hard else 2500
+        if budget is not None:
+            max_tokens = budget.cap_tokens(max_tokens, cfg.budget_tokens_per_s)
+
+        usage = {}
+        global_kwargs = dict(
             model=model,
             temperature=0.25 if hard else 0.35,
-            max_completion_tokens=3500 if hard else 2500,
+            max_completion_tokens=max_tokens,
             messages=[
                 {"role": "system", "content": _global_system_prompt()},
                 {"role": "user", "content": user_query},
             ],
         )
-
-        text = resp.choices[0].message.content.strip()
-
-        # (Tuỳ chọn) Escalate lần 2 nếu dùng mini nhưng output thiếu cấu trúc/liệt kê
-        if (not hard) and _is_hard_global(user_query):
-            # nếu router vẫn GLOBAL nhưng mini trả lời quá ngắn/thiếu ý
-            if len(text) < 900 or ("Định nghĩa" not in text and "Phân loại" not in text):
-                resp2 = client.chat.completions.create(
+        can_escalate = cfg.use_global_escalation and not hard
+        if can_escalate and short_of(budget, cfg.budget_global_full_model_ms):
+            budget.degrade("skip_escalation")
+            can_escalate = False
+
+        escalated = None
+        with span("generate", model=model) as sp:
+            if can_escalate:
+                # mini: stream + kiểm tra dần, thiếu cấu trúc thì dừng sớm (không đợi hết câu trả lời)
+                text, escalated = _stream_global_with_probe(
+                    client,
+                    on_delta=on_delta,
+                    usage_out=usage,
+                    probe_chars=cfg.global_escalation_probe_chars,
+                    min_chars=cfg.global_min_chars,
+                    **global_kwargs,
+                )
+            else:
+                text = _chat_text(client, site="global", on_delta=on_delta, usage_out=usage, **global_kwargs)
+            sp.set(chars=len(text), escalated=escalated)
+
+        # Escalate lên gpt-4.1 nếu bản mini thiếu cấu trúc (phát hiện sớm) hoặc quá ngắn
+        if escalated:
+            debug_log("=== GLOBAL ESCALATE ===", f"reason={escalated} mini_chars={len(text)}")
+            strategy = f"GLOBAL/{model}->gpt-4.1"
+            if on_delta is not None:
+                on_delta(None)  # bản mini đã stream bị thay thế
+            with span("escalate", model="gpt-4.1", reason=escalated):
+                text = _chat_text(
+                    client,
+                    site="global_escalate",
+                    on_delta=on_delta,
+                    usage_out=usage,
                     model="gpt-4.1",
                     temperature=0.2,
-                    max_completion_tokens=3800,
+                    max_completion_tokens=budget.cap_tokens(3800, cfg.budget_tokens_per_s) if budget else 3800,
                     messages=[
                         {"role": "system", "content": _global_system_prompt()},
                         {"role": "user", "content": user_query},
                         {"role": "user", "content": "Hãy mở rộng theo đúng cấu trúc, bổ sung phân loại và ví dụ đại diện nếu câu hỏi yêu cầu liệt kê."},
                     ],
                 )
-                text = resp2.choices[0].message.content.strip()
+
+        # câu trả lời đã degrade (cắt max tokens, bỏ escalate...) không cache -> request đủ budget không nhận bản rút gọn
+        if cache_key and not degraded(budget):
+            answer_cache.put(cache_key, text, mode=strategy)
+        _log_usage(strategy, usage)
 
         return {
             "text": text,
             "img_keys": [],
             "route": "GLOBAL",
             "norm_query": "",
-            "strategy": f"GLOBAL/{model}",
+            "strategy": strategy,
             "profile": {"top1": 0, "top2": 0, "gap": 0, "mean5": 0, "n": 0, "conf": 0},
+            "cache": cache_tier,
+            "usage": usage,
+            "escalated": escalated,
         }
 
-    # 1) Normalize query
-    norm_query = normalize_query(client, user_query)
-
-    # 2) Listing?
-
-    must_tags, any_tags = infer_filters_from_query(norm_query)
+    # 2) Normalize query (thiếu thời gian -> dùng nguyên câu hỏi)
+    if short_of(budget, cfg.budget_normalize_ms):
+        budget.degrade("skip_normalize")
+        norm_query = user_query.strip()
+    else:
+        with span("normalize"):
+            norm_query = normalize_query(client, user_query)
+
+    with span("tag_inference") as sp:
+        must_tags, any_tags = infer_filters_from_query(norm_query)
+        sp.set(must=len(must_tags), any=len(any_tags))
+
+    # 3) Entity partition: chỉ quét phần index liên quan khi entity_type đủ chắc
+    partitions = None
+    if cfg.use_entity_partitions:
+        entity_type, entity_score = infer_entity_type(norm_query)
+        partitions = partitions_for_query(entity_type, entity_score, min_score=cfg.entity_partition_min_score)
+
+    # 4) Listing? -> liệt kê đầy đủ theo tag index (không similarity scan)
+    if cfg.use_listing_engine and (must_tags or any_tags) and detect_listing(user_query):
+        page = list_page(
+            kb,
+            must_tags,
+            any_tags,
+            partitions=partitions,
+            cursor=listing_cursor,
+            page_size=cfg.listing_page_size,
+        )
+        if page.total:
+            if cfg.listing_use_llm:
+                text = summarize_listing_with_llm(client, user_query, page)
+            else:
+                text = format_listing_answer(user_query, page)
+            return {
+                "text": text,
+                "img_keys": [],
+                "route": "RAG",
+                "norm_query": norm_query,
+                "strategy": "LISTING",
+                "profile": {"top1": 0, "top2": 0, "gap": 0, "mean5": 0, "n": page.total, "conf": 0},
+                "listing": {"total": page.total, "cursor": page.cursor, "next_cursor": page.next_cursor},
+            }
 
     top_k = choose_top_k(
         must_tags=must_tags,
         any_tags=any_tags,
         norm_query=norm_query,
     )
+    if top_k > cfg.budget_min_top_k and short_of(budget, cfg.budget_full_top_k_ms):
+        budget.degrade("shrink_top_k", f"{top_k}->{cfg.budget_min_top_k}")
+        top_k = cfg.budget_min_top_k
     print("QUERY      :", norm_query)
     print("MUST TAGS  :", must_tags)
     print("ANY TAGS   :", any_tags)
+    print("PARTITIONS :", partitions or "ALL")
+
+    with span("embed"):
+        q_vec = embed_query(client, norm_query, cfg)
+    with span("retrieve", top_k=top_k) as sp:
+        hits = retrieve_search(
+            client=client,
+            kb=kb,
+            norm_query=norm_query,
+            top_k=top_k,
+            must_tags=must_tags,
+            any_tags=any_tags,
+            partitions=partitions,
+            query_vec=q_vec,
+            cfg=cfg,
+        )
+        sp.set(hits=len(hits))
+
+    if session is not None and cfg.use_session_cache:
+        session.remember(
+            user_query=user_query,
+            norm_query=norm_query,
+            must_tags=must_tags,
+            any_tags=any_tags,
+            partitions=partitions,
+            query_vec=q_vec,
+            hits=hits,
+            max_pool=cfg.session_max_pool,
+        )
+
+    return answer_from_hits(
+        user_query=user_query,
+        norm_query=norm_query,
+        hits=hits,
+        kb=kb,
+        client=client,
+        cfg=cfg,
+        retrieval_policy=retrieval_policy,
+        query_vec=q_vec,
+        query_tags=must_tags + any_tags,
+        answer_cache=answer_cache,
+        on_delta=on_delta,
+        budget=budget,
+    )
 
-    hits = retrieve_search(
-    client=client,
-    kb=kb,
-    norm_query=norm_query,
-    top_k=top_k,
-    must_tags=must_tags,
-    any_tags=any_tags,
-)
-    
+def answer_from_hits(
+    *,
+    user_query,
+    norm_query,
+    hits,
+    kb,
+    client,
+    cfg,
+    retrieval_policy,
+    query_vec=None,
+    query_tags=(),
+    answer_cache=None,
+    on_delta=None,
+    budget=None,
+):
+    """
+    Phần sau retrieval: fused score -> strategy -> primary doc -> VERBATIM/DIRECT_DOC/LLM.
+    """
     if not hits:
         return {
             "text": "Không tìm thấy dữ liệu phù hợp.",
@@ -162,14 +611,29 @@ def answer_with_suggestions(*, user_query, kb, client, cfg, retrieval_policy):
             "profile": {"top1": 0, "top2": 0, "gap": 0, "mean5": 0, "n": 0, "conf": 0},
         }
 
-    # 4) Filter by MIN_SCORE_MAIN
+    # 4b) Local rerank (no-op nếu chưa fit trọng số)
+    if cfg.use_local_rerank:
+        with span("local_rerank"):
+            entity_type, _ = infer_entity_type(norm_query)
+            local_rerank(kb, norm_query, hits, query_tags, entity_type, weights_path=cfg.local_rerank_weights_path)
+
+    # 4c) LLM rerank (batch song song + cache, có deadline) trên top theo điểm hiện tại
+    if cfg.use_llm_rerank and short_of(budget, cfg.budget_llm_rerank_ms):
+        budget.degrade("skip_llm_rerank")
+    elif cfg.use_llm_rerank:
+        with span("llm_rerank") as sp:
+            hits = sorted(hits, key=rank_key, reverse=True)
+            sp.set(**llm_rerank(client, kb, norm_query, hits, cfg=cfg))
+
+    # 5) Filter by MIN_SCORE_MAIN
     for h in hits:
         h["fused_score"] = fused_score(h)
-    # sort hits by fused_score desc to make profile stable
-    hits = sorted(hits, key=lambda x: x["fused_score"], reverse=True)
+    # sort hits by (đã rerank?, fused_score) desc to make profile stable
+    hits = sorted(hits, key=rank_key, reverse=True)
+    top_hits = _hit_summary(hits, cfg.query_log_top_hits)
     filtered_for_main = [h for h in hits if h["fused_score"] >= retrieval_policy.min_score_main]
 
-    # 5) Decide strategy (DIRECT_DOC / RAG_STRICT / RAG_SOFT)
+    # 6) Decide strategy (DIRECT_DOC / RAG_STRICT / RAG_SOFT)
     has_main = len(filtered_for_main) > 0
     prof = analyze_hits_fused(hits)
     strategy = decide_strategy(
@@ -179,13 +643,16 @@ def answer_with_suggestions(*, user_query, kb, client, cfg, retrieval_policy):
         policy=retrieval_policy,
         code_boost_direct=cfg.code_boost_direct,
     )
+    if strategy in ("RAG_STRICT", "RAG_SOFT") and has_main and short_of(budget, cfg.budget_generate_ms):
+        budget.degrade("direct_doc", strategy)
+        strategy = "DIRECT_DOC"
 
-    # 6) Prefer include_in_context if available
+    # 7) Prefer include_in_context if available
     context_candidates = [h for h in filtered_for_main if h.get("include_in_context", False)]
     if not context_candidates:
         context_candidates = filtered_for_main
 
-    # 7) Pick primary_doc (prefer code match)
+    # 8) Pick primary_doc (prefer code match)
     code_candidates = extract_codes_from_query(norm_query)
     primary_doc = None
     if code_candidates:
@@ -213,18 +680,21 @@ def answer_with_suggestions(*, user_query, kb, client, cfg, retrieval_policy):
             "norm_query": norm_query,
             "strategy": "VERBATIM",
             "profile": prof,
+            "top_hits": top_hits,
         }
 
     # 9) DIRECT_DOC: KB đủ mạnh -> trả trực tiếp doc (không ép QA)
     if strategy == "DIRECT_DOC":
         text = format_direct_doc_answer(user_query, primary_doc)
-        return {
+        res = {
             "text": text,
             "route": "RAG",
             "norm_query": norm_query,
             "strategy": strategy,
             "profile": prof,
+            "top_hits": top_hits,
         }
+        return attach_suggestions(res, kb=kb, primary_doc=primary_doc, used_hits=[primary_doc], retrieval_policy=retrieval_policy)
 
     # adaptive ctx, nhưng giới hạn theo mode
     base_ctx = choose_adaptive_max_ctx(hits)
@@ -235,25 +705,174 @@ def answer_with_suggestions(*, user_query, kb, client, cfg, retrieval_policy):
         max_ctx = min(RAGConfig.max_ctx_strict, base_ctx)
         rag_mode = "STRICT"
 
-    main_hits = [primary_doc]
-    for h in context_candidates:
-        if h is not primary_doc and len(main_hits) < max_ctx:
-            main_hits.append(h)
-
-    context = build_context_from_hits(main_hits)
-
-    final_answer = call_finetune_with_context(
-        client=client,
-        user_query=user_query,
-        context=context,
-        answer_mode=answer_mode,
-        rag_mode=rag_mode,  
-    )
+    if cfg.use_mmr:
+        # chunk gần trùng -> thay bằng bằng chứng khác (hoặc bỏ)
+        main_hits = mmr_select(
+            kb,
+            primary_doc,
+            context_candidates,
+            max_ctx,
+            lambda_mult=cfg.mmr_lambda,
+            dup_threshold=cfg.mmr_dup_threshold,
+        )
+    else:
+        main_hits = [primary_doc]
+        for h in context_candidates:
+            if h is not primary_doc and len(main_hits) < max_ctx:
+                main_hits.append(h)
+
+    # Answer cache: exact (query + mode + doc ngữ cảnh + KB) rồi semantic (cùng primary_doc)
+    cache_mode = f"{answer_mode}/{rag_mode}"
+    cache_key, cache_tier, final_answer = None, "off", None
+    usage = {}
+    if answer_cache is not None:
+        kb_ver = kb_version(kb)
+        cache_key = exact_key(norm_query, cache_mode, [h["id"] for h in main_hits], kb_ver)
+        final_answer, cache_tier = answer_cache.get(
+            cache_key,
+            query_vec=query_vec,
+            primary_doc=primary_doc.get("id"),
+            mode=cache_mode,
+            kb_version=kb_ver,
+        )
 
-    return {
+    if final_answer is None:
+        with span("context", docs=len(main_hits)) as sp:
+            ctx_hits = merge_adjacent_chunks(main_hits) if cfg.use_chunk_merge else main_hits
+            if cfg.use_context_compression and answer_mode not in ("procedure", "listing"):
+                ctx_hits = compress_hits(
+                    ctx_hits,
+                    norm_query,
+                    query_tags,
+                    keep_ratio=cfg.compress_keep_ratio,
+                    min_chars=cfg.compress_min_chars,
+                )
+            context = build_context_from_hits(
+                ctx_hits,
+                token_budget=cfg.context_token_budget,
+                min_tail_tokens=cfg.context_min_tail_tokens,
+            )
+            sp.set(chars=len(context))
+        max_tokens = FINETUNE_MAX_TOKENS
+        if budget is not None:
+            max_tokens = budget.cap_tokens(max_tokens, cfg.budget_tokens_per_s)
+
+        with span("generate", mode=cache_mode, stream=on_delta is not None):
+            if on_delta is None:
+                final_answer = call_finetune_with_context(
+                    client=client,
+                    user_query=user_query,
+                    context=context,
+                    answer_mode=answer_mode,
+                    rag_mode=rag_mode,
+                    max_completion_tokens=max_tokens,
+                    usage_out=usage,
+                )
+            else:
+                parts = []
+                for delta in stream_finetune_with_context(
+                    client=client,
+                    user_query=user_query,
+                    context=context,
+                    answer_mode=answer_mode,
+                    rag_mode=rag_mode,
+                    max_completion_tokens=max_tokens,
+                    usage_out=usage,
+                ):
+                    parts.append(delta)
+                    on_delta(delta)
+                final_answer = "".join(parts).strip()
+
+        if cache_key and not degraded(budget):
+            answer_cache.put(
+                cache_key,
+                final_answer,
+                query_vec=query_vec,
+                primary_doc=primary_doc.get("id"),
+                mode=cache_mode,
+                kb_version=kb_ver,
+            )
+
+    _log_usage(strategy, usage)
+
+    res = {
         "text": final_answer,
         "route": "RAG",
         "norm_query": norm_query,
         "strategy": strategy,
         "profile": prof,
-    }
\ No newline at end of file
+        "top_hits": top_hits,
+        "cache": cache_tier,
+        "usage": usage,
+    }
+    return attach_suggestions(res, kb=kb, primary_doc=primary_doc, used_hits=main_hits, retrieval_policy=retrieval_policy)
+
+def stream_answer_with_suggestions(**kwargs):
+    """
+    Bản streaming của answer_with_suggestions (cùng tham số). Yield event dict:
+    - {"type": "delta", "text": ...}  : đoạn câu trả lời mới (in ngay)
+    - {"type": "reset"}               : bỏ phần đã in (câu trả lời được sinh lại)
+    - {"type": "final", "result": res}: kết quả đầy đủ (text, strategy, profile, img_keys...)
+      res["latency"] = {"ttft_ms", "total_ms", "streamed"}
+
+    Pipeline chạy ở thread riêng, token đẩy qua queue.
+    """
+    events = queue.Queue()
+
+    def on_delta(text):
+        events.put(("reset", None) if text is None else ("delta", text))
+
+    def worker():
+        try:
+            events.put(("final", answer_with_suggestions(**kwargs, on_delta=on_delta)))
+        except BaseException as e:
+            events.put(("error", e))
+
+    t0 = time.perf_counter()
+    ttft = None
+    emitted = ""
+    threading.Thread(target=worker, daemon=True).start()
+
+    while True:
+        kind, payload = events.get()
+        if kind == "error":
+            raise payload
+
+        if kind == "reset":
+            emitted = ""
+            yield {"type": "reset"}
+            continue
+
+        if kind == "delta":
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            emitted += payload
+            yield {"type": "delta", "text": payload}
+            continue
+
+        # final: phần chưa stream (gợi ý "Có thể bạn quan tâm", hoặc cả câu nếu không qua LLM)
+        res = payload
+        text = res.get("text", "")
+        streamed = bool(emitted)
+        head = emitted.rstrip()
+        rest = text[len(head):] if text.startswith(head) else ("" if streamed else text)
+        if rest:
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            yield {"type": "delta", "text": rest}
+
+        total = time.perf_counter() - t0
+        res["latency"] = {
+            "ttft_ms": round((ttft if ttft is not None else total) * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+            "streamed": streamed,
+        }
+        usage = res.get("usage") or {}
+        logger.info(
+            f"ttft_ms={res['latency']['ttft_ms']} total_ms={res['latency']['total_ms']} "
+            f"streamed={streamed} strategy={res.get('strategy', '')} "
+            f"prompt_tokens={usage.get('prompt_tokens', 0)} cached_tokens={usage.get('cached_tokens', 0)}",
+            extra={"trace_id": (res.get("timings") or {}).get("trace_id") or new_trace_id()},
+        )
+        yield {"type": "final", "result": res}
+        return
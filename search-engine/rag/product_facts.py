@@ -0,0 +1,183 @@
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from rag.kb_index import get_kb_index, kb_version, set_kb_index, unpack_kb
+from rag.retriever import _parse_tags_any_format
+from rag.tag_filter import _norm
+
+# ======================
+# PRODUCT FACT STORE (build-time)
+#   - Trích hoạt chất / dạng thuốc / TGCL / liều dùng từ NỘI DUNG doc sản phẩm
+#     (cùng regex với data/csv_to_kb_json.py::parse_product_struct_from_text)
+#   - Index theo tag sản phẩm (product:* / alias:*) của doc; chỉ doc nêu đúng 1 product:*
+#     (alias:* trên doc đó là tên thương mại khác của cùng sản phẩm). Doc phác đồ phối hợp
+#     nhiều sản phẩm không tách được liều / TGCL của từng sản phẩm -> bỏ qua
+#   - Câu hỏi dạng "liều dùng X", "thời gian cách ly của Y", "X chứa hoạt chất gì"
+#     -> trả lời bằng template, không retrieval, không LLM
+#   - Liều / TGCL lưu 1 giá trị / sản phẩm (không theo cây trồng, đối tượng): query nêu cây trồng /
+#     sâu bệnh / cỏ -> không dùng fact store (nhãn thuốc ghi liều, TGCL khác nhau theo cây), đi RAG
+# ======================
+
+FACTS_SUFFIX = ".facts.json"
+FACT_TAG_PREFIXES = ("product:", "alias:")
+# intent mà giá trị phụ thuộc cây trồng / đối tượng (hoạt chất thì không)
+TARGET_SPECIFIC_INTENTS = ("phi", "dosage")
+TARGET_TAG_PREFIXES = ("crop:", "pest:", "disease:", "weed:")
+
+# --- Extractors (đồng bộ với data/csv_to_kb_json.py) ---
+RE_PHI = re.compile(r"thời\s*gian\s*cách\s*ly\s*:\s*([0-9]{1,3})\s*ngày", re.IGNORECASE)
+RE_FORMULATION = re.compile(r"\b(EC|SC|SL|WP|WG|WDG|GR|DF)\b", re.IGNORECASE)
+RE_ACTIVE = re.compile(r"hoạt\s*chất\s*:\s*(.+?)(?:\.|nhóm|hãng|đặc\s*tính|đối\s*tượng|phạm\s*vi|liều\s*dùng|$)",
+                       re.IGNORECASE | re.DOTALL)
+RE_DOSAGE_TANK = re.compile(r"pha\s*([0-9]+(?:[.,][0-9]+)?)\s*-\s*([0-9]+(?:[.,][0-9]+)?)\s*ml\s*cho\s*bình\s*([0-9]+)\s*lít",
+                            re.IGNORECASE)
+RE_DOSAGE_HA = re.compile(r"liều\s*dùng.*?:\s*([0-9]+(?:[.,][0-9]+)?)\s*lít\s*/\s*ha", re.IGNORECASE)
+
+# --- Intent (so khớp trên text đã bỏ dấu) ---
+FACT_INTENT_PATTERNS = {
+    "phi": r"\b(thoi gian cach ly|cach ly|tgcl)\b",
+    "active": r"\b(hoat chat|thanh phan|chua chat gi|chua gi)\b",
+    "dosage": r"\b(lieu dung|lieu luong|lieu|cach pha|pha bao nhieu|pha may|bao nhieu ml|bao nhieu lit)\b",
+}
+FACT_FIELDS = {
+    "phi": ("phi_days",),
+    "active": ("active",),
+    "dosage": ("per_tank_ml_range", "per_ha_l"),
+}
+
+
+def parse_product_facts(text: str) -> Dict[str, Any]:
+    t = str(text or "").strip()
+    if not t or t.lower() == "nan":
+        return {}
+
+    facts: Dict[str, Any] = {}
+
+    m = RE_FORMULATION.search(t)
+    if m:
+        facts["formulation"] = m.group(1).upper()
+
+    m = RE_ACTIVE.search(t)
+    if m:
+        active = re.sub(r"\s+", " ", m.group(1)).strip(" ,;:")
+        if active:
+            facts["active"] = active
+
+    m = RE_PHI.search(t)
+    if m:
+        facts["phi_days"] = int(m.group(1))
+
+    m = RE_DOSAGE_HA.search(t)
+    if m:
+        facts["per_ha_l"] = m.group(1).replace(",", ".")
+
+    m = RE_DOSAGE_TANK.search(t)
+    if m:
+        facts["per_tank_ml_range"] = [m.group(1).replace(",", "."), m.group(2).replace(",", ".")]
+        facts["tank_l"] = m.group(3)
+
+    return facts
+
+
+def build_product_facts(kb, version: str = "") -> Dict[str, Any]:
+    """
+    {"version": ..., "products": {tag: {field: value, ..., "sources": {field: doc_id}}}}
+    Nhiều doc cùng sản phẩm -> field nào có trước thì giữ (doc entity_type=product ưu tiên).
+    Doc có nhiều hơn 1 product:* -> không gán fact (không biết dữ kiện thuộc sản phẩm nào).
+    """
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = unpack_kb(kb)
+    products: Dict[str, Dict[str, Any]] = {}
+    if TAGS_V2 is None:
+        return {"version": version, "products": products}
+
+    rows = range(len(ANSWERS))
+    if ENTITY_TYPE is not None:
+        rows = [i for i in rows if str(ENTITY_TYPE[i]) != "registry"]
+        rows.sort(key=lambda i: str(ENTITY_TYPE[i]) != "product")
+
+    for i in rows:
+        tags = [t for t in _parse_tags_any_format(TAGS_V2[i]) if t.startswith(FACT_TAG_PREFIXES)]
+        if sum(t.startswith("product:") for t in tags) != 1:
+            continue
+        facts = parse_product_facts(ANSWERS[i])
+        if not facts:
+            continue
+        doc_id = str(IDS[i]) if IDS is not None else str(i)
+        for tag in tags:
+            rec = products.setdefault(tag, {"sources": {}})
+            for field, value in facts.items():
+                if field not in rec:
+                    rec[field] = value
+                    rec["sources"][field] = doc_id
+
+    return {"version": version, "products": products}
+
+
+def save_product_facts(path, store: Dict[str, Any]) -> None:
+    Path(path).write_text(json.dumps(store, ensure_ascii=False), encoding="utf-8")
+
+
+def load_product_facts(path, expected_version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    p = Path(path)
+    if not p.exists():
+        return None
+    store = json.loads(p.read_text(encoding="utf-8"))
+    if expected_version and store.get("version") != expected_version:
+        return None
+    return store
+
+
+def facts_sidecar_path(npz_path) -> Path:
+    p = Path(npz_path)
+    return p.with_name(p.stem + FACTS_SUFFIX)
+
+
+def attach_product_facts(kb, npz_path) -> Optional[Dict[str, Any]]:
+    store = load_product_facts(facts_sidecar_path(npz_path), expected_version=kb_version(kb))
+    if store is not None:
+        set_kb_index(kb, "product_facts", store)
+    return store
+
+
+def get_product_facts(kb) -> Dict[str, Any]:
+    return get_kb_index(kb, "product_facts", lambda: build_product_facts(kb, version=kb_version(kb)))
+
+
+def detect_fact_intents(user_query: str) -> List[str]:
+    qn = _norm(user_query)
+    return [intent for intent, pat in FACT_INTENT_PATTERNS.items() if re.search(pat, qn)]
+
+
+def lookup_product_facts(kb, user_query: str, tags, max_products: int = 3) -> Optional[Dict[str, Any]]:
+    """
+    Return {"intents": [...], "products": [(tag, record), ...]} nếu MỌI sản phẩm được hỏi
+    đều có đủ field cho MỌI intent; thiếu bất kỳ -> None (đi đường RAG/LLM).
+    Hỏi liều / TGCL kèm tag cây trồng / sâu bệnh / cỏ -> None (fact store không tách theo cây).
+    """
+    intents = detect_fact_intents(user_query)
+    if any(i in TARGET_SPECIFIC_INTENTS for i in intents) and any(
+        str(t).startswith(TARGET_TAG_PREFIXES) for t in tags or []
+    ):
+        return None
+    # product:* trước; alias:* chỉ dùng khi query không có product:* (tránh lặp cùng 1 sản phẩm)
+    product_tags = []
+    for prefix in FACT_TAG_PREFIXES:
+        product_tags = [t for t in tags or [] if str(t).startswith(prefix)]
+        if product_tags:
+            break
+    if not intents or not product_tags or len(product_tags) > max_products:
+        return None
+
+    products = get_product_facts(kb)["products"]
+    found = []
+    for tag in product_tags:
+        rec = products.get(tag)
+        if rec is None:
+            return None
+        for intent in intents:
+            if not any(rec.get(f) for f in FACT_FIELDS[intent]):
+                return None
+        found.append((tag, rec))
+    return {"intents": intents, "products": found}
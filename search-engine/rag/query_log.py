@@ -0,0 +1,236 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from rag.config import RAGConfig
+from rag.debug_log import debug_log
+
+# ======================
+# QUERY LOG (JSONL, append-only) — thay rag_logs.csv
+#   - 1 dòng JSON / query: route, strategy, profile, top hit (id + điểm), thời gian từng stage,
+#     latency, token usage, cache, budget, escalation; câu trả lời chỉ giữ đoạn đầu + hash
+#   - append() chỉ dựng record + đưa vào queue; thread nền ghi theo batch
+#   - segment: queries-YYYYMMDD-HHMMSS-NNN.jsonl; quá kích thước / sang ngày -> đóng + gzip
+#     (process dừng đột ngột -> segment .jsonl chưa nén, reader vẫn đọc được)
+#   - load_query_log(dir, day) -> pandas DataFrame (cột lồng nhau đã flatten) để phân tích
+# ======================
+
+SEGMENT_PREFIX = "queries-"
+_STOP = object()
+
+
+def _round(x, nd: int = 4):
+    try:
+        return round(float(x), nd)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_record(user_query: str, res: Dict[str, Any], answer_chars: int = 300) -> Dict[str, Any]:
+    """
+    res của answer_with_suggestions -> 1 record log (chỉ kiểu JSON cơ bản).
+    """
+    now = time.time()
+    text = res.get("text", "") or ""
+    timings = res.get("timings") or {}
+    return {
+        "ts": round(now, 3),
+        "time": datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+        "trace_id": timings.get("trace_id", ""),
+        "route": res.get("route", "RAG"),
+        "strategy": res.get("strategy", ""),
+        "user_query": user_query,
+        "norm_query": res.get("norm_query", ""),
+        "profile": {k: _round(v) for k, v in (res.get("profile") or {}).items()},
+        "top_hits": res.get("top_hits", []),
+        "cache": res.get("cache", ""),
+        "escalated": res.get("escalated"),
+        "follow_up": bool(res.get("follow_up", False)),
+        "stages_ms": timings.get("stages", {}),
+        "total_ms": timings.get("total_ms"),
+        "latency": res.get("latency", {}),
+        "usage": res.get("usage", {}),
+        "degradations": (res.get("budget") or {}).get("degradations", []),
+        "answer_chars": len(text),
+        "answer_sha1": hashlib.sha1(text.encode("utf-8")).hexdigest()[:16],
+        "answer_head": text[:answer_chars],
+        "img_keys": res.get("img_keys", []),
+    }
+
+
+class QueryLog:
+    """
+    Writer JSONL chạy nền. Dùng: log = QueryLog(cfg); log.append(q, res); ...; log.close().
+    """
+
+    def __init__(
+        self,
+        log_dir: str = RAGConfig.query_log_dir,
+        segment_max_bytes: int = RAGConfig.query_log_segment_max_bytes,
+        compress: bool = RAGConfig.query_log_compress,
+        answer_chars: int = RAGConfig.query_log_answer_chars,
+        queue_max: int = 10_000,
+    ):
+        self.log_dir = log_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.compress = compress
+        self.answer_chars = answer_chars
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_max)
+        os.makedirs(log_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, name="rag-query-log", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, cfg) -> Optional["QueryLog"]:
+        if not cfg.use_query_log:
+            return None
+        return cls(
+            log_dir=cfg.query_log_dir,
+            segment_max_bytes=cfg.query_log_segment_max_bytes,
+            compress=cfg.query_log_compress,
+            answer_chars=cfg.query_log_answer_chars,
+        )
+
+    def append(self, user_query: str, res: Dict[str, Any]) -> None:
+        line = json.dumps(build_record(user_query, res, self.answer_chars), ensure_ascii=False, default=str)
+        try:
+            self._queue.put_nowait(line + "\n")
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Ghi nốt queue, đóng + nén segment hiện tại.
+        """
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # ---------- thread nền ----------
+
+    def _new_segment_path(self) -> str:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        n = 0
+        while True:
+            path = os.path.join(self.log_dir, f"{SEGMENT_PREFIX}{stamp}-{n:03d}.jsonl")
+            if not (os.path.exists(path) or os.path.exists(path + ".gz")):
+                return path
+            n += 1
+
+    def _finish_segment(self, path: str) -> None:
+        if not self.compress or not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError as e:
+            debug_log("=== QUERY LOG GZIP FAILED ===", path, repr(e))
+
+    def _write_loop(self) -> None:
+        f, path, day = None, None, None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(x is _STOP for x in batch)
+            lines = [x for x in batch if x is not _STOP]
+            try:
+                if lines:
+                    today = datetime.now().strftime("%Y%m%d")
+                    if f is not None and day != today:
+                        f.close()
+                        self._finish_segment(path)
+                        f = None
+                    if f is None:
+                        path, day = self._new_segment_path(), today
+                        f = open(path, "a", encoding="utf-8")
+                    f.write("".join(lines))
+                    f.flush()
+                    if f.tell() >= self.segment_max_bytes:
+                        f.close()
+                        self._finish_segment(path)
+                        f = None
+            except OSError as e:
+                self.dropped += len(lines)
+                debug_log("=== QUERY LOG WRITE FAILED ===", repr(e))
+            if stop:
+                if f is not None:
+                    f.close()
+                    self._finish_segment(path)
+                return
+
+
+# ======================
+# READER
+# ======================
+
+def segment_paths(log_dir: str, day: Optional[str] = None) -> List[str]:
+    """
+    day: "YYYY-MM-DD" / "YYYYMMDD" (None = tất cả). Theo tên segment = thời điểm mở segment.
+    """
+    stamp = day.replace("-", "") if day else ""
+    pattern = os.path.join(log_dir, f"{SEGMENT_PREFIX}{stamp}*.jsonl*")
+    return sorted(p for p in glob.glob(pattern) if p.endswith((".jsonl", ".jsonl.gz")))
+
+
+def iter_query_log(log_dir: str, day: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    for path in segment_paths(log_dir, day):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # dòng cuối ghi dở
+
+
+def load_query_log(log_dir: str, day: Optional[str] = None):
+    """
+    -> pandas DataFrame, cột lồng nhau flatten: "stages_ms.retrieve/scan", "usage.prompt_tokens",
+       "profile.top1"...; top_hits giữ dạng list (top1_id / top1_score tách sẵn).
+    """
+    import pandas as pd
+
+    rows = list(iter_query_log(log_dir, day))
+    if not rows:
+        return pd.DataFrame()
+    for r in rows:
+        top = (r.get("top_hits") or [{}])[0]
+        r["top1_id"] = top.get("id")
+        r["top1_score"] = top.get("score")
+    df = pd.json_normalize(rows, max_level=1)
+    df["ts"] = pd.to_datetime(df["ts"], unit="s")
+    return df
+
+
+def stage_latency_summary(df) -> "Any":
+    """
+    DataFrame -> bảng p50/p95/p99 (ms) theo stage (NumPy nanpercentile trên cột stages_ms.*).
+    """
+    import numpy as np
+    import pandas as pd
+
+    cols = [c for c in df.columns if c.startswith("stages_ms.")]
+    if "total_ms" in df.columns:
+        cols.append("total_ms")
+    out = {}
+    for c in cols:
+        v = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=np.float64)
+        v = v[~np.isnan(v)]
+        if len(v):
+            p50, p95, p99 = np.percentile(v, [50, 95, 99])
+            out[c.replace("stages_ms.", "")] = {"n": len(v), "p50": p50, "p95": p95, "p99": p99}
+    return pd.DataFrame(out).T.round(1)
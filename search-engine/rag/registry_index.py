@@ -0,0 +1,279 @@
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rag.kb_index import get_kb_index, kb_version, set_kb_index, unpack_kb
+from rag.listing import ListingPage, _parse_cursor
+from rag.tag_filter import _norm
+
+# ======================
+# REGISTRY INDEX (danh mục thuốc BVTV)
+#   - Parse sẵn từng dòng danh mục (id danh_muc_thuoc_bao_ve_thuc_vat_*, entity_type=registry):
+#     Hoạt chất / Tên thương phẩm / Đối tượng/cây trồng / Đơn vị đăng ký
+#   - Index: key đã normalize -> các dòng; query tra theo n-gram (không embedding, không LLM)
+#   - Nhiều field khớp -> giao nhau (AND), cùng field -> hợp (OR); phân trang bằng cursor
+# ======================
+
+REGISTRY_SUFFIX = ".registry.json"
+REGISTRY_ID_PREFIX = "danh_muc_thuoc_bao_ve_thuc_vat"
+REGISTRY_FIELDS = ("trade_name", "active", "registrant", "pest", "crop")
+MAX_NGRAM = 6
+
+_LABELS = [
+    ("sector", r"Ngành"),
+    ("group", r"Nhóm"),
+    ("active", r"Hoạt chất"),
+    ("trade_name", r"Tên thương phẩm"),
+    ("targets", r"Đối tượng/cây trồng"),
+    ("registrant", r"Đơn vị đăng ký"),
+    ("rank", r"Rank"),
+]
+_LABEL_RE = re.compile("(" + "|".join(lbl for _, lbl in _LABELS) + r")\s*:", re.IGNORECASE)
+_LABEL_FIELD = {_norm(lbl): f for f, lbl in _LABELS}
+
+# Bỏ khi lấy "tên ngắn" của đơn vị đăng ký: "Công ty TNHH MTV Lucky" -> "lucky"
+_COMPANY_WORDS = {
+    "cong", "ty", "tnhh", "cp", "co", "phan", "mtv", "sx", "tm", "dv", "xnk", "ttc", "tap", "doan",
+    "thuong", "mai", "san", "xuat", "dich", "vu", "viet", "nam", "vn", "ltd", "co.,", "corp", "inc",
+    "mot", "thanh", "vien", "va", "hoa", "chat", "nong", "duoc", "quoc", "te",
+}
+
+# Đuôi muối / ester / đồng phân của hoạt chất: "glyphosate ipa salt", "emamectin benzoate",
+# "quizalofop p ethyl" -> index thêm tên gốc để query chỉ nêu tên gốc vẫn khớp
+ACTIVE_SUFFIX_WORDS = {
+    "salt", "salts", "muoi", "ipa", "isopropylamine", "dimethylamine", "dimethyl", "dma", "amine",
+    "ammonium", "sodium", "natri", "potassium", "kali", "aluminium", "benzoate", "sulfate", "sulphate",
+    "hydrochloride", "olamine", "ethyl", "methyl", "butyl", "p", "m", "s",
+}
+
+# Từ vựng của câu hỏi tra cứu (không phải tên thuốc / hoạt chất / đối tượng) -> không dùng để khớp
+QUERY_STOPWORDS = {
+    "thuoc", "dang", "ky", "danh", "muc", "ten", "thuong", "pham", "hoat", "chat", "cong", "ty",
+    "don", "vi", "doi", "tuong", "cay", "trong", "tru", "tri", "phong", "tren", "cho", "cua",
+    "nhung", "nao", "gi", "chua", "co", "la", "cac", "loai", "bvtv", "bao", "ve", "thuc", "vat",
+    "duoc", "phep", "va", "hay", "hoac", "nay", "do", "voi",
+}
+
+
+def _key(s: str) -> str:
+    s = re.sub(r"\([^)]*\)", " ", _norm(s))
+    s = re.sub(r"[^a-z0-9.]+", " ", s)
+    return re.sub(r"\s+", " ", s).strip(" .")
+
+
+def parse_registry_answer(text: str) -> Dict[str, str]:
+    """
+    "Ngành: ... Nhóm: ... Hoạt chất: X Tên thương phẩm: Y Đối tượng/cây trồng: a/b; c/d Đơn vị đăng ký: W Rank: ..."
+    """
+    t = str(text or "")
+    out: Dict[str, str] = {}
+    marks = list(_LABEL_RE.finditer(t))
+    for m, nxt in zip(marks, marks[1:] + [None]):
+        field = _LABEL_FIELD.get(_norm(m.group(1)))
+        value = t[m.end(): nxt.start() if nxt else len(t)].strip(" :;")
+        if field and value and field not in out:
+            out[field] = value
+    return out
+
+
+def split_targets(targets: str):
+    """
+    "sâu đục thân, sâu cuốn lá/ lúa; bọ cánh tơ/ chè" -> pests, crops
+    """
+    pests, crops = [], []
+    for part in str(targets or "").split(";"):
+        pest, _, crop = part.partition("/")
+        pests += [p.strip() for p in pest.split(",") if p.strip()]
+        crops += [c.strip() for c in crop.split(",") if c.strip()]
+    return pests, crops
+
+
+def _active_base(k: str) -> str:
+    """
+    "glyphosate ipa salt" -> "glyphosate"; không còn gì / quá ngắn -> giữ nguyên k.
+    """
+    words = k.split()
+    while len(words) > 1 and words[-1] in ACTIVE_SUFFIX_WORDS:
+        words.pop()
+    base = " ".join(words)
+    return base if len(base) >= 4 and base not in ACTIVE_SUFFIX_WORDS else k
+
+
+def _index_keys(rec: Dict[str, Any]) -> Dict[str, List[str]]:
+    keys = {f: [] for f in REGISTRY_FIELDS}
+    if rec.get("trade_name"):
+        keys["trade_name"].append(_key(rec["trade_name"]))
+    for a in re.split(r"[+,]", rec.get("active", "")):
+        # "Abamectin 18g/l" -> "abamectin"
+        k = re.split(r"\s\d", _key(a))[0].strip()
+        if k:
+            keys["active"].append(k)
+            base = _active_base(k)
+            if base != k:
+                keys["active"].append(base)
+    if rec.get("registrant"):
+        full = _key(rec["registrant"])
+        keys["registrant"].append(full)
+        short = " ".join(w for w in full.split() if w not in _COMPANY_WORDS)
+        if len(short) >= 4 and short != full and not set(short.split()) <= QUERY_STOPWORDS:
+            keys["registrant"].append(short)
+    pests, crops = split_targets(rec.get("targets", ""))
+    keys["pest"] += [_key(p) for p in pests]
+    keys["crop"] += [_key(c) for c in crops]
+    return {f: [k for k in dict.fromkeys(v) if len(k) >= 2] for f, v in keys.items()}
+
+
+@dataclass(frozen=True)
+class RegistryIndex:
+    """
+    records : list record đã parse (kèm "idx" = dòng KB, "id")
+    postings: field -> key -> np.ndarray vị trí trong records
+    version : kb_version lúc build
+    """
+    records: List[Dict[str, Any]]
+    postings: Dict[str, Dict[str, np.ndarray]]
+    version: str = ""
+
+
+def parse_registry_records(kb) -> List[Dict[str, Any]]:
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = unpack_kb(kb)
+    records = []
+    for i in range(len(ANSWERS)):
+        doc_id = str(IDS[i]) if IDS is not None else ""
+        is_registry = doc_id.startswith(REGISTRY_ID_PREFIX) or (
+            ENTITY_TYPE is not None and str(ENTITY_TYPE[i]) == "registry"
+        )
+        if not is_registry:
+            continue
+        rec = parse_registry_answer(ANSWERS[i])
+        if not rec.get("trade_name"):
+            continue
+        rec["idx"] = i
+        rec["id"] = doc_id
+        records.append(rec)
+    return records
+
+
+def index_registry_records(records: List[Dict[str, Any]], version: str = "") -> RegistryIndex:
+    postings: Dict[str, Dict[str, List[int]]] = {f: {} for f in REGISTRY_FIELDS}
+    for pos, rec in enumerate(records):
+        for field, keys in _index_keys(rec).items():
+            for k in keys:
+                postings[field].setdefault(k, []).append(pos)
+    frozen = {f: {k: np.asarray(v, dtype=np.int64) for k, v in d.items()} for f, d in postings.items()}
+    return RegistryIndex(records=records, postings=frozen, version=version)
+
+
+def build_registry_index(kb) -> RegistryIndex:
+    return index_registry_records(parse_registry_records(kb), version=kb_version(kb))
+
+
+def save_registry_index(path, index: RegistryIndex) -> None:
+    # chỉ lưu record đã parse; postings dựng lại khi load (vài ms)
+    Path(path).write_text(
+        json.dumps({"version": index.version, "records": index.records}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+
+
+def load_registry_index(path, expected_version: Optional[str] = None) -> Optional[RegistryIndex]:
+    p = Path(path)
+    if not p.exists():
+        return None
+    data = json.loads(p.read_text(encoding="utf-8"))
+    if expected_version and data.get("version") != expected_version:
+        return None
+    return index_registry_records(data["records"], version=data.get("version", ""))
+
+
+def registry_sidecar_path(npz_path) -> Path:
+    p = Path(npz_path)
+    return p.with_name(p.stem + REGISTRY_SUFFIX)
+
+
+def attach_registry_index(kb, npz_path) -> Optional[RegistryIndex]:
+    index = load_registry_index(registry_sidecar_path(npz_path), expected_version=kb_version(kb))
+    if index is not None:
+        set_kb_index(kb, "registry", index)
+    return index
+
+
+def get_registry_index(kb) -> RegistryIndex:
+    return get_kb_index(kb, "registry", lambda: build_registry_index(kb))
+
+
+def match_registry_query(index: RegistryIndex, user_query: str) -> Dict[str, List[str]]:
+    """
+    field -> các key xuất hiện trong query (n-gram, cụm dài trước, không chồng lấp).
+    Key có ở nhiều field -> gán cho field có nhiều dòng hơn ("cam": vài dòng pest
+    "chiết cành hồ tiêu, cam" vs hàng trăm dòng crop); bằng nhau -> theo thứ tự REGISTRY_FIELDS.
+    """
+    words = _key(user_query).split()
+    matched: Dict[str, List[str]] = {}
+    # từ vựng tra cứu đứng riêng lẻ không được khớp; trong cụm dài vẫn được ("nhen do")
+    stop = [w in QUERY_STOPWORDS for w in words]
+    taken = [False] * len(words)
+    for n in range(min(MAX_NGRAM, len(words)), 0, -1):
+        for s in range(len(words) - n + 1):
+            if any(taken[s:s + n]) or all(stop[s:s + n]):
+                continue
+            k = " ".join(words[s:s + n])
+            fields = [f for f in REGISTRY_FIELDS if k in index.postings[f]]
+            if not fields:
+                continue
+            field = max(fields, key=lambda f: len(index.postings[f][k]))
+            matched.setdefault(field, []).append(k)
+            taken[s:s + n] = [True] * n
+    return matched
+
+
+def lookup_registry(index: RegistryIndex, user_query: str):
+    """
+    Return (positions, matched): AND giữa các field, OR trong 1 field; thứ tự theo danh mục.
+    """
+    matched = match_registry_query(index, user_query)
+    if not matched:
+        return np.zeros(0, dtype=np.int64), matched
+
+    result = None
+    for field, keys in matched.items():
+        rows = np.unique(np.concatenate([index.postings[field][k] for k in keys]))
+        result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+    return result, matched
+
+
+def registry_page(kb, user_query: str, *, cursor: Optional[str] = None, page_size: int = 50) -> ListingPage:
+    """
+    Trang kết quả tra danh mục; groups theo hoạt chất.
+    """
+    index = get_registry_index(kb)
+    positions, matched = lookup_registry(index, user_query)
+    offset = _parse_cursor(cursor)
+
+    items = []
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for pos in positions[offset: offset + page_size].tolist():
+        rec = index.records[pos]
+        item = {
+            "idx": rec["idx"],
+            "id": rec["id"],
+            "trade_name": rec.get("trade_name", ""),
+            "active": rec.get("active", ""),
+            "targets": rec.get("targets", ""),
+            "registrant": rec.get("registrant", ""),
+        }
+        items.append(item)
+        groups.setdefault(item["active"] or "khác", []).append(item)
+
+    end = offset + len(items)
+    return ListingPage(
+        items=items,
+        groups=groups,
+        total=len(positions),
+        cursor=str(offset),
+        next_cursor=str(end) if end < len(positions) else None,
+    )
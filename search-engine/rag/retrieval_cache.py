@@ -0,0 +1,147 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from rag.config import RAGConfig
+from rag.kb_index import kb_version
+
+# ======================
+# RETRIEVAL CACHE (dùng chung mọi thread trong process)
+#   - Khoá: (query text hoặc hash embedding, must_tags, any_tags, top_k, partitions, KB version)
+#   - Giá trị: mảng gọn (idx, sim, stage, match_count) -> dựng lại hit dict bằng build_hits
+#     (mỗi lần trả list dict mới, pipeline ghi fused_score vào hit không ảnh hưởng cache)
+#   - Kèm cache embedding theo text: câu lặp lại không gọi embeddings API
+# ======================
+
+STAGES = ("STRICT", "FALLBACK1_DROP_ANY", "FALLBACK2_DROP_MUST_FULL_RECALL")
+_STAGE_CODE = {s: i for i, s in enumerate(STAGES)}
+
+
+@dataclass(frozen=True)
+class CachedRetrieval:
+    idx: np.ndarray          # int32 [n] — thứ tự picked
+    sims: np.ndarray         # float32 [n]
+    stage: np.ndarray        # uint8 [n] — index vào STAGES
+    match_count: np.ndarray  # int16 [n]
+
+    @classmethod
+    def from_pick(cls, picked, sims, stage_by_idx: dict, match_count_by_idx: dict) -> "CachedRetrieval":
+        idx = np.asarray(picked, dtype=np.int32)
+        return cls(
+            idx=idx,
+            sims=np.asarray([sims[i] for i in picked], dtype=np.float32),
+            stage=np.asarray([_STAGE_CODE.get(stage_by_idx.get(i, "STRICT"), 0) for i in picked], dtype=np.uint8),
+            match_count=np.asarray([match_count_by_idx.get(i, 0) for i in picked], dtype=np.int16),
+        )
+
+    def build_args(self):
+        """
+        (picked, sims, stage_by_idx, match_count_by_idx) đúng chữ ký retriever.build_hits.
+        """
+        picked = self.idx.tolist()
+        return (
+            picked,
+            dict(zip(picked, self.sims.tolist())),
+            {i: STAGES[c] for i, c in zip(picked, self.stage.tolist())},
+            dict(zip(picked, self.match_count.tolist())),
+        )
+
+
+class LRUCache:
+    """
+    LRU đơn giản, thread-safe, có đếm hit/miss.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def resize(self, max_entries: int) -> None:
+        with self._lock:
+            self.max_entries = max_entries
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+RETRIEVAL_CACHE = LRUCache(RAGConfig.retrieval_cache_max_entries)
+QUERY_VEC_CACHE = LRUCache(RAGConfig.query_vec_cache_max_entries)
+
+
+def configure_retrieval_cache(cfg=RAGConfig) -> None:
+    """
+    Kích thước 2 cache theo cfg của process (mặc định lấy từ RAGConfig lúc import).
+    Bật/tắt cache theo cfg của từng lời gọi (get/put nhận cfg).
+    """
+    RETRIEVAL_CACHE.resize(cfg.retrieval_cache_max_entries)
+    QUERY_VEC_CACHE.resize(cfg.query_vec_cache_max_entries)
+
+
+def retrieval_key(kb, query, must_tags, any_tags, top_k: int, partitions=None) -> str:
+    """
+    query: text (str) hoặc embedding đã normalize (np.ndarray).
+    Thứ tự tag không ảnh hưởng kết quả search -> sort trước khi băm.
+    """
+    h = hashlib.sha1()
+    if isinstance(query, str):
+        h.update(b"t:" + query.strip().encode("utf-8"))
+    else:
+        h.update(b"v:" + np.ascontiguousarray(query, dtype=np.float32).tobytes())
+    h.update("\x1f".join([
+        "|".join(sorted(must_tags or [])),
+        "|".join(sorted(any_tags or [])),
+        str(int(top_k)),
+        "|".join(partitions) if partitions else "ALL",
+        kb_version(kb),
+    ]).encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_cached_retrieval(key: str, cfg=RAGConfig) -> Optional[CachedRetrieval]:
+    if not cfg.use_retrieval_cache:
+        return None
+    return RETRIEVAL_CACHE.get(key)
+
+
+def put_cached_retrieval(key: str, value: CachedRetrieval, cfg=RAGConfig) -> None:
+    if cfg.use_retrieval_cache:
+        RETRIEVAL_CACHE.put(key, value)
@@ -2,19 +2,43 @@ import re
 import json
 import numpy as np
 from rag.config import RAGConfig
-from rag.debug_log import debug_log
-from rag.logger import get_logger, new_trace_id
+from rag.debug_log import DEBUG, debug_enabled, debug_log
+from rag.logger import get_logger
+from rag.tracing import annotate, current_trace_id, span
+from rag.kb_index import unpack_kb
+from rag.llm import embedding_create
+from rag.partitions import get_partition_index, scan_partitions
+from rag.retrieval_cache import (
+    QUERY_VEC_CACHE,
+    CachedRetrieval,
+    get_cached_retrieval,
+    put_cached_retrieval,
+    retrieval_key,
+)
 
 logger = get_logger()
 
 
-def embed_query(client, text: str):
-    resp = client.embeddings.create(
+def embed_query(client, text: str, cfg=RAGConfig):
+    cache_key = ("text-embedding-3-small", text.strip())
+    if cfg.use_retrieval_cache:
+        v = QUERY_VEC_CACHE.get(cache_key)
+        if v is not None:
+            annotate(cached=True)
+            return v
+
+    resp = embedding_create(
+        client,
+        site="embed_query",
         model="text-embedding-3-small",
         input=[text],
     )
     v = np.array(resp.data[0].embedding, dtype=np.float32)
     v = v / (np.linalg.norm(v) + 1e-8)
+    v.setflags(write=False)  # dùng chung giữa các request
+
+    if cfg.use_retrieval_cache:
+        QUERY_VEC_CACHE.put(cache_key, v)
     return v
 
 
@@ -81,10 +105,14 @@ def _parse_tags_any_format(x):
     return {s}
 
 
-def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=None):
+def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=None, partitions=None, query_vec=None, cfg=RAGConfig):
     """
     must_tags: list[str] -> AND condition (must include all)
     any_tags : list[str] -> OR condition (must include at least one)
+    partitions: tuple[str] entity_type partitions to scan (see rag.partitions);
+                None -> full index. Empty result on partitions -> retry full index.
+    query_vec : normalized query embedding if the caller already has it (skips the embedding call).
+    cfg       : RAGConfig of the caller (use_retrieval_cache).
     If TAGS_V2 is missing in KB, filtering is skipped (backward compatible).
 
     Output item fields (added):
@@ -94,29 +122,47 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
     must_tags = list(must_tags or [])
     any_tags = list(any_tags or [])
 
-    trace_id = new_trace_id()
+    trace_id = current_trace_id()
     logger.debug(
         f"Tag filter: must={must_tags}, any={any_tags}",
         extra={"trace_id": trace_id},
     )
 
+    # --- Retrieval cache: câu lặp lại -> dựng lại hits từ mảng đã lưu ---
+    cache_key = retrieval_key(
+        kb,
+        norm_query if query_vec is None else query_vec,
+        must_tags,
+        any_tags,
+        top_k,
+        partitions,
+    )
+    cached = get_cached_retrieval(cache_key, cfg)
+    if cached is not None:
+        debug_log(f"=== RETRIEVAL CACHE HIT: {len(cached.idx)} docs ===")
+        with span("build_hits", cached=True):
+            return build_hits(kb, *cached.build_args())
+
     # Backward compatibility:
-    if len(kb) >= 9:
-        EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = kb
-    else:
-        EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS = kb
-        TAGS_V2 = None
-        ENTITY_TYPE = None
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = unpack_kb(kb)
 
     # --- Query embedding ---
-    q = embed_query(client, norm_query)
+    q = query_vec if query_vec is not None else embed_query(client, norm_query, cfg)
 
-    # --- Similarity ---
-    embs = np.array(EMBS, dtype=np.float32)
-    sims = embs @ q
-    idx_sorted = np.argsort(-sims)
+    # --- Similarity (chỉ trên các partition entity_type liên quan) ---
+    pindex = get_partition_index(kb)
 
-    debug = True
+    def scan(parts):
+        with span("scan", partitions=",".join(parts) if parts else "ALL") as sp:
+            cand_idx, cand_sims = scan_partitions(pindex, q, parts)
+            sims_full = np.full(len(pindex.order), -np.inf, dtype=np.float32)
+            sims_full[cand_idx] = cand_sims
+            sp.set(scanned=len(cand_idx))
+            return sims_full, cand_idx[np.argsort(-cand_sims)]
+
+    sims, idx_sorted = scan(partitions)
+
+    debug = debug_enabled(DEBUG)  # dump từng candidate chỉ ở level DEBUG
     debug_limit = 120  # log candidates
 
     # Track per-index info for later scoring / debug
@@ -207,16 +253,16 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
                 break
 
         if debug:
-            debug_log(f"=== PICKED {len(picked_local)}/{top_k} in stage {stage_name} ===")
+            lines = [f"=== PICKED {len(picked_local)}/{top_k} in stage {stage_name} ==="]
             for r, idx in enumerate(picked_local[: min(len(picked_local), 30)], 1):
                 tv2 = str(TAGS_V2[idx]) if TAGS_V2 is not None else ""
                 nm = int(match_count_by_idx.get(idx, 0))
-                debug_log(
+                lines += [
                     f"  #{r:02d} idx={idx} sim={float(sims[idx]):.4f} matches={nm} id={IDS[idx] if IDS is not None else ''}",
                     f"      Q: {str(QUESTIONS[idx])[:140] if QUESTIONS is not None else ''}",
                     f"      tags_v2: {tv2[:200]}",
-                )
-            debug_log("")
+                ]
+            debug_log(*lines, level=DEBUG)
 
         return picked_local
 
@@ -232,32 +278,62 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
                 break
         return out
 
-    # --- Strict first ---
-    picked = pick_indices(must_tags, any_tags, "STRICT")
-    final_stage = "STRICT"
-
-    # Fallback 1: drop ANY (keep MUST), only if ANY existed and strict not enough
-    if len(picked) < top_k and any_tags:
-        picked_fb1 = pick_indices(must_tags, [], "FALLBACK1_DROP_ANY")
-        picked = merge_fill(picked, picked_fb1, top_k)
-        final_stage = "STRICT+FALLBACK1"
-
-    # Fallback 2: drop MUST too (full recall), only if strict still not enough
-    if len(picked) < top_k and must_tags:
-        picked_fb2 = pick_indices([], [], "FALLBACK2_DROP_MUST_FULL_RECALL")
-        picked = merge_fill(picked, picked_fb2, top_k)
-        final_stage = "STRICT+FALLBACK1+FALLBACK2"
-
-    if debug:
-        debug_log(
-            "=== FINAL PICK STAGE ===",
-            f"final_stage : {final_stage}",
-            f"picked_count: {len(picked)}",
-            f"top_k       : {top_k}",
-            "========================",
-        )
+    def run_stages():
+        with span("filter") as sp:
+            # --- Strict first ---
+            picked = pick_indices(must_tags, any_tags, "STRICT")
+            final_stage = "STRICT"
+
+            # Fallback 1: drop ANY (keep MUST), only if ANY existed and strict not enough
+            if len(picked) < top_k and any_tags:
+                picked_fb1 = pick_indices(must_tags, [], "FALLBACK1_DROP_ANY")
+                picked = merge_fill(picked, picked_fb1, top_k)
+                final_stage = "STRICT+FALLBACK1"
+
+            # Fallback 2: drop MUST too (full recall), only if strict still not enough
+            if len(picked) < top_k and must_tags:
+                picked_fb2 = pick_indices([], [], "FALLBACK2_DROP_MUST_FULL_RECALL")
+                picked = merge_fill(picked, picked_fb2, top_k)
+                final_stage = "STRICT+FALLBACK1+FALLBACK2"
+
+            sp.set(stage=final_stage, picked=len(picked))
+            return picked, final_stage
+
+    picked, final_stage = run_stages()
+
+    # Partition không có doc nào -> quét lại toàn bộ index
+    if not picked and partitions:
+        match_count_by_idx.clear()
+        stage_by_idx.clear()
+        reason_by_idx.clear()
+        sims, idx_sorted = scan(None)
+        picked, final_stage = run_stages()
+        final_stage += "+FULL_INDEX"
+
+    debug_log(
+        "=== FINAL PICK STAGE ===",
+        f"partitions  : {list(partitions) if partitions else 'ALL'}",
+        f"scanned     : {len(idx_sorted)}/{len(pindex.order)}",
+        f"final_stage : {final_stage}",
+        f"picked_count: {len(picked)}",
+        f"top_k       : {top_k}",
+        "========================",
+    )
+
+    put_cached_retrieval(cache_key, CachedRetrieval.from_pick(picked, sims, stage_by_idx, match_count_by_idx), cfg)
 
     # --- Build results ---
+    with span("build_hits", cached=False):
+        return build_hits(kb, picked, sims, stage_by_idx, match_count_by_idx)
+
+
+def build_hits(kb, picked, sims, stage_by_idx: dict, match_count_by_idx: dict):
+    """
+    Dựng list hit dict từ index KB + similarity (sims[i] = cosine của doc i).
+    Dùng chung cho search() và các đường re-score (session follow-up, cache...).
+    """
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = unpack_kb(kb)
+
     results = []
     for i in picked:
         i = int(i)
@@ -279,6 +355,7 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
         score = base_sim + bonus
 
         item = {
+            "idx": i,
             "id": str(IDS[i]) if IDS is not None else "",
             "question": str(QUESTIONS[i]) if QUESTIONS is not None else "",
             "alt_question": str(ALT_QUESTIONS[i]) if ALT_QUESTIONS is not None else "",
@@ -1,6 +1,8 @@
 import re
 
-def route_query(client, user_query: str) -> str:
+from rag.llm import chat_completion
+
+def route_query(client, user_query: str, use_llm: bool = True) -> str:
     """
     Trả về:
     - "RAG"    : ưu tiên dùng tài liệu nội bộ
@@ -51,6 +53,10 @@ def route_query(client, user_query: str) -> str:
     # ---------------------------
     # 3) LLM router (khi heuristic không quyết được)
     # ---------------------------
+    if not use_llm:
+        # hết latency budget: không gọi LLM, mặc định RAG như fallback bên dưới
+        return "RAG"
+
     system_prompt = """
 Bạn là bộ phân luồng câu hỏi cho hệ thống trợ lý nông nghiệp của BMCVN.
 
@@ -63,7 +69,9 @@ LUẬT:
 - Chỉ trả lời GLOBAL hoặc RAG, không thêm bất kỳ ký tự nào khác.
 """.strip()
 
-    resp = client.chat.completions.create(
+    resp = chat_completion(
+        client,
+        site="router",
         model="gpt-4o-mini",
         temperature=0,
         messages=[
@@ -23,11 +23,31 @@ def analyze_hits_fused(hits: list) -> dict:
 def fused_score(h: dict, w_r: float = 0.70, w_e: float = 0.30) -> float:
     """
     Score hợp nhất cho 1 doc.
-    - Ưu tiên rerank_score (nếu có)
-    - Fallback sang embedding score nếu rerank_score không có/0
+    - Ưu tiên llm_rerank_score (LLM chấm 0–1; 0.0 là điểm thật = không liên quan)
+    - Sau đó rerank_score của local reranker (nếu có/khác 0)
+    - Fallback sang embedding score
     """
-    r = float(h.get("rerank_score", 0.0) or 0.0)
     e = float(h.get("score", 0.0) or 0.0)
+    llm = h.get("llm_rerank_score")
+    if llm is not None:
+        return w_r * float(llm) + w_e * e
+    r = float(h.get("rerank_score", 0.0) or 0.0)
     if r <= 0.0:
         return e
-    return w_r * r + w_e * e
\ No newline at end of file
+    return w_r * r + w_e * e
+
+def rerank_tier(h: dict) -> int:
+    """
+    2 = có llm_rerank_score, 1 = có rerank_score (local), 0 = chỉ có embedding score.
+    """
+    if h.get("llm_rerank_score") is not None:
+        return 2
+    return 1 if float(h.get("rerank_score", 0.0) or 0.0) > 0.0 else 0
+
+def rank_key(h: dict) -> tuple:
+    """
+    Khoá sort (giảm dần): hit đã được rerank chấm luôn đứng trên hit chưa chấm
+    (ngoài top_k_rerank, batch lỗi / trễ) -> fused_score của 2 nhóm khác thang đo,
+    không so trực tiếp (doc LLM chấm 0.5 không bị doc embedding 0.6 chưa chấm vượt).
+    """
+    return rerank_tier(h), fused_score(h)
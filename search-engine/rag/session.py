@@ -0,0 +1,200 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rag.kb_index import unpack_kb
+from rag.retriever import build_hits
+from rag.tag_filter import _norm
+
+# ======================
+# CONVERSATION SESSION CACHE
+#   - Giữ candidate pool + tags + query embedding của câu hỏi trước
+#   - Câu hỏi nối tiếp ("còn liều dùng thì sao?") -> re-score trong pool cũ,
+#     bỏ qua route -> normalize -> full scan
+#   - Bộ nhớ có giới hạn: max_sessions (LRU) + idle expiry; pool chỉ lưu index KB
+#     (embedding lấy lại từ EMBS dùng chung, không copy)
+# ======================
+
+# Tín hiệu câu hỏi nối tiếp (so khớp trên text đã bỏ dấu): chỉ nhận câu có đại từ / tỉnh lược
+# trỏ về câu trước. Đuôi "thế nào / ra sao" một mình KHÔNG đủ (câu hỏi độc lập cũng kết thúc như vậy).
+FOLLOW_UP_PATTERNS = [
+    # "còn liều dùng?", "thế còn thời gian cách ly?", "vậy thì pha bao nhiêu?"
+    # ("con sâu/rầy..." là loại từ, "thế nào là..." là câu mới -> không tính)
+    r"^(con|the con|vay con|vay thi|the thi|vay|the)\b(?!\s+(sau|ray|bo|nhen|rep|oc|ruoi|mot|chuot|nao|he)\b)",
+    # "liều dùng thì sao?"
+    r"\bthi sao\s*\??$",
+    # "thuốc đó", "loại này", "sản phẩm kia"
+    r"\b(cai|thuoc|san pham|loai|chai|goi) (do|nay|kia)\b",
+    # so sánh trong các lựa chọn của câu trước: "loại nào rẻ hơn?", "thuốc nào mạnh hơn?"
+    r"^(loai|cai|thuoc|san pham|chai|goi) nao\b.*\bhon\b",
+]
+# "nó": so trên text còn dấu (bỏ dấu thì trùng "nở", "nổ", "no")
+FOLLOW_UP_PRONOUN_RE = re.compile(r"(?<!\w)nó(?!\w)")
+# Câu mới nêu sản phẩm / hoạt chất / sâu bệnh / cây trồng chưa có trong câu trước -> câu hỏi mới
+SUBJECT_TAG_PREFIXES = ("product:", "alias:", "brand:", "chemical:", "pest:", "disease:", "weed:", "crop:")
+FOLLOW_UP_MAX_WORDS = 12
+
+
+@dataclass
+class ConversationSession:
+    session_id: str
+    last_query: str = ""
+    norm_query: str = ""
+    must_tags: List[str] = field(default_factory=list)
+    any_tags: List[str] = field(default_factory=list)
+    partitions: Optional[tuple] = None
+    query_vec: Optional[np.ndarray] = None
+    pool_idx: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    pool_stage: Dict[int, str] = field(default_factory=dict)
+    pool_match_count: Dict[int, int] = field(default_factory=dict)
+    follow_ups: int = 0
+    updated_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def has_pool(self) -> bool:
+        return len(self.pool_idx) > 0
+
+    def remember(
+        self,
+        *,
+        user_query: str,
+        norm_query: str,
+        must_tags,
+        any_tags,
+        partitions,
+        query_vec,
+        hits: List[Dict[str, Any]],
+        max_pool: int = 400,
+    ) -> None:
+        """
+        Lưu câu hỏi gốc + candidate pool (sau retrieval) để câu sau re-rank.
+        """
+        hits = [h for h in hits if "idx" in h][:max_pool]
+        self.last_query = user_query
+        self.norm_query = norm_query
+        self.must_tags = list(must_tags or [])
+        self.any_tags = list(any_tags or [])
+        self.partitions = partitions
+        self.query_vec = query_vec
+        self.pool_idx = np.asarray([h["idx"] for h in hits], dtype=np.int64)
+        self.pool_stage = {int(h["idx"]): h.get("stage", "STRICT") for h in hits}
+        self.pool_match_count = {int(h["idx"]): int(h.get("match_count", 0)) for h in hits}
+        self.follow_ups = 0
+        self.touch()
+
+    def reset(self) -> None:
+        """
+        Câu hỏi mới không qua retrieval (GLOBAL, listing, fact store, danh mục) -> bỏ pool cũ,
+        câu sau không re-rank nhầm trên chủ đề trước đó.
+        """
+        self.last_query = ""
+        self.norm_query = ""
+        self.must_tags = []
+        self.any_tags = []
+        self.partitions = None
+        self.query_vec = None
+        self.pool_idx = np.zeros(0, dtype=np.int64)
+        self.pool_stage = {}
+        self.pool_match_count = {}
+        self.follow_ups = 0
+        self.touch()
+
+    def touch(self) -> None:
+        self.updated_at = time.monotonic()
+
+
+class SessionStore:
+    """
+    LRU theo thời gian truy cập + hết hạn khi idle quá idle_ttl_s. Thread-safe.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl_s: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, s: ConversationSession, now: float) -> bool:
+        return (now - s.updated_at) > self.idle_ttl_s
+
+    def get(self, session_id: str) -> ConversationSession:
+        now = time.monotonic()
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is not None and self._expired(s, now):
+                del self._sessions[session_id]
+                s = None
+            if s is None:
+                s = ConversationSession(session_id=session_id)
+                self._sessions[session_id] = s
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return s
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self, now: float) -> None:
+        # cũ nhất ở đầu OrderedDict
+        while self._sessions:
+            sid, s = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or self._expired(s, now):
+                del self._sessions[sid]
+            else:
+                break
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+def is_follow_up(user_query: str, session: Optional[ConversationSession], new_must=None, new_any=None) -> bool:
+    """
+    Câu ngắn, có đại từ / tỉnh lược trỏ về câu trước ("còn…", "thuốc đó", "loại này", "nó")
+    hoặc so sánh ("loại nào rẻ hơn?") và không nêu sản phẩm/sâu bệnh/cây trồng mới
+    -> hỏi tiếp trên chủ đề cũ.
+    """
+    if session is None or not session.has_pool:
+        return False
+
+    qn = _norm(user_query)
+    n_words = len(qn.split())
+    if n_words == 0 or n_words > FOLLOW_UP_MAX_WORDS:
+        return False
+
+    old_tags = set(session.must_tags) | set(session.any_tags)
+    if any(str(t).startswith(SUBJECT_TAG_PREFIXES) and t not in old_tags for t in (new_must or []) + (new_any or [])):
+        return False
+
+    if FOLLOW_UP_PRONOUN_RE.search((user_query or "").lower()):
+        return True
+    return any(re.search(p, qn) for p in FOLLOW_UP_PATTERNS)
+
+
+def rescore_in_session(kb, session: ConversationSession, query_vec: np.ndarray, extra_hits=None) -> List[Dict[str, Any]]:
+    """
+    Re-score candidate pool cũ theo query_vec mới (1 phép nhân [pool x d]).
+    extra_hits: kết quả search nhỏ cho tag mới -> merge (giữ score cao hơn theo idx).
+    """
+    EMBS = unpack_kb(kb)[0]
+    idx = session.pool_idx
+
+    sims = {}
+    if len(idx):
+        pool_sims = np.asarray(EMBS[idx], dtype=np.float32) @ query_vec
+        sims = dict(zip(idx.tolist(), pool_sims.tolist()))
+
+    hits = build_hits(kb, idx.tolist(), sims, session.pool_stage, session.pool_match_count)
+
+    merged = {h["idx"]: h for h in hits}
+    for h in extra_hits or []:
+        old = merged.get(h["idx"])
+        if old is None or float(h["score"]) > float(old["score"]):
+            merged[h["idx"]] = h
+
+    return sorted(merged.values(), key=lambda x: x["score"], reverse=True)
@@ -2,7 +2,8 @@ import re
 import unicodedata
 from rag.debug_log import debug_log
 from typing import Dict, List, Tuple, Set, Any, Union, Optional
-from rag.logger import get_logger, new_trace_id
+from rag.logger import get_logger
+from rag.tracing import current_trace_id
 
 # ======================
 # 1) NORMALIZE
@@ -2620,7 +2621,7 @@ def infer_filters_from_query(q: str):
     must, anyt = apply_group_rules(q0, found)
     must, anyt = finalize_filters(must, anyt)
 
-    trace_id = new_trace_id()
+    trace_id = current_trace_id()
     logger.debug(
         f"Tag filter: must={must}, any={anyt}",
         extra={"trace_id": trace_id}
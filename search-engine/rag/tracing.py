@@ -0,0 +1,152 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from rag.logger import new_trace_id
+
+# ======================
+# TRACING (span theo stage, 1 trace / request)
+#   - start_trace() ở đầu answer_with_suggestions: tạo trace_id + span gốc, lưu trong contextvars
+#   - with span("embed"): ... đo thời gian 1 stage; span lồng nhau -> cây span
+#   - Không có trace đang chạy -> span() là no-op (gọi retriever/generator lẻ không tốn gì)
+#   - contextvars không tự sang thread pool (LLM rerank, hedging) -> chỉ đặt span ở thread gọi
+# ======================
+
+
+@dataclass
+class Span:
+    name: str
+    start: float = field(default_factory=time.perf_counter)
+    end: Optional[float] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    children: List["Span"] = field(default_factory=list)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {"name": self.name, "ms": round(self.duration_ms(), 1)}
+        if self.attrs:
+            d["attrs"] = dict(self.attrs)
+        if self.children:
+            d["children"] = [c.to_dict() for c in self.children]
+        return d
+
+
+class _NoopSpan:
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    root: Span
+
+    def stages(self) -> Dict[str, float]:
+        """
+        {"retrieve/scan": ms, ...}: đường dẫn tên span dưới gốc; span trùng tên (vd. scan lần 2) cộng dồn.
+        """
+        out: Dict[str, float] = {}
+
+        def walk(s: Span, prefix: str) -> None:
+            for c in s.children:
+                path = f"{prefix}{c.name}"
+                out[path] = round(out.get(path, 0.0) + c.duration_ms(), 1)
+                walk(c, path + "/")
+
+        walk(self.root, "")
+        return out
+
+    def timings(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round(self.root.duration_ms(), 1),
+            "stages": self.stages(),
+            "spans": [c.to_dict() for c in self.root.children],
+        }
+
+    def format(self) -> str:
+        lines = []
+
+        def walk(s: Span, depth: int) -> None:
+            attrs = " ".join(f"{k}={v}" for k, v in s.attrs.items())
+            lines.append(f"{'  ' * depth}{s.name:<{24 - 2 * depth}} {s.duration_ms():9.1f} ms  {attrs}".rstrip())
+            for c in s.children:
+                walk(c, depth + 1)
+
+        walk(self.root, 0)
+        return "\n".join(lines)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("rag_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("rag_span", default=None)
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None):
+    """
+    Mở trace mới (kể cả khi đang có trace ngoài: trace ngoài được khôi phục khi thoát).
+    """
+    trace = Trace(trace_id=trace_id or new_trace_id(), root=Span(name))
+    t_tok = _current_trace.set(trace)
+    s_tok = _current_span.set(trace.root)
+    try:
+        yield trace
+    finally:
+        trace.root.end = time.perf_counter()
+        _current_span.reset(s_tok)
+        _current_trace.reset(t_tok)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Span con của span hiện tại; exception -> attrs["error"] rồi raise tiếp.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield _NOOP
+        return
+
+    s = Span(name, attrs=attrs)
+    parent.children.append(s)
+    tok = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current_span.reset(tok)
+
+
+def annotate(**attrs) -> None:
+    """
+    Gắn thêm thuộc tính vào span hiện tại (vd. cached=True) mà không mở span mới.
+    """
+    s = _current_span.get()
+    if s is not None:
+        s.set(**attrs)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> str:
+    """
+    trace_id của request đang chạy (log của retriever / tag_filter cùng 1 id); ngoài trace -> id mới.
+    """
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else new_trace_id()
@@ -0,0 +1,40 @@
+import argparse
+
+from rag.kb_index import kb_version
+from rag.kb_loader import load_npz
+from rag.knn_graph import build_knn_graph, knn_sidecar_path, save_knn_graph
+from rag.product_facts import build_product_facts, facts_sidecar_path, save_product_facts
+from rag.registry_index import build_registry_index, registry_sidecar_path, save_registry_index
+
+NPZ_PATH = "01012026-data-kd-1-4-chuan-fix-brand.npz"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build các index phụ (sidecar) cho KB .npz")
+    ap.add_argument("--npz", default=NPZ_PATH, help="KB .npz (output của fast_run/build_vector_*.py)")
+    ap.add_argument("--knn_k", type=int, default=16, help="Số láng giềng lưu cho mỗi doc")
+    ap.add_argument("--block_size", type=int, default=1024, help="Số dòng mỗi block khi nhân ma trận")
+    args = ap.parse_args()
+
+    kb = load_npz(args.npz)
+    version = kb_version(kb)
+    print(f"KB: {args.npz} | docs={len(kb[0])} | version={version}")
+
+    graph = build_knn_graph(kb[0], k=args.knn_k, block_size=args.block_size, version=version)
+    out = knn_sidecar_path(args.npz)
+    save_knn_graph(out, graph)
+    print(f"✅ kNN graph: {graph.idx.shape} -> {out}")
+
+    facts = build_product_facts(kb, version=version)
+    out = facts_sidecar_path(args.npz)
+    save_product_facts(out, facts)
+    print(f"✅ product facts: {len(facts['products'])} sản phẩm -> {out}")
+
+    registry = build_registry_index(kb)
+    out = registry_sidecar_path(args.npz)
+    save_registry_index(out, registry)
+    print(f"✅ registry index: {len(registry.records)} dòng danh mục -> {out}")
+
+
+if __name__ == "__main__":
+    main()
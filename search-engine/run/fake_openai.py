@@ -0,0 +1,168 @@
+import hashlib
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from rag.tag_filter import _norm
+
+# ======================
+# FAKE OPENAI BACKEND (load test offline, không tốn token)
+#   - chat.completions.create: temperature=0 (router / normalize / rerank) -> echo câu user
+#     (router không nhận GLOBAL/RAG -> fallback RAG); còn lại -> câu trả lời tổng hợp answer_tokens token
+#   - Giả lập latency: TTFT (ttft_ms) + sinh token (tokens_per_s); stream -> từng chunk + usage chunk cuối
+#   - embeddings.create: bag-of-words vector hash (deterministic, EMB_DIM chiều) + embed_ms
+#     + thành phần "domain" chung (DOMAIN_WEIGHT): như embedding thật, 2 câu cùng lĩnh vực
+#     không bao giờ trực giao (cosine nền ~0.33), câu chung nhiều từ với doc -> cosine cao hơn
+#   - KB giả: câu hỏi / trả lời / tags thật từ CSV, embedding = vector hash của question
+#   -> đo được chi phí thật của pipeline (tag inference, scan NumPy, context, thread pool, HTTP)
+#      với latency LLM cố định; KHÔNG đo chất lượng câu trả lời
+# ======================
+
+EMB_DIM = 1536
+DOMAIN_WEIGHT = 0.7
+FAKE_KB_CSV = Path(__file__).resolve().parents[2] / "data" / "data-kd-1-4-tags-v2-chuan.csv"
+
+
+@lru_cache(maxsize=65536)
+def _word_vec(word: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha1(word.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(EMB_DIM).astype(np.float32)
+
+
+def hash_vec(text: str) -> np.ndarray:
+    words = _norm(str(text)).split() or [""]
+    v = np.sum([_word_vec(w) for w in words], axis=0)
+    domain = _word_vec("\x00domain")
+    v = v / np.linalg.norm(v) + DOMAIN_WEIGHT * domain / np.linalg.norm(domain)
+    return v / np.linalg.norm(v)
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _count_tokens(messages: List[Dict[str, Any]]) -> int:
+    # ước lượng thô: ~4 ký tự / token
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1
+
+
+class _FakeStream:
+    """
+    Giống openai.Stream: iterable chunk (delta.content), chunk cuối mang usage, có close().
+    """
+
+    def __init__(self, pieces: List[str], usage: SimpleNamespace, ttft_s: float, piece_s: float):
+        self._pieces = pieces
+        self._usage = usage
+        self._ttft_s = ttft_s
+        self._piece_s = piece_s
+        self._closed = False
+
+    def __iter__(self):
+        time.sleep(self._ttft_s)
+        for piece in self._pieces:
+            if self._closed:
+                return
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+            time.sleep(self._piece_s)
+        if not self._closed:
+            yield SimpleNamespace(choices=[], usage=self._usage)
+
+    def close(self) -> None:
+        self._closed = True
+
+
+class _FakeChatCompletions:
+    def __init__(self, backend: "FakeBackend"):
+        self._b = backend
+
+    def create(self, *, messages, stream: bool = False, temperature: float = 1.0, **kwargs):
+        b = self._b
+        user_text = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+        if not temperature:
+            text = user_text.strip()
+        else:
+            words = user_text.split()[:8] or ["câu hỏi"]
+            filler = "Nội dung trả lời mô phỏng từ tài liệu nội bộ."
+            text = " ".join(words) + ": " + " ".join([filler] * max(1, b.answer_tokens // 10))
+        n_out = max(1, len(text) // 4)
+        usage = _usage(_count_tokens(messages), n_out)
+        gen_s = n_out / b.tokens_per_s if b.tokens_per_s > 0 else 0.0
+
+        if stream:
+            pieces = [text[i:i + 16] for i in range(0, len(text), 16)] or [""]
+            return _FakeStream(pieces, usage, b.ttft_ms / 1000.0, gen_s / len(pieces))
+
+        time.sleep(b.ttft_ms / 1000.0 + gen_s)
+        message = SimpleNamespace(content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class _FakeEmbeddings:
+    def __init__(self, backend: "FakeBackend"):
+        self._b = backend
+
+    def create(self, *, input, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        time.sleep(self._b.embed_ms / 1000.0)
+        data = [SimpleNamespace(embedding=hash_vec(t).tolist()) for t in texts]
+        tokens = sum(len(t) for t in texts) // 4 + 1
+        return SimpleNamespace(data=data, usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens))
+
+
+class FakeOpenAI:
+    def __init__(self, backend: "FakeBackend"):
+        self.chat = SimpleNamespace(completions=_FakeChatCompletions(backend))
+        self.embeddings = _FakeEmbeddings(backend)
+
+
+@dataclass(frozen=True)
+class FakeBackend:
+    """
+    csv_path      : KB CSV (id, question, answer, category, tags, alt_questions, entity_type, tags_v2)
+    ttft_ms       : thời gian tới token đầu của mỗi chat call
+    tokens_per_s  : tốc độ sinh token (call không stream cũng chờ đủ thời gian này)
+    answer_tokens : độ dài (token) câu trả lời tổng hợp
+    embed_ms      : latency mỗi embeddings.create
+    """
+    csv_path: str = str(FAKE_KB_CSV)
+    ttft_ms: float = 300.0
+    tokens_per_s: float = 100.0
+    answer_tokens: int = 150
+    embed_ms: float = 30.0
+
+    def make_client(self) -> FakeOpenAI:
+        return FakeOpenAI(self)
+
+    def load_kb(self):
+        df = pd.read_csv(self.csv_path, dtype=str, keep_default_na=False)
+
+        def col(name: str) -> np.ndarray:
+            return df[name].to_numpy(dtype=object) if name in df.columns else np.array([""] * len(df), dtype=object)
+
+        EMBS = np.stack([hash_vec(q) for q in df["question"]])
+        return (
+            EMBS, col("question"), col("answer"), col("alt_questions"), col("category"),
+            col("tags"), col("id"), col("tags_v2"), col("entity_type"),
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "kb": Path(self.csv_path).name,
+            "ttft_ms": self.ttft_ms,
+            "tokens_per_s": self.tokens_per_s,
+            "answer_tokens": self.answer_tokens,
+            "embed_ms": self.embed_ms,
+        }
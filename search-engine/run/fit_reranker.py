@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+from rag.kb_index import unpack_kb
+from rag.kb_loader import load_npz
+from rag.llm import make_client
+from rag.local_rerank import FEATURES, WEIGHTS_PATH, fit_logistic, log_loss, rerank_features
+from rag.query_log import load_query_log
+from rag.retriever import search as retrieve_search
+from rag.tag_filter import infer_entity_type, infer_filters_from_query
+from rag.verbatim import parse_parent_and_index
+
+NPZ_PATH = "01012026-data-kd-1-4-chuan-fix-brand.npz"
+
+# ======================
+# FIT LOCAL RERANKER (offline)
+#   Nguồn nhãn:
+#   --labels  : JSONL {"query": ..., "positive_ids": [...]} (query lấy từ log, đã gán doc đúng)
+#   --export_from_log: xuất candidate của các query trong query log (thư mục JSONL / rag_logs.csv cũ) để gán nhãn
+#   --kb_alt_questions N: tự sinh nhãn từ KB (HỎI KHÁC của doc -> chính doc đó / cùng parent)
+# ======================
+
+
+def retrieve_candidates(client, kb, query: str, top_k: int):
+    must, anyt = infer_filters_from_query(query)
+    hits = retrieve_search(client=client, kb=kb, norm_query=query, top_k=top_k, must_tags=must, any_tags=anyt)
+    return hits, must + anyt
+
+
+def load_labels(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                row = json.loads(line)
+                if row.get("positive_ids"):
+                    yield row["query"], set(row["positive_ids"])
+
+
+def kb_alt_question_labels(kb, n: int, seed: int = 0):
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = unpack_kb(kb)
+    rows = [i for i in range(len(IDS)) if ALT_QUESTIONS is not None and str(ALT_QUESTIONS[i]).strip().lower() not in {"", "nan", "none"}]
+    random.Random(seed).shuffle(rows)
+    for i in rows[:n]:
+        alt = str(ALT_QUESTIONS[i]).split("|")[0].strip()
+        yield alt, {str(IDS[i])}
+
+
+def export_from_log(client, kb, log_path: str, out_path: str, top_k: int):
+    # thư mục query log (JSONL) hoặc rag_logs.csv cũ
+    if os.path.isdir(log_path):
+        df = load_query_log(log_path)
+    else:
+        df = pd.read_csv(log_path, encoding="utf-8-sig")
+    if df.empty:
+        print(f"⚠️ {log_path}: không có query nào")
+        return
+    df = df[df.get("route", "RAG") == "RAG"]
+    queries = [q for q in df["norm_query"].fillna("").astype(str).unique() if q.strip()]
+    with open(out_path, "w", encoding="utf-8") as f:
+        for q in queries:
+            hits, _ = retrieve_candidates(client, kb, q, top_k)
+            f.write(json.dumps({
+                "query": q,
+                "positive_ids": [],
+                "candidates": [{"id": h["id"], "question": h["question"]} for h in hits],
+            }, ensure_ascii=False) + "\n")
+    print(f"✅ {len(queries)} query -> {out_path} (điền positive_ids rồi chạy lại với --labels)")
+
+
+def mrr(scores_by_query):
+    rr = []
+    for s, y in scores_by_query:
+        order = np.argsort(-s)
+        ranks = np.nonzero(y[order] > 0)[0]
+        rr.append(1.0 / (ranks[0] + 1) if len(ranks) else 0.0)
+    return float(np.mean(rr)) if rr else 0.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fit trọng số local reranker từ query đã gán nhãn")
+    ap.add_argument("--npz", default=NPZ_PATH)
+    ap.add_argument("--labels", help="JSONL {query, positive_ids}")
+    ap.add_argument("--export_from_log", help="thư mục query log (hoặc rag_logs.csv) -> xuất candidate để gán nhãn")
+    ap.add_argument("--export_out", default="rerank_labels_todo.jsonl")
+    ap.add_argument("--kb_alt_questions", type=int, default=0, help="Số nhãn tự sinh từ HỎI KHÁC trong KB")
+    ap.add_argument("--top_k", type=int, default=60)
+    ap.add_argument("--holdout", type=float, default=0.2)
+    ap.add_argument("--out", default=WEIGHTS_PATH)
+    args = ap.parse_args()
+
+    client = make_client(api_key="...")
+    kb = load_npz(args.npz)
+
+    if args.export_from_log:
+        export_from_log(client, kb, args.export_from_log, args.export_out, args.top_k)
+        return
+
+    labelled = []
+    if args.labels:
+        labelled += list(load_labels(args.labels))
+    if args.kb_alt_questions:
+        labelled += list(kb_alt_question_labels(kb, args.kb_alt_questions))
+    if not labelled:
+        raise SystemExit("Không có nhãn: dùng --labels hoặc --kb_alt_questions")
+
+    groups = []
+    for query, positives in labelled:
+        pos_parents = {parse_parent_and_index(p)[0] for p in positives}
+        hits, tags = retrieve_candidates(client, kb, query, args.top_k)
+        if not hits:
+            continue
+        y = np.array([
+            1.0 if h["id"] in positives or parse_parent_and_index(h["id"])[0] in pos_parents else 0.0
+            for h in hits
+        ])
+        if y.sum() == 0:
+            continue  # doc đúng không nằm trong pool -> không học được gì cho reranker
+        X = rerank_features(kb, query, hits, tags, infer_entity_type(query)[0])
+        groups.append((X, y))
+
+    random.Random(0).shuffle(groups)
+    n_test = int(len(groups) * args.holdout)
+    test, train = groups[:n_test], groups[n_test:]
+    print(f"queries: train={len(train)} test={len(test)} (bỏ {len(labelled) - len(groups)} query không có doc đúng trong pool)")
+
+    Xtr = np.concatenate([g[0] for g in train])
+    ytr = np.concatenate([g[1] for g in train])
+    weights = fit_logistic(Xtr, ytr)
+
+    for name, w in zip(FEATURES, weights.w):
+        print(f"  {name:13s} {w:+.3f}")
+    print(f"  {'bias':13s} {weights.b:+.3f}")
+
+    if test:
+        Xte = np.concatenate([g[0] for g in test])
+        yte = np.concatenate([g[1] for g in test])
+        print(f"log loss (test): {log_loss(weights, Xte, yte):.4f}")
+        print(f"MRR dense only : {mrr([(g[0][:, 0], g[1]) for g in test]):.4f}")
+        print(f"MRR reranked   : {mrr([(weights.score(g[0]), g[1]) for g in test]):.4f}")
+
+    weights.save(args.out, n_queries=len(train), top_k=args.top_k)
+    print(f"✅ weights -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from run.fake_openai import FakeBackend
+
+# ======================
+# LOAD TEST cho run/server.py (asyncio, stdlib)
+#   - Mỗi mức concurrency: C client, mỗi client 1 kết nối keep-alive, gửi lần lượt câu hỏi
+#     (vòng lặp questions.txt) trong --duration_s giây
+#   - Báo cáo: throughput (req/s), latency p50/p95/p99, số lỗi / 503 theo từng mức
+#   - Server gọi OpenAI thật -> chạy tốn token: --duration_s nhỏ, --levels vừa phải
+#   - Server phải chạy --no_cache: questions.txt lặp vòng -> từ lượt 2 chỉ đo answer cache hit
+#     (readyz báo cache còn bật -> cảnh báo + ghi vào report)
+#   - --fake: tự chạy `python -m run.server --fake --no_cache` trên port trống (FakeBackend,
+#     không gọi OpenAI), đo xong SIGTERM server -> report tái lập được offline
+# ======================
+
+BASE_DIR = Path(__file__).resolve().parent
+QUESTIONS_TXT = BASE_DIR / "questions.txt"
+
+
+def load_questions(path: Path) -> List[str]:
+    out = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        q = line.strip()
+        if q and not q.startswith("#"):
+            out.append(q)
+    return out
+
+
+class Connection:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, payload=None) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+        head = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = status_head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {k.strip().lower(): v.strip() for k, v in (l.split(":", 1) for l in lines[1:] if ":" in l)}
+        data = await self.reader.readexactly(int(headers.get("content-length", "0")))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, data
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+async def run_level(host: str, port: int, questions: List[str], concurrency: int, duration_s: float,
+                    budget_ms: Optional[float]) -> Dict[str, float]:
+    latencies: List[float] = []
+    counts = {"ok": 0, "overloaded": 0, "errors": 0}
+    deadline = time.perf_counter() + duration_s
+
+    async def client(k: int):
+        conn = Connection(host, port)
+        i = k
+        try:
+            while time.perf_counter() < deadline:
+                payload = {"query": questions[i % len(questions)]}
+                if budget_ms:
+                    payload["budget_ms"] = budget_ms
+                i += concurrency
+                t0 = time.perf_counter()
+                try:
+                    status, _ = await conn.request("POST", "/answer", payload)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    counts["errors"] += 1
+                    await conn.close()
+                    await asyncio.sleep(0.2)  # server đang restart / shutdown
+                    continue
+                if status == 200:
+                    counts["ok"] += 1
+                    latencies.append((time.perf_counter() - t0) * 1000.0)
+                elif status == 503:
+                    counts["overloaded"] += 1
+                    await asyncio.sleep(0.2)
+                else:
+                    counts["errors"] += 1
+        finally:
+            await conn.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(k) for k in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    lat = np.asarray(latencies, dtype=np.float64)
+    row = {"concurrency": concurrency, "elapsed_s": round(elapsed, 1), **counts,
+           "throughput_rps": round(counts["ok"] / elapsed, 2) if elapsed else 0.0}
+    for name, q in (("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99)):
+        row[name] = round(float(np.percentile(lat, q)), 1) if len(lat) else None
+    return row
+
+
+def format_report(rows: List[Dict[str, float]], meta: Dict[str, str]) -> str:
+    cols = ["concurrency", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "ok", "overloaded", "errors", "elapsed_s"]
+    lines = ["# Load test: throughput vs concurrency", ""]
+    lines += [f"- {k}: {v}" for k, v in meta.items()]
+    lines += ["", "| " + " | ".join(cols) + " |", "|" + "---|" * len(cols)]
+    for r in rows:
+        lines.append("| " + " | ".join("-" if r.get(c) is None else str(r.get(c)) for c in cols) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def free_port(host: str) -> int:
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def spawn_fake_server(args) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "run.server", "--fake", "--no_cache",
+        "--host", args.host, "--port", str(args.port),
+        "--fake_ttft_ms", str(args.fake_ttft_ms),
+        "--fake_tokens_per_s", str(args.fake_tokens_per_s),
+        "--fake_answer_tokens", str(args.fake_answer_tokens),
+        "--fake_embed_ms", str(args.fake_embed_ms),
+    ]
+    if args.workers:
+        cmd += ["--workers", str(args.workers)]
+    print("Spawn:", " ".join(cmd), flush=True)
+    return subprocess.Popen(cmd, cwd=BASE_DIR.parent, stdout=subprocess.DEVNULL)
+
+
+async def wait_ready(host: str, port: int, timeout_s: float):
+    deadline = time.perf_counter() + timeout_s
+    while True:
+        conn = Connection(host, port)
+        try:
+            status, body = await conn.request("GET", "/readyz")
+            if status == 200:
+                return json.loads(body)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            status, body = None, b""
+        finally:
+            await conn.close()
+        if time.perf_counter() > deadline:
+            raise SystemExit(f"Server chưa sẵn sàng: {status} {body.decode('utf-8', 'replace')}")
+        await asyncio.sleep(0.5)
+
+
+async def main_async(args) -> None:
+    questions = load_questions(Path(args.questions))
+    if not questions:
+        raise SystemExit(f"Không có câu hỏi trong {args.questions}")
+
+    server = None
+    if args.fake:
+        args.port = free_port(args.host)
+        server = spawn_fake_server(args)
+    try:
+        state = await wait_ready(args.host, args.port, args.ready_timeout_s if args.fake else 0.0)
+        await run_levels(args, questions, state)
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+
+async def run_levels(args, questions: List[str], state) -> None:
+    caches = state.get("caches") or {}
+    if any(caches.values()):
+        print(f"CẢNH BÁO: server đang bật cache {caches} -> số đo gồm cache hit; chạy server với --no_cache",
+              flush=True)
+
+    rows = []
+    for c in args.levels:
+        row = await run_level(args.host, args.port, questions, c, args.duration_s, args.budget_ms)
+        print(json.dumps(row, ensure_ascii=False), flush=True)
+        rows.append(row)
+
+    meta = {
+        "server": f"http://{args.host}:{args.port}" + (" (--fake)" if args.fake else ""),
+        "workers": str(state.get("workers", "?")),
+        "caches": json.dumps(caches) if caches else "unknown (readyz không báo)",
+        "questions": f"{len(questions)} ({Path(args.questions).name})",
+        "duration per level": f"{args.duration_s}s",
+        "budget_ms": str(args.budget_ms or "server default"),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "cpus": str(os.cpu_count()),
+        "command": "python -m run.load_test " + " ".join(sys.argv[1:]),
+    }
+    if state.get("fake"):
+        meta["fake backend"] = json.dumps(state["fake"], ensure_ascii=False)
+    report = format_report(rows, meta)
+    print()
+    print(report)
+    if args.out:
+        Path(args.out).write_text(report, encoding="utf-8")
+        print(f"Report -> {args.out}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test run/server.py: throughput theo concurrency")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--questions", default=str(QUESTIONS_TXT))
+    ap.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    ap.add_argument("--duration_s", type=float, default=30.0)
+    ap.add_argument("--budget_ms", type=float, default=None)
+    ap.add_argument("--out", default="load_test_report.md")
+    ap.add_argument("--fake", action="store_true", help="Tự chạy server --fake --no_cache (offline, không tốn token)")
+    ap.add_argument("--workers", type=int, default=None, help="--fake: server_max_concurrency của server")
+    ap.add_argument("--ready_timeout_s", type=float, default=120.0)
+    ap.add_argument("--fake_ttft_ms", type=float, default=FakeBackend.ttft_ms)
+    ap.add_argument("--fake_tokens_per_s", type=float, default=FakeBackend.tokens_per_s)
+    ap.add_argument("--fake_answer_tokens", type=int, default=FakeBackend.answer_tokens)
+    ap.add_argument("--fake_embed_ms", type=float, default=FakeBackend.embed_ms)
+    asyncio.run(main_async(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,22 @@
-from openai import OpenAI
-
 from rag.config import RAGConfig
+from rag.llm import make_client, llm_stats
+from rag.metrics import start_metrics
 from rag.kb_loader import load_npz
-from rag.logger_csv import append_log_to_csv
-from rag.pipeline import answer_with_suggestions
+from rag.query_log import QueryLog
+from rag.pipeline import answer_with_suggestions, stream_answer_with_suggestions
 from policies.v7_policy import PolicyV7 as policy
 from pathlib import Path
-from rag.debug_log import debug_log
+from rag.debug_log import configure_debug_log, debug_log
+from rag.knn_graph import attach_knn_graph
+from rag.product_facts import attach_product_facts
+from rag.registry_index import attach_registry_index
+from rag.retrieval_cache import configure_retrieval_cache
+from rag.session import ConversationSession
+from rag.answer_cache import AnswerCache
 
 BASE_DIR = Path(__file__).resolve().parent
 QUESTIONS_TXT = BASE_DIR / "questions.txt"
-CSV_PATH = "rag_logs.csv"
+KB_NPZ = "01012026-data-kd-1-4-chuan-fix-brand.npz"
 
 def iter_questions(txt_path: str):
     """
@@ -33,17 +39,43 @@ def iter_questions(txt_path: str):
         yield q
 
 
+def make_answer_cache(cfg):
+    if not cfg.use_answer_cache:
+        return None
+    return AnswerCache(
+        max_entries=cfg.answer_cache_max_entries,
+        semantic_threshold=cfg.answer_cache_semantic_threshold,
+        path=cfg.answer_cache_path,
+    ).load()
+
+
+def save_answer_cache(answer_cache):
+    if answer_cache is None:
+        return
+    answer_cache.save()
+    print("Answer cache:", answer_cache.stats())
+
+
 def run_batch_questions():
     # 1) đọc query từ CLI
 
     # 2) init OpenAI client (đặt key theo env là tốt nhất)
-    client = OpenAI(api_key="...")
+    client = make_client(api_key="...")
 
     # 3) load KB (1 lần)
     # kb = load_npz("data-kd-nam-benh-full-fix-noise.npz")
-    kb = load_npz("01012026-data-kd-1-4-chuan-fix-brand.npz")
+    kb = load_npz(KB_NPZ)
+    # kNN graph / product facts / registry index build sẵn bằng run/build_indexes.py (không có -> build khi cần)
+    attach_knn_graph(kb, KB_NPZ)
+    attach_product_facts(kb, KB_NPZ)
+    attach_registry_index(kb, KB_NPZ)
 
     cfg = RAGConfig()
+    configure_debug_log(cfg)
+    configure_retrieval_cache(cfg)
+    answer_cache = make_answer_cache(cfg)
+    stop_metrics = start_metrics(cfg)
+    query_log = QueryLog.from_config(cfg)
 
     for i, q in enumerate(iter_questions(QUESTIONS_TXT), start=1):
         debug_log(f"[{i}] Q: {q}")
@@ -54,32 +86,43 @@ def run_batch_questions():
             client=client,
             cfg=cfg,
             retrieval_policy=policy,
+            answer_cache=answer_cache,
         )
 
-        append_log_to_csv(
-            csv_path=CSV_PATH,
-            user_query=q,
-            norm_query=res.get("norm_query", ""),
-            strategy=res.get("strategy", ""),
-            prof=res.get("profile", {}) or {},
-            res=res,
-            route=res.get("route", "RAG"),
-        )
+        if query_log is not None:
+            query_log.append(q, res)
 
-    print(f"\nHoàn tất. Log đã ghi vào: {CSV_PATH}")
+    save_answer_cache(answer_cache)
+    print("LLM calls:", llm_stats())
+    if stop_metrics is not None:
+        stop_metrics()
+    if query_log is not None:
+        query_log.close()
+        print(f"\nHoàn tất. Log đã ghi vào: {cfg.query_log_dir}/")
 
 def main():
     # 1) đọc query từ CLI
 
     # 2) init OpenAI client (đặt key theo env là tốt nhất)
-    client = OpenAI(api_key="...")
+    client = make_client(api_key="...")
 
     # 3) load KB (1 lần)
     # kb = load_npz("data-kd-nam-benh-full-fix-noise.npz")
-    kb = load_npz("01012026-data-kd-1-4-chuan-fix-brand.npz")
+    kb = load_npz(KB_NPZ)
+    # kNN graph / product facts / registry index build sẵn bằng run/build_indexes.py (không có -> build khi cần)
+    attach_knn_graph(kb, KB_NPZ)
+    attach_product_facts(kb, KB_NPZ)
+    attach_registry_index(kb, KB_NPZ)
 
 
     cfg = RAGConfig()
+    configure_debug_log(cfg)
+    configure_retrieval_cache(cfg)
+    # 1 hội thoại CLI = 1 session (câu hỏi nối tiếp re-rank trong pool câu trước)
+    session = ConversationSession(session_id="cli")
+    answer_cache = make_answer_cache(cfg)
+    stop_metrics = start_metrics(cfg)
+    query_log = QueryLog.from_config(cfg)
 
     # q = input("Query: ").strip(
     # res = answer_with_suggestions(
@@ -89,22 +132,11 @@ def main():
     #     cfg=cfg,
     #     policy=policy,
     # )
-    # # 5) log CSV
-    # csv_path = "rag_logs.csv"
-    # append_log_to_csv(
-    #     csv_path=csv_path,
-    #     user_query=q,
-    #     norm_query=res.get("norm_query", ""),
-    #     strategy=res.get("strategy", ""),
-    #     prof=res.get("profile", {}) or {},
-    #     res=res,
-    #     route=res.get("route", "RAG"),
-    #     # bạn có thể thêm policy_version nếu có
-    # )
+    # # 5) log query (JSONL)
+    # query_log.append(q, res)
     # # 6) in kết quả
     # print("\n===== KẾT QUẢ =====\n")
     # print(res["text"])
-    # print("\nSaved log to:", csv_path)
 
     while True:
         try:
@@ -118,33 +150,45 @@ def main():
             print("KeyboardInterrupt.")
             break
         try:            
-            res = answer_with_suggestions(
+            # 6) in kết quả ngay khi model sinh token
+            print("\n===== KẾT QUẢ =====\n")
+            res = {}
+            for ev in stream_answer_with_suggestions(
                 user_query=q,
                 kb=kb,
                 client=client,
                 cfg=cfg,
                 retrieval_policy=policy,
+                session=session,
+                answer_cache=answer_cache,
+            ):
+                if ev["type"] == "delta":
+                    print(ev["text"], end="", flush=True)
+                elif ev["type"] == "reset":
+                    print("\n\n----- (đang soạn lại câu trả lời đầy đủ hơn) -----\n", flush=True)
+                else:
+                    res = ev["result"]
+            print()
+            # 5) log query (JSONL, ghi nền)
+            if query_log is not None:
+                query_log.append(q, res)
+            lat = res.get("latency", {})
+            usage = res.get("usage") or {}
+            print(
+                f"\n[ttft={lat.get('ttft_ms')} ms | total={lat.get('total_ms')} ms"
+                f" | cached={usage.get('cached_tokens', 0)}/{usage.get('prompt_tokens', 0)} tok]"
             )
-            # 5) log CSV
-            csv_path = "rag_logs.csv"
-            append_log_to_csv(
-                csv_path=csv_path,
-                user_query=q,
-                norm_query=res.get("norm_query", ""),
-                strategy=res.get("strategy", ""),
-                prof=res.get("profile", {}) or {},
-                res=res,
-                route=res.get("route", "RAG"),
-                # bạn có thể thêm policy_version nếu có
-            )
-            # 6) in kết quả
-            print("\n===== KẾT QUẢ =====\n")
-            print(res["text"])
-            print("\nSaved log to:", csv_path)
         except Exception as e:
             print("Unhandled exception in loop: ", e)
             continue
 
+    save_answer_cache(answer_cache)
+    print("LLM calls:", llm_stats())
+    if stop_metrics is not None:
+        stop_metrics()
+    if query_log is not None:
+        query_log.close()
+
 if __name__ == "__main__":
     # Test nhiều câu hỏi
     # run_batch_questions()
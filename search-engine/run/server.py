@@ -0,0 +1,477 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from rag.config import RAGConfig
+from rag.debug_log import configure_debug_log, debug_log, flush_debug_log
+from rag.kb_loader import load_npz
+from rag.knn_graph import attach_knn_graph
+from rag.llm import llm_stats, make_client
+from rag.metrics import METRICS, start_metrics
+from rag.pipeline import answer_with_suggestions, stream_answer_with_suggestions
+from rag.product_facts import attach_product_facts
+from rag.query_log import QueryLog
+from rag.registry_index import attach_registry_index
+from rag.retrieval_cache import configure_retrieval_cache
+from rag.session import SessionStore
+from run.fake_openai import FakeBackend
+from run.main import KB_NPZ, make_answer_cache, save_answer_cache
+from policies.v7_policy import PolicyV7 as policy
+
+# ======================
+# HTTP SERVER (asyncio, stdlib)
+#   - Load KB + sidecar 1 lần, dùng chung client (httpx pool), answer cache, session store
+#   - Event loop chỉ lo I/O; pipeline (NumPy + gọi LLM đồng bộ) chạy trong thread pool
+#     server_max_concurrency worker; hàng chờ > server_max_queue -> 503 (Retry-After)
+#   - Slot (và khoá session) chỉ trả lại khi thread pipeline xong thật, kể cả sau 504
+#     -> executor không bao giờ có việc xếp hàng ngoài server_max_queue
+#   - Cùng session_id -> chạy lần lượt; request chờ khoá session chưa giữ slot worker
+#   - POST /answer {"query", "session_id"?, "budget_ms"?, "stream"?}
+#       stream=true -> NDJSON chunked: {"type": "delta"|"reset"|"final", ...}
+#   - GET /healthz (process sống) · GET /readyz (KB đã load, chưa drain, cache bật/tắt) · GET /metrics
+#   - --no_cache: tắt answer cache + retrieval cache (load test đo pipeline, không đo cache hit)
+#   - --fake: FakeBackend (run/fake_openai.py) thay OpenAI + KB npz -> load test offline
+#   - SIGINT/SIGTERM: readyz -> 503, ngừng nhận kết nối, chờ request đang chạy (server_shutdown_grace_s),
+#     rồi lưu answer cache / đóng query log / flush debug log
+# ======================
+
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+KEEP_RESULT_KEYS = (
+    "text", "route", "strategy", "norm_query", "img_keys", "suggestions", "listing",
+    "cache", "usage", "budget", "escalated", "follow_up", "timings", "latency",
+)
+
+
+def _json_default(o):
+    # numpy scalar / array trong profile, score...
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    return str(o)
+
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+
+def public_result(res: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: res[k] for k in KEEP_RESULT_KEYS if k in res}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class _SessionLock:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0  # request đang giữ + đang chờ khoá
+
+
+class RAGServer:
+    def __init__(self, cfg: RAGConfig, npz_path: str, api_key: Optional[str] = None,
+                 fake: Optional[FakeBackend] = None):
+        self.cfg = cfg
+        self.npz_path = npz_path
+        self.api_key = api_key
+        self.fake = fake
+        self.kb = None
+        self.client = None
+        self.answer_cache = None
+        self.query_log = None
+        self.stop_metrics = None
+        self.sessions = SessionStore()
+        self.session_locks: Dict[str, _SessionLock] = {}
+        self.executor = ThreadPoolExecutor(max_workers=cfg.server_max_concurrency, thread_name_prefix="rag-req")
+        self.slots = asyncio.Semaphore(cfg.server_max_concurrency)
+        self.waiting = 0
+        self.inflight = 0
+        self.ready = False
+        self.draining = False
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections = set()
+        self.idle_event = asyncio.Event()
+        self.idle_event.set()
+        self.stopped = asyncio.Event()
+
+    # ---------- lifecycle ----------
+
+    def load(self) -> None:
+        if self.fake is not None:
+            # KB giả không có sidecar -> index build khi cần
+            self.client = self.fake.make_client()
+            kb = self.fake.load_kb()
+        else:
+            self.client = make_client(api_key=self.api_key, cfg=self.cfg)
+            kb = load_npz(self.npz_path)
+            attach_knn_graph(kb, self.npz_path)
+            attach_product_facts(kb, self.npz_path)
+            attach_registry_index(kb, self.npz_path)
+        self.kb = kb
+        self.answer_cache = make_answer_cache(self.cfg)
+        self.query_log = QueryLog.from_config(self.cfg)
+        self.stop_metrics = start_metrics(self.cfg)
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        # load KB có thể mất vài giây -> ngoài event loop (healthz vẫn trả lời)
+        self.server = await asyncio.start_server(self.handle_connection, self.cfg.server_host, self.cfg.server_port)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda: asyncio.ensure_future(self.shutdown()))
+            except NotImplementedError:  # Windows
+                pass
+        print(f"Listening on http://{self.cfg.server_host}:{self.cfg.server_port} (loading KB...)")
+        await loop.run_in_executor(self.executor, self.load)
+        self.ready = True
+        kb_name = f"fake ({self.fake.csv_path})" if self.fake is not None else self.npz_path
+        print(f"Ready: KB {kb_name} | workers={self.cfg.server_max_concurrency} | caches={self.cache_state()}")
+
+    def cache_state(self) -> Dict[str, bool]:
+        return {"answer": self.answer_cache is not None, "retrieval": bool(self.cfg.use_retrieval_cache)}
+
+    async def shutdown(self) -> None:
+        if self.draining:
+            return
+        self.draining = True
+        self.ready = False
+        print("Shutting down: draining in-flight requests...")
+        if self.server is not None:
+            self.server.close()
+        try:
+            await asyncio.wait_for(self.idle_event.wait(), timeout=self.cfg.server_shutdown_grace_s)
+        except asyncio.TimeoutError:
+            print(f"Grace period over, {self.inflight} request(s) still running")
+        for task in list(self.connections):
+            task.cancel()  # kết nối keep-alive đang rảnh
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        save_answer_cache(self.answer_cache)
+        if self.query_log is not None:
+            self.query_log.close()
+        if self.stop_metrics is not None:
+            self.stop_metrics()
+        print("LLM calls:", llm_stats())
+        flush_debug_log()
+        self.stopped.set()
+
+    # ---------- HTTP ----------
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None  # client đóng kết nối
+        except asyncio.LimitOverrunError:
+            raise HttpError(400, "headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "bad request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        headers[":version"] = version
+        length = int(headers.get("content-length", "0") or 0)
+        if length > self.cfg.server_max_body_bytes:
+            raise HttpError(413, "body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    @staticmethod
+    def write_response(writer, status: int, body: bytes, content_type: str = "application/json",
+                       keep_alive: bool = True, headers: Optional[Dict[str, str]] = None) -> None:
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                try:
+                    req = await self.read_request(reader)
+                except HttpError as e:
+                    self.write_response(writer, e.status, _dumps({"error": str(e)}), keep_alive=False)
+                    break
+                if req is None:
+                    break
+                method, path, headers, body = req
+                keep_alive = (
+                    not self.draining
+                    and headers.get("connection", "").lower() != "close"
+                    and headers[":version"] != "HTTP/1.0"
+                )
+                self.connections.discard(task)  # đang xử lý -> shutdown không huỷ
+                try:
+                    await self.dispatch(method, path, body, writer, keep_alive)
+                except HttpError as e:
+                    self.write_response(writer, e.status, _dumps({"error": str(e)}), keep_alive=keep_alive, headers=e.headers)
+                except Exception as e:
+                    debug_log("=== SERVER ERROR ===", repr(e))
+                    self.write_response(writer, 500, _dumps({"error": type(e).__name__}), keep_alive=False)
+                    keep_alive = False
+                finally:
+                    self.connections.add(task)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, body: bytes, writer, keep_alive: bool) -> None:
+        if path == "/healthz":
+            self.write_response(writer, 200, _dumps({"status": "ok"}), keep_alive=keep_alive)
+        elif path == "/readyz":
+            status = 200 if self.ready else 503
+            state = {"ready": self.ready, "draining": self.draining, "inflight": self.inflight, "waiting": self.waiting,
+                     "workers": self.cfg.server_max_concurrency, "caches": self.cache_state(),
+                     "fake": self.fake.describe() if self.fake is not None else None}
+            self.write_response(writer, status, _dumps(state), keep_alive=keep_alive)
+        elif path == "/metrics":
+            self.write_response(writer, 200, METRICS.render().encode("utf-8"),
+                                content_type="text/plain; version=0.0.4; charset=utf-8", keep_alive=keep_alive)
+        elif path == "/answer":
+            if method != "POST":
+                raise HttpError(405, "POST only")
+            await self.handle_answer(body, writer, keep_alive)
+        else:
+            raise HttpError(404, "not found")
+
+    # ---------- /answer ----------
+
+    def parse_answer_request(self, body: bytes) -> Dict[str, Any]:
+        try:
+            payload = json.loads(body.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise HttpError(400, "invalid JSON")
+        query = str(payload.get("query", "")).strip()
+        if not query:
+            raise HttpError(400, "missing query")
+        return {
+            "query": query,
+            "session_id": payload.get("session_id"),
+            "budget_ms": payload.get("budget_ms"),
+            "stream": bool(payload.get("stream", False)),
+        }
+
+    def pipeline_kwargs(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        session = None
+        if req["session_id"] and self.cfg.use_session_cache:
+            session = self.sessions.get(str(req["session_id"]))
+        return dict(
+            user_query=req["query"],
+            kb=self.kb,
+            client=self.client,
+            cfg=self.cfg,
+            retrieval_policy=policy,
+            session=session,
+            answer_cache=self.answer_cache,
+            budget_ms=req["budget_ms"],
+        )
+
+    async def acquire_slot(self) -> None:
+        if not self.ready:
+            raise HttpError(503, "not ready", {"Retry-After": "1"})
+        if self.slots.locked() and self.waiting >= self.cfg.server_max_queue:
+            raise HttpError(503, "overloaded", {"Retry-After": "1"})
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        self.idle_event.clear()
+
+    def release_slot(self) -> None:
+        self.slots.release()
+        self.inflight -= 1
+        if self.inflight == 0:
+            self.idle_event.set()
+
+    async def lock_session(self, session_id) -> None:
+        # 2 request cùng session -> chạy lần lượt (session pool không thread-safe).
+        # Đếm cả request đang chờ: chỉ bỏ khoá khỏi dict khi không còn ai giữ / chờ.
+        if not session_id:
+            return
+        entry = self.session_locks.get(session_id)
+        if entry is None:
+            entry = self.session_locks[session_id] = _SessionLock()
+        entry.refs += 1
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self._drop_session_ref(session_id, entry)
+            raise
+
+    def unlock_session(self, session_id) -> None:
+        if not session_id:
+            return
+        entry = self.session_locks[session_id]
+        entry.lock.release()
+        self._drop_session_ref(session_id, entry)
+
+    def _drop_session_ref(self, session_id, entry: _SessionLock) -> None:
+        entry.refs -= 1
+        if entry.refs == 0 and self.session_locks.get(session_id) is entry:
+            del self.session_locks[session_id]
+
+    def finish_when_done(self, work, session_id) -> None:
+        """
+        Trả slot + khoá session khi việc cuối cùng của request trong executor xong.
+        504: thread pipeline vẫn chạy -> giữ slot tới lúc đó (add_done_callback), không để
+        request mới dồn vào hàng đợi không giới hạn của executor.
+        """
+        def finish():
+            self.release_slot()
+            self.unlock_session(session_id)
+
+        if work is None or work.done():
+            finish()
+            return
+        loop = asyncio.get_running_loop()
+        work.add_done_callback(lambda _: loop.call_soon_threadsafe(finish))
+
+    async def run_in_worker(self, job: Dict[str, Any], fn, *args, timeout: float):
+        """
+        fn(*args) trong executor; job["work"] = concurrent Future mới nhất của request.
+        """
+        work = self.executor.submit(fn, *args)
+        job["work"] = work
+        return await asyncio.wait_for(asyncio.wrap_future(work), timeout=timeout)
+
+    async def handle_answer(self, body: bytes, writer, keep_alive: bool) -> None:
+        req = self.parse_answer_request(body)
+        session_id = req["session_id"]
+        # khoá session trước slot: request chờ câu trước cùng session không chiếm worker
+        await self.lock_session(session_id)
+        try:
+            await self.acquire_slot()
+        except BaseException:
+            self.unlock_session(session_id)
+            raise
+        job: Dict[str, Any] = {"work": None}
+        try:
+            if req["stream"]:
+                await self.stream_answer(req, writer, job)
+            else:
+                res = await self.run_answer(req, job)
+                self.write_response(writer, 200, _dumps(public_result(res)), keep_alive=keep_alive)
+        finally:
+            self.finish_when_done(job["work"], session_id)
+
+    async def run_answer(self, req: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        try:
+            res = await self.run_in_worker(
+                job,
+                lambda: answer_with_suggestions(**self.pipeline_kwargs(req)),
+                timeout=self.cfg.server_request_timeout_s,
+            )
+        except asyncio.TimeoutError:
+            raise HttpError(504, "pipeline timeout")
+        res["latency"] = {"total_ms": round((time.perf_counter() - t0) * 1000, 1), "streamed": False}
+        if self.query_log is not None:
+            self.query_log.append(req["query"], res)
+        return res
+
+    async def stream_answer(self, req: Dict[str, Any], writer, job: Dict[str, Any]) -> None:
+        """
+        NDJSON qua chunked transfer; mỗi event = 1 dòng JSON (delta / reset / final).
+        Stream luôn đóng kết nối sau final (đơn giản hoá phía client).
+        """
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+        )
+        gen = stream_answer_with_suggestions(**self.pipeline_kwargs(req))
+        deadline = time.monotonic() + self.cfg.server_request_timeout_s
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    ev = await self.run_in_worker(job, next, gen, None, timeout=max(remaining, 0.001))
+                except asyncio.TimeoutError:
+                    ev = {"type": "error", "error": "pipeline timeout"}
+                if ev is None:
+                    break
+                if ev["type"] == "final":
+                    res = ev["result"]
+                    if self.query_log is not None:
+                        self.query_log.append(req["query"], res)
+                    ev = {"type": "final", "result": public_result(res)}
+                chunk = _dumps(ev) + b"\n"
+                writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+                await writer.drain()
+                if ev["type"] in ("final", "error"):
+                    break
+        finally:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+
+async def serve(cfg: RAGConfig, npz_path: str, api_key: Optional[str], fake: Optional[FakeBackend] = None) -> None:
+    app = RAGServer(cfg, npz_path, api_key, fake=fake)
+    await app.start()
+    await app.stopped.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="HTTP server cho RAG pipeline (asyncio, stdlib)")
+    ap.add_argument("--npz", default=KB_NPZ)
+    ap.add_argument("--host", default=RAGConfig.server_host)
+    ap.add_argument("--port", type=int, default=RAGConfig.server_port)
+    ap.add_argument("--workers", type=int, default=RAGConfig.server_max_concurrency, help="Số request pipeline chạy đồng thời")
+    ap.add_argument("--no_cache", action="store_true", help="Tắt answer cache + retrieval cache")
+    ap.add_argument("--fake", action="store_true", help="Fake OpenAI + KB từ CSV (load test offline)")
+    ap.add_argument("--fake_csv", default=FakeBackend.csv_path)
+    ap.add_argument("--fake_ttft_ms", type=float, default=FakeBackend.ttft_ms)
+    ap.add_argument("--fake_tokens_per_s", type=float, default=FakeBackend.tokens_per_s)
+    ap.add_argument("--fake_answer_tokens", type=int, default=FakeBackend.answer_tokens)
+    ap.add_argument("--fake_embed_ms", type=float, default=FakeBackend.embed_ms)
+    args = ap.parse_args()
+
+    overrides = {}
+    if args.no_cache:
+        overrides.update(use_answer_cache=False, use_retrieval_cache=False)
+    cfg = RAGConfig(server_host=args.host, server_port=args.port, server_max_concurrency=args.workers, **overrides)
+    fake = None
+    if args.fake:
+        fake = FakeBackend(
+            csv_path=args.fake_csv,
+            ttft_ms=args.fake_ttft_ms,
+            tokens_per_s=args.fake_tokens_per_s,
+            answer_tokens=args.fake_answer_tokens,
+            embed_ms=args.fake_embed_ms,
+        )
+    configure_debug_log(cfg)
+    configure_retrieval_cache(cfg)
+    asyncio.run(serve(cfg, args.npz, os.environ.get("OPENAI_API_KEY", "..."), fake=fake))
+
+
+if __name__ == "__main__":
+    main()
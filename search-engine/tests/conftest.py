@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# chạy được cả `pytest` từ search-engine/ lẫn từ thư mục gốc repo
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
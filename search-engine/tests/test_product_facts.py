@@ -0,0 +1,42 @@
+import numpy as np
+
+from rag.product_facts import lookup_product_facts
+
+
+def _kb():
+    answers = [
+        "Tecvil 50SC. Hoạt chất: Hexaconazole 50g/l. Thời gian cách ly: 7 ngày. "
+        "Pha 15-20 ml cho bình 16 lít.",
+    ]
+    n = len(answers)
+    return (
+        np.zeros((n, 4), dtype=np.float32),
+        np.array(["Tecvil là gì?"], dtype=object),
+        np.array(answers, dtype=object),
+        np.array([""] * n, dtype=object),
+        np.array([""] * n, dtype=object),
+        np.array([""] * n, dtype=object),
+        np.array(["san_pham_tecvil_01"], dtype=object),
+        np.array(['["product:tecvil", "crop:lua"]'], dtype=object),
+        np.array(["product"], dtype=object),
+    )
+
+
+def test_dosage_without_target_uses_fact_store():
+    facts = lookup_product_facts(_kb(), "Liều dùng Tecvil?", ["product:tecvil"])
+    assert facts is not None
+    assert facts["products"][0][1]["per_tank_ml_range"] == ["15", "20"]
+
+
+def test_dosage_or_phi_with_crop_pest_or_disease_falls_back_to_rag():
+    kb = _kb()
+    assert lookup_product_facts(kb, "Liều dùng Tecvil trên sầu riêng?", ["product:tecvil", "crop:durian"]) is None
+    assert lookup_product_facts(kb, "Tecvil trị rầy nâu pha bao nhiêu?", ["product:tecvil", "pest:ray-nau"]) is None
+    assert lookup_product_facts(kb, "Thời gian cách ly Tecvil khi trị thán thư?",
+                                ["product:tecvil", "disease:anthracnose"]) is None
+
+
+def test_active_ingredient_is_crop_independent():
+    facts = lookup_product_facts(_kb(), "Hoạt chất của Tecvil trên lúa là gì?", ["product:tecvil", "crop:lua"])
+    assert facts is not None
+    assert facts["products"][0][1]["active"].startswith("Hexaconazole")
@@ -0,0 +1,44 @@
+import numpy as np
+
+from rag.mmr import mmr_select
+from rag.scoring import fused_score, rank_key
+
+
+def _hit(hid, score, idx=0, **kw):
+    return {"id": hid, "idx": idx, "score": score, **kw}
+
+
+def test_llm_scored_hits_rank_above_unscored():
+    hits = [
+        _hit("unscored_high", 0.90),                      # ngoài top_k_rerank / batch trễ
+        _hit("llm_mid", 0.60, llm_rerank_score=0.5),      # fused = 0.53
+        _hit("llm_zero", 0.80, llm_rerank_score=0.0),     # 0 là điểm thật
+        _hit("unscored_low", 0.40),
+    ]
+    assert fused_score(hits[0]) > fused_score(hits[1])    # khác thang đo: so trực tiếp là sai
+
+    ranked = [h["id"] for h in sorted(hits, key=rank_key, reverse=True)]
+    assert ranked == ["llm_mid", "llm_zero", "unscored_high", "unscored_low"]
+
+
+def test_local_rerank_tier_between_llm_and_embedding():
+    hits = [
+        _hit("emb_only", 0.95),
+        _hit("local", 0.30, rerank_score=0.2),
+        _hit("llm", 0.10, llm_rerank_score=0.1, rerank_score=0.9),
+    ]
+    ranked = [h["id"] for h in sorted(hits, key=rank_key, reverse=True)]
+    assert ranked == ["llm", "local", "emb_only"]
+
+
+def test_mmr_prefers_scored_hits_over_unscored():
+    embs = np.eye(4, dtype=np.float32)  # 4 doc trực giao -> không doc nào bị coi là trùng
+    kb = (embs, None, None, None, None, None, np.array(["a", "b", "c", "d"], dtype=object))
+    primary = _hit("a", 0.7, idx=0, llm_rerank_score=0.9)
+    scored = _hit("b", 0.6, idx=1, llm_rerank_score=0.5)
+    unscored = _hit("c", 0.95, idx=2)
+    for h in (primary, scored, unscored):
+        h["fused_score"] = fused_score(h)
+
+    picked = mmr_select(kb, primary, [primary, unscored, scored], k=2)
+    assert [h["id"] for h in picked] == ["a", "b"]